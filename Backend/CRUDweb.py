@@ -1,26 +1,18 @@
+import atexit
 import json
 import gradio as gr
 import pandas as pd
-import datetime
-from typing import Dict, Any
+from catalogImport import PREVIEW_COLUMNS, apply_plan, diff_sheet, plan_summary, read_sheet
+from catalogStore import CatalogStore, default_db_path
 
 # File paths
 DATA_PATH = "/Users/alessiacolumban/TAL_Chatbot/DataPrep/converters_with_links_and_pricelist.json"
 META_PATH = "/Users/alessiacolumban/TAL_Chatbot/DataPrep/converters_metadata.json"
 
-def load_json(path) -> Dict[str, Any]:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-
-def save_json(data: Dict[str, Any], path):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-
-def get_current_time():
-    return datetime.datetime.now().isoformat()
+# Edits are appended to a journal; the JSON files are checkpointed a few seconds after the last edit
+store = CatalogStore(default_db_path(DATA_PATH), DATA_PATH, META_PATH)
+store.start_exporter()
+atexit.register(store.flush)
 
 def add_converter(
     converter_id, converter_type, artnr, description, strain_relief, location, dimmability,
@@ -28,42 +20,32 @@ def add_converter(
     price, unit, lifecycle, pdf_link
 ):
     converter_id = converter_id.strip()
-    data = load_json(DATA_PATH)
-    meta = load_json(META_PATH)
-    if converter_id in data:
-        return f"Converter '{converter_id}' already exists."
-    info = {}
-    if converter_type: info["TYPE"] = converter_type
-    if artnr: info["ARTNR"] = float(artnr)
-    if description: info["CONVERTER DESCRIPTION:"] = description
-    if strain_relief: info["STRAIN RELIEF"] = strain_relief
-    if location: info["LOCATION"] = location
-    if dimmability: info["DIMMABILITY"] = dimmability
-    if ccr: info["CCR (AMPLITUDE)"] = ccr
-    if size: info["SIZE: L*B*H (mm)"] = size
-    if efficiency: info["EFFICIENCY @full load"] = float(efficiency)
-    if ip: info["IP"] = float(ip)
-    if class_: info["CLASS"] = float(class_)
-    if input_voltage: info["NOM. INPUT VOLTAGE (V)"] = input_voltage
-    if output_voltage: info["OUTPUT VOLTAGE (V)"] = output_voltage
-    if barcode: info["Barcode"] = barcode
-    if name: info["Name"] = name
-    if price: info["Listprice"] = float(price)
-    if unit: info["Unit"] = unit
-    if lifecycle: info["LifeCycle"] = lifecycle
-    if pdf_link: info["pdf_link"] = pdf_link
-    info["lamps"] = {}
-    data[converter_id] = info
-
-    now = get_current_time()
-    meta[converter_id] = {
-        "created_at": now,
-        "updated_at": now,
-        "deleted_at": None,
-        "price_history": [{"timestamp": now, "price": float(price)}] if price else []
-    }
-    save_json(data, DATA_PATH)
-    save_json(meta, META_PATH)
+    with store.transaction():
+        if store.has_converter(converter_id):
+            return f"Converter '{converter_id}' already exists."
+        info = {}
+        if converter_type: info["TYPE"] = converter_type
+        if artnr: info["ARTNR"] = float(artnr)
+        if description: info["CONVERTER DESCRIPTION:"] = description
+        if strain_relief: info["STRAIN RELIEF"] = strain_relief
+        if location: info["LOCATION"] = location
+        if dimmability: info["DIMMABILITY"] = dimmability
+        if ccr: info["CCR (AMPLITUDE)"] = ccr
+        if size: info["SIZE: L*B*H (mm)"] = size
+        if efficiency: info["EFFICIENCY @full load"] = float(efficiency)
+        if ip: info["IP"] = float(ip)
+        if class_: info["CLASS"] = float(class_)
+        if input_voltage: info["NOM. INPUT VOLTAGE (V)"] = input_voltage
+        if output_voltage: info["OUTPUT VOLTAGE (V)"] = output_voltage
+        if barcode: info["Barcode"] = barcode
+        if name: info["Name"] = name
+        if price: info["Listprice"] = float(price)
+        if unit: info["Unit"] = unit
+        if lifecycle: info["LifeCycle"] = lifecycle
+        if pdf_link: info["pdf_link"] = pdf_link
+        info["lamps"] = {}
+        # Created/updated times and the first price history entry come from the journal entry
+        store.add_converter(converter_id, info, price=float(price) if price else None)
     return f"Added converter '{converter_id}'."
 
 def update_converter(
@@ -72,168 +54,136 @@ def update_converter(
     price, unit, lifecycle, pdf_link
 ):
     converter_id = converter_id.strip()
-    data = load_json(DATA_PATH)
-    meta = load_json(META_PATH)
-    if converter_id not in data:
-        return f"Converter '{converter_id}' does not exist."
-    info = data[converter_id]
-    now = get_current_time()
-    # Update fields if provided
-    if converter_type: info["TYPE"] = converter_type
-    if artnr: info["ARTNR"] = float(artnr)
-    if description: info["CONVERTER DESCRIPTION:"] = description
-    if strain_relief: info["STRAIN RELIEF"] = strain_relief
-    if location: info["LOCATION"] = location
-    if dimmability: info["DIMMABILITY"] = dimmability
-    if ccr: info["CCR (AMPLITUDE)"] = ccr
-    if size: info["SIZE: L*B*H (mm)"] = size
-    if efficiency: info["EFFICIENCY @full load"] = float(efficiency)
-    if ip: info["IP"] = float(ip)
-    if class_: info["CLASS"] = float(class_)
-    if input_voltage: info["NOM. INPUT VOLTAGE (V)"] = input_voltage
-    if output_voltage: info["OUTPUT VOLTAGE (V)"] = output_voltage
-    if barcode: info["Barcode"] = barcode
-    if name: info["Name"] = name
-    if price:
-        price = float(price)
-        if "Listprice" not in info or price != info.get("Listprice"):
-            if converter_id not in meta:
-                meta[converter_id] = {
-                    "created_at": now,
-                    "updated_at": now,
-                    "deleted_at": None,
-                    "price_history": []
-                }
-            if "price_history" not in meta[converter_id]:
-                meta[converter_id]["price_history"] = []
-            meta[converter_id]["price_history"].append({"timestamp": now, "price": price})
-        info["Listprice"] = price
-    if unit: info["Unit"] = unit
-    if lifecycle: info["LifeCycle"] = lifecycle
-    if pdf_link: info["pdf_link"] = pdf_link
-
-    # Update metadata
-    if converter_id not in meta:
-        meta[converter_id] = {
-            "created_at": now,
-            "updated_at": now,
-            "deleted_at": None,
-            "price_history": []
-        }
-    meta[converter_id]["updated_at"] = now
+    with store.transaction():
+        info = store.get_converter(converter_id)
+        if info is None:
+            return f"Converter '{converter_id}' does not exist."
+        # Update fields if provided
+        fields = {}
+        if converter_type: fields["TYPE"] = converter_type
+        if artnr: fields["ARTNR"] = float(artnr)
+        if description: fields["CONVERTER DESCRIPTION:"] = description
+        if strain_relief: fields["STRAIN RELIEF"] = strain_relief
+        if location: fields["LOCATION"] = location
+        if dimmability: fields["DIMMABILITY"] = dimmability
+        if ccr: fields["CCR (AMPLITUDE)"] = ccr
+        if size: fields["SIZE: L*B*H (mm)"] = size
+        if efficiency: fields["EFFICIENCY @full load"] = float(efficiency)
+        if ip: fields["IP"] = float(ip)
+        if class_: fields["CLASS"] = float(class_)
+        if input_voltage: fields["NOM. INPUT VOLTAGE (V)"] = input_voltage
+        if output_voltage: fields["OUTPUT VOLTAGE (V)"] = output_voltage
+        if barcode: fields["Barcode"] = barcode
+        if name: fields["Name"] = name
+        if unit: fields["Unit"] = unit
+        if lifecycle: fields["LifeCycle"] = lifecycle
+        if pdf_link: fields["pdf_link"] = pdf_link
+        store.update_converter(converter_id, fields)
+        if price:
+            price = float(price)
+            if "Listprice" not in info or price != info.get("Listprice"):
+                store.change_price(converter_id, price)
+        info.update(fields)
 
-    # Compute new id
-    new_type = info["TYPE"]
-    new_artnr = int(info["ARTNR"])
-    new_id = f"{new_type}mA - {new_artnr}"
+        # Compute new id
+        new_type = info["TYPE"]
+        new_artnr = int(info["ARTNR"])
+        new_id = f"{new_type}mA - {new_artnr}"
 
-    if new_id != converter_id:
-        data[new_id] = info
-        meta[new_id] = meta.pop(converter_id)
-        del data[converter_id]
-        save_json(data, DATA_PATH)
-        save_json(meta, META_PATH)
-        return f"Updated converter. ID changed to '{new_id}'."
-    else:
-        data[converter_id] = info
-        save_json(data, DATA_PATH)
-        save_json(meta, META_PATH)
-        return f"Updated converter '{converter_id}'."
+        if new_id != converter_id:
+            store.rename_converter(converter_id, new_id)
+            return f"Updated converter. ID changed to '{new_id}'."
+    return f"Updated converter '{converter_id}'."
 
 def delete_converter(converter_id):
     converter_id = converter_id.strip()
-    data = load_json(DATA_PATH)
-    meta = load_json(META_PATH)
-    if converter_id not in data:
-        return f"Converter '{converter_id}' does not exist."
-    now = get_current_time()
-    if converter_id not in meta:
-        meta[converter_id] = {
-            "created_at": now,
-            "updated_at": now,
-            "deleted_at": now,
-            "price_history": []
-        }
-    else:
-        meta[converter_id]["deleted_at"] = now
-    del data[converter_id]  # <-- This line actually removes the entry
-    save_json(data, DATA_PATH)
-    save_json(meta, META_PATH)
+    with store.transaction():
+        if not store.has_converter(converter_id):
+            return f"Converter '{converter_id}' does not exist."
+        # Removes the entry; its metadata keeps the deletion time
+        store.delete_converter(converter_id)
     return f"Deleted converter '{converter_id}'."
 
 
 def add_or_update_lamp(converter_id, lamp_name, min_val, max_val):
     converter_id = converter_id.strip()
     lamp_name = lamp_name.strip()
-    data = load_json(DATA_PATH)
-    if converter_id not in data:
-        return f"Converter '{converter_id}' does not exist."
-    if "lamps" not in data[converter_id]:
-        data[converter_id]["lamps"] = {}
-    data[converter_id]["lamps"][lamp_name] = {"min": min_val, "max": max_val}
-    save_json(data, DATA_PATH)
+    with store.transaction():
+        if not store.has_converter(converter_id):
+            return f"Converter '{converter_id}' does not exist."
+        store.put_lamp(converter_id, lamp_name, {"min": min_val, "max": max_val})
     return f"Added/updated lamp '{lamp_name}' in converter '{converter_id}'."
 
 def delete_lamp(converter_id, lamp_name):
     converter_id = converter_id.strip()
     lamp_name = lamp_name.strip()
-    data = load_json(DATA_PATH)
-    if converter_id not in data:
-        return f"Converter '{converter_id}' does not exist."
-    lamps = data[converter_id].get("lamps", {})
-    if lamp_name not in lamps:
-        return f"Lamp '{lamp_name}' does not exist in converter '{converter_id}'."
-    del lamps[lamp_name]
-    save_json(data, DATA_PATH)
+    with store.transaction():
+        info = store.get_converter(converter_id)
+        if info is None:
+            return f"Converter '{converter_id}' does not exist."
+        if lamp_name not in info.get("lamps", {}):
+            return f"Lamp '{lamp_name}' does not exist in converter '{converter_id}'."
+        store.delete_lamp(converter_id, lamp_name)
     return f"Deleted lamp '{lamp_name}' from converter '{converter_id}'."
 
 def get_converter(converter_id):
     converter_id = converter_id.strip()
-    data = load_json(DATA_PATH)
-    return json.dumps(data.get(converter_id, {}), indent=2, ensure_ascii=False)
+    return json.dumps(store.get_converter(converter_id) or {}, indent=2, ensure_ascii=False)
 
 def filter_lamps(filter_type, n_latest):
-    data = load_json(DATA_PATH)
-    meta = load_json(META_PATH)
+    if filter_type == "Latest Added":
+        rows = store.listing(order_by="created_at", limit=n_latest, include_deleted=False)
+    elif filter_type == "Latest Updated":
+        rows = store.listing(order_by="updated_at", limit=n_latest, include_deleted=False)
+    elif filter_type == "Price Change":
+        rows = store.listing(price_changes=True)
+    else:
+        rows = store.listing()
     records = []
-    for cid, cinfo in data.items():
-        m = meta.get(cid, {})
-        created_at = m.get("created_at", "")
-        updated_at = m.get("updated_at", "")
-        deleted_at = m.get("deleted_at", None)
-        price_history = m.get("price_history", [])
-        price = cinfo.get("Listprice", "")
-        lamps = cinfo.get("lamps", {})
+    for row in rows:
+        m = row["meta"]
         record = {
-            "Converter ID": cid,
-            "Created At": created_at,
-            "Updated At": updated_at,
-            "Deleted At": deleted_at,
-            "Price": price,
-            "Lamps": ", ".join(lamps.keys())
+            "Converter ID": row["id"],
+            "Created At": m.get("created_at", ""),
+            "Updated At": m.get("updated_at", ""),
+            "Deleted At": m.get("deleted_at", None),
+            "Price": row["price"],
+            "Lamps": ", ".join(row["lamps"])
         }
-        if filter_type == "Show All":
-            records.append(record)
-        elif filter_type == "Latest Added":
-            if not deleted_at:
-                records.append(record)
-        elif filter_type == "Latest Updated":
-            if not deleted_at:
-                records.append(record)
-        elif filter_type == "Deleted":
-            if deleted_at:
-                records.append(record)
-        elif filter_type == "Price Change":
-            if len(price_history) > 1:
-                record["Price History"] = str(price_history)
-                records.append(record)
-    # Apply sorting and slicing only for the relevant filters
-    if filter_type == "Latest Added":
-        records = sorted(records, key=lambda x: x.get("Created At", ""), reverse=True)[:n_latest]
-    elif filter_type == "Latest Updated":
-        records = sorted(records, key=lambda x: x.get("Updated At", ""), reverse=True)[:n_latest]
+        if filter_type == "Price Change":
+            record["Price History"] = str(m.get("price_history", []))
+        records.append(record)
     return pd.DataFrame(records)
 
+def _read_import_sheet(file):
+    path = getattr(file, "name", file)
+    if not path:
+        raise ValueError("Upload a CSV or Excel sheet first.")
+    return read_sheet(path)
+
+def preview_import(file, remove_missing_lamps):
+    try:
+        sheet = _read_import_sheet(file)
+    except (ValueError, KeyError, OSError, ImportError) as e:
+        return f"Could not read the sheet: {str(e)}", pd.DataFrame(columns=PREVIEW_COLUMNS)
+    plan = diff_sheet(store.snapshot()[0], sheet, remove_missing_lamps)
+    return plan_summary(plan), plan["preview"]
+
+def apply_import(file, remove_missing_lamps):
+    # The diff is recomputed inside the transaction, so edits made since the preview are respected
+    try:
+        sheet = _read_import_sheet(file)
+    except (ValueError, KeyError, OSError, ImportError) as e:
+        return f"Could not read the sheet: {str(e)}"
+    with store.transaction():
+        plan = diff_sheet(store.snapshot()[0], sheet, remove_missing_lamps)
+        changed = apply_plan(store, plan)
+    return f"Applied to {changed} converters. {plan_summary(plan)}"
+
+def export_catalog():
+    store.checkpoint()
+    return f"Exported {DATA_PATH} and {META_PATH}."
+
 with gr.Blocks(title="TAL Converter JSON Editor") as demo:
     gr.Markdown("# TAL Converter JSON Editor")
 
@@ -394,5 +344,31 @@ with gr.Blocks(title="TAL Converter JSON Editor") as demo:
             outputs=lamp_table
         )
 
+    with gr.Tab("Bulk Import"):
+        gr.Markdown("Upload the converter matrix or a price list (CSV or Excel, same columns as in DataPrep), preview the changes and apply them in one go.")
+        import_file = gr.File(label="Matrix or price list", file_types=[".csv", ".xlsx", ".xls"])
+        remove_missing_lamps = gr.Checkbox(value=True, label="Remove lamps the matrix no longer lists for a converter")
+        preview_btn = gr.Button("Preview Changes")
+        import_summary = gr.Textbox(label="Summary")
+        import_preview = gr.DataFrame(label="Changes", interactive=False)
+        apply_btn = gr.Button("Apply Changes")
+        import_output = gr.Textbox(label="Result")
+        preview_btn.click(
+            preview_import,
+            inputs=[import_file, remove_missing_lamps],
+            outputs=[import_summary, import_preview]
+        )
+        apply_btn.click(
+            apply_import,
+            inputs=[import_file, remove_missing_lamps],
+            outputs=import_output
+        )
+
+    with gr.Tab("Export JSON"):
+        gr.Markdown("Edits are checkpointed to the JSON files a few seconds after the last change. Export now to write them immediately.")
+        export_btn = gr.Button("Export JSON")
+        export_output = gr.Textbox(label="Result")
+        export_btn.click(export_catalog, outputs=export_output)
+
 if __name__ == "__main__":
     demo.launch(share=True)
@@ -1,13 +1,18 @@
+import atexit
+import copy
 import json
 import gradio as gr
 import pandas as pd
-import datetime
 import os
 import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from typing import Dict, Any
 from azure.cosmos import CosmosClient, PartitionKey, exceptions
 from azure.cosmos.exceptions import CosmosResourceNotFoundError
 from dotenv import load_dotenv
+from catalogImport import PREVIEW_COLUMNS, apply_plan, changed_ids, diff_sheet, plan_summary, planned_converter, read_sheet
+from catalogStore import CatalogStore, default_db_path
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,6 +28,10 @@ DATABASE_NAME = os.getenv("AZURE_COSMOS_DB_DATABASE", "TAL_DB")  # Default to TA
 print(DATABASE_NAME)
 CONTAINER_NAME = os.getenv("AZURE_COSMOS_DB_CONTAINER", "Converters")  # Default to Converters_with_embeddings
 
+# Bulk import: Cosmos DB allows 100 operations per transactional batch
+COSMOS_BATCH_MAX_OPERATIONS = 100
+COSMOS_BATCH_WORKERS = int(os.getenv("COSMOS_BATCH_WORKERS", "8"))
+
 # Indexing policy
 INDEXING_POLICY = {
     "indexingMode": "consistent",
@@ -50,19 +59,10 @@ try:
 except exceptions.CosmosHttpResponseError as e:
     raise ValueError(f"Failed to initialize Cosmos DB client or create database/container: {str(e)}")
 
-def load_json(path) -> Dict[str, Any]:
-    try:
-        with open(path, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-
-def save_json(data: Dict[str, Any], path):
-    with open(path, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4, ensure_ascii=False)
-
-def get_current_time():
-    return datetime.datetime.now().isoformat()
+# Edits are appended to a journal; the JSON files are checkpointed a few seconds after the last edit
+store = CatalogStore(default_db_path(DATA_PATH), DATA_PATH, META_PATH)
+store.start_exporter()
+atexit.register(store.flush)
 
 def transform_to_cosmos_format(converter_id: str, converter_data: Dict[str, Any]) -> Dict[str, Any]:
     """Transform converter data to match Cosmos DB document structure."""
@@ -125,15 +125,52 @@ def sync_to_cosmos_db(converter_id: str, converter_data: Dict[str, Any], meta_da
         print(f"Error syncing to Cosmos DB: {str(e)}")
         return False
 
+def sync_batch_to_cosmos(converters: Dict[str, Dict[str, Any]], metas: Dict[str, Dict[str, Any]]) -> Dict[str, str]:
+    """Upsert converters as one transactional batch per partition (artnr); returns the cosmos_id of each one written."""
+    partitions = defaultdict(list)
+    for converter_id, converter_data in converters.items():
+        document = transform_to_cosmos_format(converter_id, converter_data)
+        # Replace the converter's existing document instead of adding another one
+        if metas.get(converter_id, {}).get("cosmos_id"):
+            document["id"] = metas[converter_id]["cosmos_id"]
+        partitions[document["artnr"]].append((converter_id, document))
+
+    def write_partition(item):
+        artnr, documents = item
+        written = {}
+        for start in range(0, len(documents), COSMOS_BATCH_MAX_OPERATIONS):
+            chunk = documents[start:start + COSMOS_BATCH_MAX_OPERATIONS]
+            try:
+                container.execute_item_batch(
+                    batch_operations=[("upsert", (document,)) for _, document in chunk],
+                    partition_key=artnr
+                )
+            except exceptions.CosmosHttpResponseError as e:
+                print(f"Error syncing batch for artnr {artnr} to Cosmos DB: {str(e)}")
+                break
+            written.update((converter_id, document["id"]) for converter_id, document in chunk)
+        return written
+
+    written = {}
+    with ThreadPoolExecutor(max_workers=COSMOS_BATCH_WORKERS) as pool:
+        for result in pool.map(write_partition, partitions.items()):
+            written.update(result)
+    return written
+
+def edited_meanwhile(converter_id: str) -> str:
+    return (f"Converter '{converter_id}' was changed by another edit while syncing to Cosmos DB; "
+            "the catalog was not updated. Please try again.")
+
 def add_converter(
     converter_id, type_, artnr, converter_description, dimlist_type, strain_relief, location, dimmability,
     ccr_amplitude, size, efficiency, ip, class_, input_voltage, output_voltage, barcode, name,
     price, unit, gross_weight, lifecycle, pdf_link
 ):
     converter_id = converter_id.strip()
-    data = load_json(DATA_PATH)
-    meta = load_json(META_PATH)
-    if converter_id in data:
+    # Cosmos DB is written outside the store's lock, so a slow call does not hold up
+    # other users; the edit is journaled only if the converter is still as read here
+    before = store.state(converter_id)
+    if before[0] is not None:
         return f"Converter '{converter_id}' already exists."
     
     info = {
@@ -161,24 +198,16 @@ def add_converter(
         "lamps": {}
     }
     
-    data[converter_id] = info
-    now = get_current_time()
-    meta[converter_id] = {
-        "created_at": now,
-        "updated_at": now,
-        "deleted_at": None,
-        "price_history": [{"timestamp": now, "price": float(price)}] if price else [],
-        "cosmos_id": None  # Will be updated after syncing
-    }
+    meta = {"cosmos_id": None}  # Will be updated after syncing
     
-    # Sync to Cosmos DB and update metadata with cosmos_id
-    if sync_to_cosmos_db(converter_id, info, meta[converter_id]):
-        # Save to JSON files
-        save_json(data, DATA_PATH)
-        save_json(meta, META_PATH)
-        return f"Added converter '{converter_id}' and synced to Cosmos DB."
-    else:
+    # Sync to Cosmos DB and record the cosmos_id in the metadata
+    if not sync_to_cosmos_db(converter_id, info, meta):
         return f"Failed to add converter '{converter_id}' to Cosmos DB."
+    with store.transaction():
+        if store.state(converter_id) != before:
+            return edited_meanwhile(converter_id)
+        store.add_converter(converter_id, info, price=float(price) if price else None, meta=meta)
+    return f"Added converter '{converter_id}' and synced to Cosmos DB."
 
 def update_converter(
     converter_id, type_, artnr, converter_description, dimlist_type, strain_relief, location, dimmability,
@@ -186,61 +215,42 @@ def update_converter(
     price, unit, gross_weight, lifecycle, pdf_link
 ):
     converter_id = converter_id.strip()
-    data = load_json(DATA_PATH)
-    meta = load_json(META_PATH)
-    if converter_id not in data:
+    before = store.state(converter_id)
+    old_info, old_meta = before
+    if old_info is None:
         return f"Converter '{converter_id}' does not exist."
     
-    info = data[converter_id]
-    now = get_current_time()
+    meta = {"cosmos_id": (old_meta or {}).get("cosmos_id")}
     
     # Update fields if provided
-    if type_: info["TYPE"] = type_
-    if artnr: info["ARTNR"] = float(artnr)
-    if converter_description: info["CONVERTER DESCRIPTION:"] = converter_description
-    if dimlist_type: info["dimlist_type"] = dimlist_type
-    if strain_relief: info["STRAIN RELIEF"] = strain_relief
-    if location: info["LOCATION"] = location
-    if dimmability: info["DIMMABILITY"] = dimmability
-    if ccr_amplitude: info["CCR (AMPLITUDE)"] = ccr_amplitude
-    if size: info["SIZE: L*B*H (mm)"] = size
-    if efficiency: info["EFFICIENCY @full load"] = float(efficiency)
-    if ip: info["IP"] = float(ip)
-    if class_: info["CLASS"] = float(class_)
-    if input_voltage: info["NOM. INPUT VOLTAGE (V)"] = input_voltage
-    if output_voltage: info["OUTPUT VOLTAGE (V)"] = output_voltage
-    if barcode: info["Barcode"] = barcode
-    if name: info["Name"] = name
+    fields = {}
+    if type_: fields["TYPE"] = type_
+    if artnr: fields["ARTNR"] = float(artnr)
+    if converter_description: fields["CONVERTER DESCRIPTION:"] = converter_description
+    if dimlist_type: fields["dimlist_type"] = dimlist_type
+    if strain_relief: fields["STRAIN RELIEF"] = strain_relief
+    if location: fields["LOCATION"] = location
+    if dimmability: fields["DIMMABILITY"] = dimmability
+    if ccr_amplitude: fields["CCR (AMPLITUDE)"] = ccr_amplitude
+    if size: fields["SIZE: L*B*H (mm)"] = size
+    if efficiency: fields["EFFICIENCY @full load"] = float(efficiency)
+    if ip: fields["IP"] = float(ip)
+    if class_: fields["CLASS"] = float(class_)
+    if input_voltage: fields["NOM. INPUT VOLTAGE (V)"] = input_voltage
+    if output_voltage: fields["OUTPUT VOLTAGE (V)"] = output_voltage
+    if barcode: fields["Barcode"] = barcode
+    if name: fields["Name"] = name
+    if unit: fields["Unit"] = unit
+    if gross_weight: fields["gross_weight"] = float(gross_weight)
+    if lifecycle: fields["LifeCycle"] = lifecycle
+    if pdf_link: fields["pdf_link"] = pdf_link
+    info = {**old_info, **fields}
+    new_price = None
     if price:
         price = float(price)
         if "Listprice" not in info or price != info.get("Listprice"):
-            if converter_id not in meta:
-                meta[converter_id] = {
-                    "created_at": now,
-                    "updated_at": now,
-                    "deleted_at": None,
-                    "price_history": [],
-                    "cosmos_id": None
-                }
-            if "price_history" not in meta[converter_id]:
-                meta[converter_id]["price_history"] = []
-            meta[converter_id]["price_history"].append({"timestamp": now, "price": price})
+            new_price = price
         info["Listprice"] = price
-    if unit: info["Unit"] = unit
-    if gross_weight: info["gross_weight"] = float(gross_weight)
-    if lifecycle: info["LifeCycle"] = lifecycle
-    if pdf_link: info["pdf_link"] = pdf_link
-    
-    # Update metadata
-    if converter_id not in meta:
-        meta[converter_id] = {
-            "created_at": now,
-            "updated_at": now,
-            "deleted_at": None,
-            "price_history": [],
-            "cosmos_id": None
-        }
-    meta[converter_id]["updated_at"] = now
     
     # Compute new id
     new_type = info["TYPE"]
@@ -249,190 +259,181 @@ def update_converter(
     
     if new_id != converter_id:
         # Delete old Cosmos DB document
-        sync_to_cosmos_db(converter_id, data[converter_id], meta[converter_id], operation="delete")
-        data[new_id] = info
-        meta[new_id] = meta.pop(converter_id)
-        del data[converter_id]
-        # Sync new document
-        if sync_to_cosmos_db(new_id, info, meta[new_id]):
-            save_json(data, DATA_PATH)
-            save_json(meta, META_PATH)
-            return f"Updated converter. ID changed to '{new_id}' and synced to Cosmos DB."
-        else:
+        sync_to_cosmos_db(converter_id, old_info, meta, operation="delete")
+    # Sync the (new) document, then journal the edit
+    if not sync_to_cosmos_db(new_id, info, meta):
+        if new_id != converter_id:
             return f"Failed to update converter to '{new_id}' in Cosmos DB."
-    else:
-        if sync_to_cosmos_db(converter_id, info, meta[converter_id]):
-            data[converter_id] = info
-            save_json(data, DATA_PATH)
-            save_json(meta, META_PATH)
-            return f"Updated converter '{converter_id}' and synced to Cosmos DB."
-        else:
-            return f"Failed to update converter '{converter_id}' in Cosmos DB."
+        return f"Failed to update converter '{converter_id}' in Cosmos DB."
+    with store.transaction():
+        if store.state(converter_id) != before:
+            return edited_meanwhile(converter_id)
+        store.update_converter(converter_id, fields, meta=meta)
+        if new_price is not None:
+            store.change_price(converter_id, new_price)
+        if new_id != converter_id:
+            store.rename_converter(converter_id, new_id)
+    if new_id != converter_id:
+        return f"Updated converter. ID changed to '{new_id}' and synced to Cosmos DB."
+    return f"Updated converter '{converter_id}' and synced to Cosmos DB."
 
 def delete_converter(converter_id):
     converter_id = converter_id.strip()
-    data = load_json(DATA_PATH)
-    meta = load_json(META_PATH)
-    if converter_id not in data:
+    before = store.state(converter_id)
+    info, meta = before
+    if info is None:
         return f"Converter '{converter_id}' does not exist."
     
-    now = get_current_time()
-    if converter_id not in meta:
-        meta[converter_id] = {
-            "created_at": None,
-            "updated_at": now,
-            "deleted_at": now,
-            "price_history": [],
-            "cosmos_id": None
-        }
-    else:
-        meta[converter_id]["deleted_at"] = now
-    
     # Delete from Cosmos DB
-    sync_to_cosmos_db(converter_id, data[converter_id], meta[converter_id], operation="delete")
+    meta = meta or {"cosmos_id": None}
+    sync_to_cosmos_db(converter_id, info, meta, operation="delete")
     
-    del data[converter_id]
-    save_json(data, DATA_PATH)
-    save_json(meta, META_PATH)
+    with store.transaction():
+        if store.state(converter_id) != before:
+            return edited_meanwhile(converter_id)
+        # The metadata keeps the deletion time
+        store.delete_converter(converter_id, meta={"cosmos_id": meta.get("cosmos_id")})
     return f"Deleted converter '{converter_id}' and removed from Cosmos DB."
 
 def add_or_update_lamp(converter_id, lamp_name, min_val, max_val):
     converter_id = converter_id.strip()
     lamp_name = lamp_name.strip()
-    data = load_json(DATA_PATH)
-    meta = load_json(META_PATH)
-    if converter_id not in data:
+    before = store.state(converter_id)
+    info = copy.deepcopy(before[0])
+    if info is None:
         return f"Converter '{converter_id}' does not exist."
     
-    if "lamps" not in data[converter_id]:
-        data[converter_id]["lamps"] = {}
-    data[converter_id]["lamps"][lamp_name] = {"min": min_val, "max": max_val}
-    
-    # Update metadata
-    now = get_current_time()
-    if converter_id not in meta:
-        meta[converter_id] = {
-            "created_at": now,
-            "updated_at": now,
-            "deleted_at": None,
-            "price_history": [],
-            "cosmos_id": None
-        }
-    meta[converter_id]["updated_at"] = now
+    if "lamps" not in info:
+        info["lamps"] = {}
+    info["lamps"][lamp_name] = {"min": min_val, "max": max_val}
+    meta = {"cosmos_id": (before[1] or {}).get("cosmos_id")}
     
     # Sync to Cosmos DB
-    if sync_to_cosmos_db(converter_id, data[converter_id], meta[converter_id]):
-        save_json(data, DATA_PATH)
-        save_json(meta, META_PATH)
-        return f"Added/updated lamp '{lamp_name}' in converter '{converter_id}' and synced to Cosmos DB."
-    else:
+    if not sync_to_cosmos_db(converter_id, info, meta):
         return f"Failed to add/update lamp '{lamp_name}' in Cosmos DB."
+    with store.transaction():
+        if store.state(converter_id) != before:
+            return edited_meanwhile(converter_id)
+        store.put_lamp(converter_id, lamp_name, info["lamps"][lamp_name], meta=meta)
+    return f"Added/updated lamp '{lamp_name}' in converter '{converter_id}' and synced to Cosmos DB."
 
 def delete_lamp(converter_id, lamp_name):
     converter_id = converter_id.strip()
     lamp_name = lamp_name.strip()
-    data = load_json(DATA_PATH)
-    meta = load_json(META_PATH)
-    if converter_id not in data:
+    before = store.state(converter_id)
+    info = copy.deepcopy(before[0])
+    if info is None:
         return f"Converter '{converter_id}' does not exist."
     
-    lamps = data[converter_id].get("lamps", {})
+    lamps = info.get("lamps", {})
     if lamp_name not in lamps:
         return f"Lamp '{lamp_name}' does not exist in converter '{converter_id}'."
     
     del lamps[lamp_name]
-    
-    # Update metadata
-    now = get_current_time()
-    if converter_id not in meta:
-        meta[converter_id] = {
-            "created_at": now,
-            "updated_at": now,
-            "deleted_at": None,
-            "price_history": [],
-            "cosmos_id": None
-        }
-    meta[converter_id]["updated_at"] = now
+    meta = {"cosmos_id": (before[1] or {}).get("cosmos_id")}
     
     # Sync to Cosmos DB
-    if sync_to_cosmos_db(converter_id, data[converter_id], meta[converter_id]):
-        save_json(data, DATA_PATH)
-        save_json(meta, META_PATH)
-        return f"Deleted lamp '{lamp_name}' from converter '{converter_id}' and synced to Cosmos DB."
-    else:
+    if not sync_to_cosmos_db(converter_id, info, meta):
         return f"Failed to delete lamp '{lamp_name}' in Cosmos DB."
+    with store.transaction():
+        if store.state(converter_id) != before:
+            return edited_meanwhile(converter_id)
+        store.delete_lamp(converter_id, lamp_name, meta=meta)
+    return f"Deleted lamp '{lamp_name}' from converter '{converter_id}' and synced to Cosmos DB."
 
 def get_converter(converter_id):
     converter_id = converter_id.strip()
-    meta = load_json(META_PATH)
-    cosmos_id = meta.get(converter_id, {}).get("cosmos_id")
+    meta = store.get_meta(converter_id) or {}
+    cosmos_id = meta.get("cosmos_id")
     
     if cosmos_id:
         try:
             # Fetch from Cosmos DB using artnr as partition key
-            data = load_json(DATA_PATH)
-            artnr = int(data.get(converter_id, {}).get("ARTNR", 0))
+            artnr = int((store.get_converter(converter_id) or {}).get("ARTNR", 0))
             item = container.read_item(item=cosmos_id, partition_key=artnr)
-            # Add metadata from local file
-            item["metadata"] = meta.get(converter_id, {})
+            # Add metadata from the catalog store
+            item["metadata"] = meta
             return json.dumps(item, indent=2, ensure_ascii=False)
         except CosmosResourceNotFoundError:
-            print(f"Document with ID {cosmos_id} not found in Cosmos DB. Falling back to local JSON.")
+            print(f"Document with ID {cosmos_id} not found in Cosmos DB. Falling back to local catalog.")
         except exceptions.CosmosHttpResponseError as e:
             print(f"Error reading document {cosmos_id}: {str(e)}")
     
-    # Fallback to local JSON
-    data = load_json(DATA_PATH)
-    item = data.get(converter_id, {})
+    # Fallback to the local catalog
+    item = store.get_converter(converter_id) or {}
     if item:
-        item["metadata"] = meta.get(converter_id, {})
+        item["metadata"] = meta
     return json.dumps(item, indent=2, ensure_ascii=False)
 
 def filter_lamps(filter_type, n_latest):
-    # Load local JSON files
-    data = load_json(DATA_PATH)
-    meta = load_json(META_PATH)
+    # Read from the catalog store
+    if filter_type == "Latest Added":
+        rows = store.listing(order_by="created_at", limit=n_latest, include_deleted=False)
+    elif filter_type == "Latest Updated":
+        rows = store.listing(order_by="updated_at", limit=n_latest, include_deleted=False)
+    elif filter_type == "Price Change":
+        rows = store.listing(price_changes=True)
+    else:
+        rows = store.listing()
     records = []
-    for cid, cinfo in data.items():
-        m = meta.get(cid, {})
-        created_at = m.get("created_at", "")
-        updated_at = m.get("updated_at", "")
-        deleted_at = m.get("deleted_at", None)
-        price_history = m.get("price_history", [])
-        price = cinfo.get("Listprice", "")
-        lamps = cinfo.get("lamps", {})
+    for row in rows:
+        m = row["meta"]
         record = {
-            "Converter ID": cid,
-            "Created At": created_at,
-            "Updated At": updated_at,
-            "Deleted At": deleted_at,
-            "Price": price,
-            "Lamps": ", ".join(lamps.keys())
+            "Converter ID": row["id"],
+            "Created At": m.get("created_at", ""),
+            "Updated At": m.get("updated_at", ""),
+            "Deleted At": m.get("deleted_at", None),
+            "Price": row["price"],
+            "Lamps": ", ".join(row["lamps"])
         }
-        if filter_type == "Show All":
-            records.append(record)
-        elif filter_type == "Latest Added":
-            if not deleted_at:
-                records.append(record)
-        elif filter_type == "Latest Updated":
-            if not deleted_at:
-                records.append(record)
-        elif filter_type == "Deleted":
-            if deleted_at:
-                records.append(record)
-        elif filter_type == "Price Change":
-            if len(price_history) > 1:
-                record["Price History"] = str(price_history)
-                records.append(record)
-    
-    # Apply sorting and slicing
-    if filter_type == "Latest Added":
-        records = sorted(records, key=lambda x: x.get("Created At", ""), reverse=True)[:n_latest]
-    elif filter_type == "Latest Updated":
-        records = sorted(records, key=lambda x: x.get("Updated At", ""), reverse=True)[:n_latest]
+        if filter_type == "Price Change":
+            record["Price History"] = str(m.get("price_history", []))
+        records.append(record)
     
     return pd.DataFrame(records)
 
+def _read_import_sheet(file):
+    path = getattr(file, "name", file)
+    if not path:
+        raise ValueError("Upload a CSV or Excel sheet first.")
+    return read_sheet(path)
+
+def preview_import(file, remove_missing_lamps):
+    try:
+        sheet = _read_import_sheet(file)
+    except (ValueError, KeyError, OSError, ImportError) as e:
+        return f"Could not read the sheet: {str(e)}", pd.DataFrame(columns=PREVIEW_COLUMNS)
+    plan = diff_sheet(store.snapshot()[0], sheet, remove_missing_lamps)
+    return plan_summary(plan), plan["preview"]
+
+def apply_import(file, remove_missing_lamps):
+    # The diff is recomputed from the current catalog, so edits made since the preview are respected
+    try:
+        sheet = _read_import_sheet(file)
+    except (ValueError, KeyError, OSError, ImportError) as e:
+        return f"Could not read the sheet: {str(e)}"
+    data, metas, _ = store.snapshot()
+    plan = diff_sheet(data, sheet, remove_missing_lamps)
+    converters = {cid: planned_converter(data, plan, cid) for cid in changed_ids(plan)}
+    # Cosmos DB first, outside the store's lock; only converters whose batch was written are journaled
+    written = sync_batch_to_cosmos(converters, metas)
+    with store.transaction():
+        # Converters edited while syncing keep those edits
+        edited = [cid for cid in written if store.state(cid) != (data.get(cid), metas.get(cid))]
+        applied = [cid for cid in written if cid not in edited]
+        apply_plan(store, plan, only=applied, meta={cid: {"cosmos_id": written[cid]} for cid in applied})
+    failed = len(converters) - len(written)
+    result = f"Applied to {len(applied)} converters and synced to Cosmos DB. {plan_summary(plan)}"
+    if failed:
+        result += f" {failed} converters failed to sync to Cosmos DB and were not changed."
+    if edited:
+        result += f" {len(edited)} converters were edited during the import and were not changed; import again to apply them."
+    return result
+
+def export_catalog():
+    store.checkpoint()
+    return f"Exported {DATA_PATH} and {META_PATH}."
+
 # Gradio interface
 with gr.Blocks(title="TAL Converter JSON Editor") as demo:
     gr.Markdown("# TAL Converter JSON Editor")
@@ -605,5 +606,31 @@ with gr.Blocks(title="TAL Converter JSON Editor") as demo:
             outputs=lamp_table
         )
 
+    with gr.Tab("Bulk Import"):
+        gr.Markdown("Upload the converter matrix or a price list (CSV or Excel, same columns as in DataPrep), preview the changes and apply them in one go.")
+        import_file = gr.File(label="Matrix or price list", file_types=[".csv", ".xlsx", ".xls"])
+        remove_missing_lamps = gr.Checkbox(value=True, label="Remove lamps the matrix no longer lists for a converter")
+        preview_btn = gr.Button("Preview Changes")
+        import_summary = gr.Textbox(label="Summary")
+        import_preview = gr.DataFrame(label="Changes", interactive=False)
+        apply_btn = gr.Button("Apply Changes")
+        import_output = gr.Textbox(label="Result")
+        preview_btn.click(
+            preview_import,
+            inputs=[import_file, remove_missing_lamps],
+            outputs=[import_summary, import_preview]
+        )
+        apply_btn.click(
+            apply_import,
+            inputs=[import_file, remove_missing_lamps],
+            outputs=import_output
+        )
+
+    with gr.Tab("Export JSON"):
+        gr.Markdown("Edits are checkpointed to the JSON files a few seconds after the last change. Export now to write them immediately.")
+        export_btn = gr.Button("Export JSON")
+        export_output = gr.Textbox(label="Result")
+        export_btn.click(export_catalog, outputs=export_output)
+
 if __name__ == "__main__":
     demo.launch()  # Run locally without sharing
@@ -0,0 +1,314 @@
+# catalogImport.py
+"""Bulk import of a converter matrix or price list sheet into the catalog.
+
+Accepts the sheets DataPrep builds the catalog from, as CSV or Excel: the
+LED converter matrix (TYPE, ARTNR, the general columns, then one column per
+lamp with "min-max" counts) or a price list (ARTNR plus Barcode, Name,
+Listprice, ...). The header row is found by its ARTNR cell, so the banner
+rows above the matrix header may stay in the file.
+
+diff_sheet compares the sheet with the catalog in long form (one row per
+converter and field, one per converter and lamp) using pandas merges, and
+returns a plan: new converters, changed fields, price changes, lamp upserts
+and, for matrix sheets, lamps no longer listed for a converter. apply_plan
+writes the plan as journal entries in one store transaction. Matrix rows
+are matched to converters by "<TYPE> - <ARTNR>", or by an article number
+only one converter has; a matrix row without a match becomes a new
+converter, a price list row (matched by ARTNR) without one is skipped.
+Converters missing from the sheet are left alone, as are blank cells.
+
+Excel writes numbers to CSV rounded to the decimals the cell shows
+("0,7" for 0.66), so a CSV number only counts as changed when the stored
+value would not be shown the same way.
+"""
+import copy
+import os
+import re
+from typing import Any, Dict, List, Optional
+
+import pandas as pd
+
+# The matrix's general columns come first, lamp columns after them (as in DataPrep)
+GENERAL_INFO_COLUMNS = 14
+PRICE_FIELD = "Listprice"
+PREVIEW_COLUMNS = ["Converter ID", "Change", "Field", "Old", "New"]
+
+_NUMBER = re.compile(r"^-?\d+(?:[.,]\d+)?$")
+_PERCENT = re.compile(r"^-?\d+(?:[.,]\d+)?\s*%$")
+
+
+class CsvNumber(float):
+    """A number from a CSV export, which Excel writes rounded to the decimals the cell shows"""
+
+    def __new__(cls, value: float, decimals: int):
+        number = super().__new__(cls, value)
+        number.decimals = decimals
+        return number
+
+    @property
+    def tolerance(self) -> float:
+        """How far the exact value may be from the shown one"""
+        return 0.5 * 10 ** -self.decimals
+
+
+def _shown_tolerance(value: Any) -> float:
+    return value.tolerance if isinstance(value, CsvNumber) else 0.0
+
+
+def _typed_csv_column(values: pd.Series) -> pd.Series:
+    """Numbers and percentages in a CSV export ("0,66", "83%") as Excel would give them"""
+    text = values.astype("string").str.strip()
+    numbers = pd.to_numeric(text.str.replace(",", ".", regex=False), errors="coerce")
+    percents = pd.to_numeric(text.str.rstrip("%").str.strip().str.replace(",", ".", regex=False), errors="coerce") / 100
+    decimals = text.str.extract(r"[.,](\d+)", expand=False).str.len().fillna(0).astype(int)
+    is_number = text.str.match(_NUMBER).fillna(False).astype(bool)
+    is_percent = text.str.match(_PERCENT).fillna(False).astype(bool)
+    typed = values.astype(object).where(values.notna(), None)
+    # Excel hands pandas floats for numeric cells in columns with blanks
+    shown_numbers = pd.Series(map(CsvNumber, numbers.astype("float64"), decimals), index=values.index, dtype=object)
+    shown_percents = pd.Series(map(CsvNumber, percents.astype("float64"), decimals + 2), index=values.index, dtype=object)
+    typed = typed.mask(is_number, shown_numbers)
+    return typed.mask(is_percent, shown_percents)
+
+
+def read_sheet(path: str) -> pd.DataFrame:
+    """The sheet with its ARTNR header row as columns and empty rows dropped"""
+    if os.path.splitext(path)[1].lower() in (".xlsx", ".xlsm", ".xls"):
+        raw = pd.read_excel(path, header=None)
+    else:
+        # Excel's CSV export uses ";" and decimal commas in some locales
+        raw = pd.read_csv(path, header=None, sep=None, engine="python", dtype=str, encoding="utf-8-sig")
+        raw = raw.apply(_typed_csv_column)
+    header_rows = raw.index[(raw.astype(str).apply(lambda c: c.str.strip()) == "ARTNR").any(axis=1)]
+    if header_rows.empty:
+        raise ValueError("No ARTNR column found in the sheet.")
+    header = header_rows[0]
+    columns = [str(c).strip() if pd.notna(c) and str(c).strip() else None for c in raw.loc[header]]
+    sheet = raw.loc[header + 1:].copy()
+    sheet.columns = columns
+    # Unnamed spacer columns carry no data
+    sheet = sheet.loc[:, [c is not None for c in columns]]
+    sheet = sheet.loc[:, ~sheet.columns.duplicated()]
+    sheet["ARTNR"] = pd.to_numeric(sheet["ARTNR"], errors="coerce")
+    sheet = sheet.dropna(subset=["ARTNR"])
+    return sheet.reset_index(drop=True)
+
+
+def sheet_kind(sheet: pd.DataFrame) -> str:
+    return "matrix" if "TYPE" in sheet.columns else "pricelist"
+
+
+def _python(value: Any) -> Any:
+    """numpy scalars and CSV numbers as plain Python values for the JSON catalog"""
+    if isinstance(value, CsvNumber):
+        return float(value)
+    return value.item() if hasattr(value, "item") else value
+
+
+def _same(old: pd.Series, new: pd.Series, tolerance: Optional[pd.Series] = None) -> pd.Series:
+    """Equal as numbers (within tolerance, for rounded CSV cells), or as trimmed text"""
+    old_num = pd.to_numeric(old, errors="coerce")
+    new_num = pd.to_numeric(new, errors="coerce")
+    difference = (old_num - new_num).abs()
+    if tolerance is not None:
+        # A little slack for binary floats, so 0.65 still rounds to a shown 0.7
+        difference = difference - tolerance - 1e-9
+    same_number = old_num.notna() & (difference <= 0)
+    same_text = old.notna() & (old.astype(str).str.strip() == new.astype(str).str.strip())
+    return same_number | same_text
+
+
+def lamp_value(value: Any) -> Dict[str, str]:
+    """A matrix cell as the catalog stores it, e.g. "2-3" -> {"min": "2", "max": "3"}"""
+    text = str(value)
+    if "-" in text:
+        min_val, max_val = (part.strip() for part in text.split("-", 1))
+    else:
+        min_val = max_val = text.strip()
+    return {"min": min_val, "max": max_val}
+
+
+def _empty_plan(kind: str) -> Dict[str, Any]:
+    return {
+        "kind": kind,
+        "adds": {},
+        "updates": {},
+        "prices": {},
+        "lamps": {},
+        "removed_lamps": {},
+        "skipped": [],
+        "preview": pd.DataFrame(columns=PREVIEW_COLUMNS)
+    }
+
+
+def diff_sheet(data: Dict[str, Any], sheet: pd.DataFrame, remove_missing_lamps: bool = True) -> Dict[str, Any]:
+    """Changes that bring the catalog (converter id -> info) in line with the sheet"""
+    kind = sheet_kind(sheet)
+    plan = _empty_plan(kind)
+    if sheet.empty:
+        return plan
+
+    if kind == "matrix":
+        general = list(sheet.columns[:GENERAL_INFO_COLUMNS])
+        lamp_columns = [c for c in sheet.columns[GENERAL_INFO_COLUMNS:] if c not in ("ARTNR", "NAME_norm")]
+    else:
+        general = list(sheet.columns)
+        lamp_columns = []
+
+    catalog = pd.DataFrame(
+        [(cid, info.get("ARTNR")) for cid, info in data.items()], columns=["converter_id", "ARTNR"]
+    )
+    catalog["ARTNR"] = pd.to_numeric(catalog["ARTNR"], errors="coerce")
+    catalog = catalog.dropna(subset=["ARTNR"])
+    if kind == "matrix":
+        # The matrix lists some converters under several types, so match "<TYPE> - <ARTNR>"
+        # first and fall back to an article number that only one converter has
+        sheet = sheet[sheet["TYPE"].notna()].copy()
+        sheet["converter_id"] = sheet["TYPE"].astype(str).str.strip() + " - " + sheet["ARTNR"].astype("int64").astype(str)
+        sheet = sheet.drop_duplicates("converter_id", keep="last")
+        unique_artnr = catalog.drop_duplicates("ARTNR", keep=False).rename(columns={"converter_id": "by_artnr"})
+        sheet = sheet.merge(unique_artnr, on="ARTNR", how="left")
+        unmatched = ~sheet["converter_id"].isin(data.keys())
+        fallback = unmatched & sheet["by_artnr"].notna() & ~sheet["by_artnr"].isin(sheet["converter_id"])
+        sheet.loc[fallback, "converter_id"] = sheet.loc[fallback, "by_artnr"]
+        sheet["is_new"] = unmatched & ~fallback
+        sheet = sheet.drop(columns="by_artnr").drop_duplicates("converter_id", keep="last")
+    else:
+        # A price applies to every converter with the article number
+        sheet = sheet.drop_duplicates("ARTNR", keep="last").merge(catalog, on="ARTNR", how="left")
+        unmatched = sheet["converter_id"].isna()
+        plan["skipped"] = sheet.loc[unmatched, "ARTNR"].astype("int64").tolist()
+        sheet = sheet[~unmatched].assign(is_new=False)
+    preview = []
+
+    # New converters: every filled general cell plus the listed lamps
+    for _, row in sheet[sheet["is_new"]].iterrows():
+        cid = row["converter_id"]
+        info = {field: _python(row[field]) for field in general if pd.notna(row[field])}
+        info["lamps"] = {
+            lamp: lamp_value(row[lamp]) for lamp in lamp_columns if pd.notna(row[lamp]) and str(row[lamp]).strip()
+        }
+        plan["adds"][cid] = info
+        preview.append((cid, "add", "", "", f"{len(info) - 1} fields, {len(info['lamps'])} lamps"))
+    existing = sheet[~sheet["is_new"]]
+
+    # Fields: one row per converter and field on both sides
+    fields = [f for f in general if f != "ARTNR"]
+    incoming = existing.melt(id_vars="converter_id", value_vars=fields, var_name="field", value_name="new")
+    incoming = incoming[incoming["new"].notna() & (incoming["new"].astype(str).str.strip() != "")]
+    current = pd.DataFrame(
+        [(cid, field, data[cid].get(field)) for cid in existing["converter_id"] for field in fields],
+        columns=["converter_id", "field", "old"]
+    )
+    changed = incoming.merge(current, on=["converter_id", "field"], how="left")
+    changed = changed[~_same(changed["old"], changed["new"], changed["new"].map(_shown_tolerance))]
+    for cid, field, new, old in changed[["converter_id", "field", "new", "old"]].itertuples(index=False):
+        new = _python(new)
+        if field == PRICE_FIELD:
+            plan["prices"][cid] = float(new)
+            preview.append((cid, "price", field, old, new))
+        else:
+            plan["updates"].setdefault(cid, {})[field] = new
+            preview.append((cid, "update", field, old, new))
+
+    # Lamps: one row per converter and lamp on both sides
+    if lamp_columns:
+        listed = existing.melt(id_vars="converter_id", value_vars=lamp_columns, var_name="lamp", value_name="cell")
+        listed = listed[listed["cell"].notna() & (listed["cell"].astype(str).str.strip() != "")]
+        listed["lamp"] = listed["lamp"].astype(str).str.strip()
+        listed["tolerance"] = listed["cell"].map(_shown_tolerance)
+        split = listed["cell"].astype(str).str.split("-", n=1, expand=True).reindex(columns=[0, 1])
+        listed["min"] = split[0].str.strip()
+        listed["max"] = split[1].str.strip().fillna(listed["min"])
+        stored = pd.DataFrame(
+            [(cid, lamp, value.get("min"), value.get("max"))
+             for cid in existing["converter_id"] for lamp, value in (data[cid].get("lamps") or {}).items()],
+            columns=["converter_id", "lamp", "old_min", "old_max"]
+        )
+        lamps = listed.merge(stored, on=["converter_id", "lamp"], how="left", indicator=True)
+        # A CSV cell within rounding of the stored count is the same count; keep the exact value
+        lamps = lamps[(lamps["_merge"] == "left_only") | ~_same(lamps["old_min"], lamps["min"], lamps["tolerance"])
+                      | ~_same(lamps["old_max"], lamps["max"], lamps["tolerance"])]
+        for cid, lamp, lo, hi, old_lo, old_hi in lamps[
+            ["converter_id", "lamp", "min", "max", "old_min", "old_max"]
+        ].itertuples(index=False):
+            plan["lamps"].setdefault(cid, {})[lamp] = {"min": lo, "max": hi}
+            old = "" if pd.isna(old_lo) else f"{old_lo}-{old_hi}"
+            preview.append((cid, "lamp", lamp, old, f"{lo}-{hi}"))
+        if remove_missing_lamps:
+            gone = stored.merge(listed[["converter_id", "lamp"]], on=["converter_id", "lamp"], how="left", indicator=True)
+            gone = gone[gone["_merge"] == "left_only"]
+            for cid, lamp, old_lo, old_hi in gone[["converter_id", "lamp", "old_min", "old_max"]].itertuples(index=False):
+                plan["removed_lamps"].setdefault(cid, []).append(lamp)
+                preview.append((cid, "lamp removed", lamp, f"{old_lo}-{old_hi}", ""))
+
+    preview = pd.DataFrame(preview, columns=PREVIEW_COLUMNS)
+    values = preview[["Old", "New"]]
+    preview[["Old", "New"]] = values.where(values.notna(), "").astype(str)
+    plan["preview"] = preview
+    return plan
+
+
+def plan_summary(plan: Dict[str, Any]) -> str:
+    parts = [
+        f"{len(plan['adds'])} new converters",
+        f"{sum(len(f) for f in plan['updates'].values())} field updates",
+        f"{len(plan['prices'])} price changes",
+        f"{sum(len(l) for l in plan['lamps'].values())} lamp updates",
+        f"{sum(len(l) for l in plan['removed_lamps'].values())} lamp removals"
+    ]
+    summary = f"{plan['kind'].capitalize()} sheet: " + ", ".join(parts) + "."
+    if plan["skipped"]:
+        summary += f" Skipped {len(plan['skipped'])} unknown article numbers: {', '.join(map(str, plan['skipped'][:10]))}"
+        summary += "..." if len(plan["skipped"]) > 10 else "."
+    return summary
+
+
+def changed_ids(plan: Dict[str, Any]) -> List[str]:
+    ids = []
+    for key in ("adds", "updates", "prices", "lamps", "removed_lamps"):
+        ids.extend(cid for cid in plan[key] if cid not in ids)
+    return ids
+
+
+def planned_converter(data: Dict[str, Any], plan: Dict[str, Any], converter_id: str) -> Dict[str, Any]:
+    """The converter as it will look after the plan is applied"""
+    if converter_id in plan["adds"]:
+        return copy.deepcopy(plan["adds"][converter_id])
+    info = copy.deepcopy(data[converter_id])
+    info.update(plan["updates"].get(converter_id, {}))
+    if converter_id in plan["prices"]:
+        info[PRICE_FIELD] = plan["prices"][converter_id]
+    lamps = info.setdefault("lamps", {})
+    lamps.update(plan["lamps"].get(converter_id, {}))
+    for lamp in plan["removed_lamps"].get(converter_id, []):
+        lamps.pop(lamp, None)
+    return info
+
+
+def apply_plan(store, plan: Dict[str, Any], only: Optional[List[str]] = None,
+               meta: Optional[Dict[str, Dict[str, Any]]] = None) -> int:
+    """Journal the plan's changes in one transaction; returns the number of converters changed.
+
+    only restricts the import to these converter ids, meta adds fields (e.g.
+    the Cosmos DB id) to a converter's metadata.
+    """
+    ids = [cid for cid in changed_ids(plan) if only is None or cid in only]
+    meta = meta or {}
+    with store.transaction():
+        for cid in ids:
+            extra = meta.get(cid)
+            if cid in plan["adds"]:
+                info = plan["adds"][cid]
+                price = info.get(PRICE_FIELD)
+                store.add_converter(cid, info, price=float(price) if price is not None else None, meta=extra)
+                continue
+            if cid in plan["updates"] or extra:
+                store.update_converter(cid, plan["updates"].get(cid, {}), meta=extra)
+            if cid in plan["prices"]:
+                store.change_price(cid, plan["prices"][cid])
+            for lamp, value in plan["lamps"].get(cid, {}).items():
+                store.put_lamp(cid, lamp, value)
+            for lamp in plan["removed_lamps"].get(cid, []):
+                store.delete_lamp(cid, lamp)
+    return len(ids)
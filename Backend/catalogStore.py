@@ -0,0 +1,614 @@
+# catalogStore.py
+"""Journaled store for the converter catalog edited by the CRUD tools.
+
+Every edit (add, update, price change, rename, delete, lamp upsert or
+removal) is appended as one entry to an append-only journal in SQLite and
+applied to the catalog held in memory, so a write is a single row insert
+and readers get a consistent copy of the current state without touching
+disk. The metadata the tools show (created_at, updated_at, deleted_at and
+the price history) is derived from the journal entries, not maintained by
+the handlers.
+
+A checkpoint folds the journal into the converters/lamps/metadata tables,
+removes the folded entries and exports the JSON files the chatbots and
+DataPrep scripts read (converters_with_links_and_pricelist.json and
+converters_metadata.json) in exactly their current format. Each file is
+replaced atomically, so a crash leaves the previous version in place, and
+the fold marks the files as behind the tables until both are written; a
+store opened with that mark still set exports them again. A checkpoint runs
+CATALOG_EXPORT_SECONDS after the last edit (0 to checkpoint on demand only),
+as soon as CATALOG_CHECKPOINT_ENTRIES entries are pending, on exit, or from
+the command line
+
+    python catalogStore.py --export
+
+On start the catalog is loaded from the tables and the journal entries
+written since the last checkpoint are replayed. An empty store imports
+the JSON files.
+
+Key order matters for an exact export, so converter and metadata documents
+are stored as JSON with their position in the file; the lamps and the price
+history sit in their own tables and are put back where the document had them.
+"""
+import argparse
+import copy
+import datetime
+import json
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, List, Optional, Tuple
+
+CATALOG_EXPORT_SECONDS = float(os.getenv("CATALOG_EXPORT_SECONDS", "5"))
+CATALOG_CHECKPOINT_ENTRIES = int(os.getenv("CATALOG_CHECKPOINT_ENTRIES", "100"))
+
+JOURNAL_OPS = ("add", "update", "price", "rename", "delete", "lamp", "lamp_delete")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS converters (
+    id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS converters_position ON converters(position);
+CREATE TABLE IF NOT EXISTS lamps (
+    converter_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    value TEXT NOT NULL,
+    PRIMARY KEY (converter_id, name)
+);
+CREATE INDEX IF NOT EXISTS lamps_name ON lamps(name);
+CREATE TABLE IF NOT EXISTS metadata (
+    converter_id TEXT PRIMARY KEY,
+    position INTEGER NOT NULL,
+    created_at TEXT,
+    updated_at TEXT,
+    deleted_at TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS metadata_position ON metadata(position);
+CREATE INDEX IF NOT EXISTS metadata_created_at ON metadata(created_at);
+CREATE INDEX IF NOT EXISTS metadata_updated_at ON metadata(updated_at);
+CREATE TABLE IF NOT EXISTS price_history (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    converter_id TEXT NOT NULL,
+    entry TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS price_history_converter ON price_history(converter_id, seq);
+CREATE TABLE IF NOT EXISTS journal (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    timestamp TEXT NOT NULL,
+    op TEXT NOT NULL,
+    converter_id TEXT NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS store_state (
+    name TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def default_db_path(data_path: str) -> str:
+    """converters_catalog.db next to the catalog JSON"""
+    return os.getenv("CATALOG_DB_PATH", os.path.join(os.path.dirname(os.path.abspath(data_path)), "converters_catalog.db"))
+
+
+def write_json_atomic(data: Dict[str, Any], path: str):
+    """Write like json.dump(indent=4), replacing the file only once the new one is complete"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4, ensure_ascii=False)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_json_file(path) -> Dict[str, Any]:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def _meta_entry(meta: Dict[str, Any], converter_id: str, timestamp: str, extra: Optional[Dict[str, Any]] = None):
+    """The converter's metadata entry, created the way the CRUD tools always did"""
+    if converter_id not in meta:
+        meta[converter_id] = {
+            "created_at": timestamp,
+            "updated_at": timestamp,
+            "deleted_at": None,
+            "price_history": []
+        }
+    entry = meta[converter_id]
+    entry.update(extra or {})
+    return entry
+
+
+def apply_entry(data: Dict[str, Any], meta: Dict[str, Any], entry: Dict[str, Any]) -> Tuple[List[str], List[str]]:
+    """Apply one journal entry to the catalog and metadata dicts.
+
+    Returns the ids that were (re)inserted as new keys of data and of meta;
+    they move to the end of the JSON files.
+    """
+    op, converter_id, timestamp = entry["op"], entry["converter_id"], entry["timestamp"]
+    payload = entry["payload"]
+    extra = payload.get("meta")
+    new_data, new_meta = [], []
+    if op == "add":
+        if converter_id not in data:
+            new_data.append(converter_id)
+        data[converter_id] = copy.deepcopy(payload["info"])
+        if converter_id not in meta:
+            new_meta.append(converter_id)
+        meta[converter_id] = {
+            "created_at": timestamp,
+            "updated_at": timestamp,
+            "deleted_at": None,
+            "price_history": [{"timestamp": timestamp, "price": payload["price"]}] if payload.get("price") is not None else []
+        }
+        meta[converter_id].update(extra or {})
+    elif op == "update":
+        data[converter_id].update(copy.deepcopy(payload["fields"]))
+        if converter_id not in meta:
+            new_meta.append(converter_id)
+        _meta_entry(meta, converter_id, timestamp, extra)["updated_at"] = timestamp
+    elif op == "price":
+        data[converter_id]["Listprice"] = payload["price"]
+        if converter_id not in meta:
+            new_meta.append(converter_id)
+        m = _meta_entry(meta, converter_id, timestamp, extra)
+        m.setdefault("price_history", []).append({"timestamp": timestamp, "price": payload["price"]})
+        m["updated_at"] = timestamp
+    elif op == "rename":
+        new_id = payload["new_id"]
+        if new_id not in data:
+            new_data.append(new_id)
+        data[new_id] = data.pop(converter_id)
+        if converter_id in meta:
+            if new_id not in meta:
+                new_meta.append(new_id)
+            meta[new_id] = meta.pop(converter_id)
+    elif op == "delete":
+        if converter_id not in meta:
+            new_meta.append(converter_id)
+        _meta_entry(meta, converter_id, timestamp, extra)["deleted_at"] = timestamp
+        del data[converter_id]
+    elif op in ("lamp", "lamp_delete"):
+        lamps = data[converter_id].setdefault("lamps", {})
+        if op == "lamp":
+            lamps[payload["lamp"]] = copy.deepcopy(payload["value"])
+        else:
+            lamps.pop(payload["lamp"], None)
+        if converter_id not in meta:
+            new_meta.append(converter_id)
+        _meta_entry(meta, converter_id, timestamp, extra)["updated_at"] = timestamp
+    else:
+        raise ValueError(f"Unknown journal op '{op}'")
+    return new_data, new_meta
+
+
+class CatalogStore:
+    """Converter catalog in memory, journaled and checkpointed to SQLite and the catalog JSON files"""
+
+    def __init__(self, db_path: str, data_path: str, meta_path: str,
+                 export_seconds: float = CATALOG_EXPORT_SECONDS, checkpoint_entries: int = CATALOG_CHECKPOINT_ENTRIES):
+        self.data_path = data_path
+        self.meta_path = meta_path
+        self.export_seconds = export_seconds
+        self.checkpoint_entries = checkpoint_entries
+        # Gradio runs handlers on worker threads; one connection and catalog behind a lock
+        self._lock = threading.RLock()
+        self._depth = 0
+        self.conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=FULL")
+        self.conn.executescript(SCHEMA)
+        self.version = 0
+        self.exported_version = 0
+        self._changed = threading.Condition()
+        # One checkpoint at a time, so files are never overwritten by an older copy
+        self._checkpoint_lock = threading.Lock()
+        self._exporter = None
+        if self._is_empty():
+            self.import_json()
+        self._load()
+        if self.pending or self._export_pending():
+            # Entries or a checkpoint from before a crash or an unclean exit
+            self.exported_version = -1
+
+    @staticmethod
+    def now() -> str:
+        return datetime.datetime.now().isoformat()
+
+    # --- Transactions ---
+
+    @contextmanager
+    def transaction(self):
+        """Journal entries inside commit together, with one timestamp; nested blocks join the outer one.
+
+        Entries are applied to the catalog as they are appended, so reads in the
+        block see them; a failed block rolls the journal back and reloads.
+        """
+        with self._lock:
+            outer = self._depth == 0
+            if outer:
+                self.conn.execute("BEGIN IMMEDIATE")
+                self._timestamp = self.now()
+                pending = self.pending
+            self._depth += 1
+            try:
+                yield self
+            except BaseException:
+                self._depth -= 1
+                if outer:
+                    self.conn.execute("ROLLBACK")
+                    self._load()
+                raise
+            self._depth -= 1
+            if outer:
+                self.conn.execute("COMMIT")
+                # Blocks that journaled nothing (e.g. a rejected edit) leave the files alone
+                if self.pending != pending:
+                    self._mark_changed()
+
+    def _mark_changed(self):
+        with self._changed:
+            self.version += 1
+            self._changed.notify_all()
+
+    def _export_pending(self) -> bool:
+        """Whether a checkpoint folded the journal but did not finish writing the JSON files"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT EXISTS(SELECT 1 FROM store_state WHERE name = 'export_pending')"
+            ).fetchone()[0]
+
+    def _is_empty(self) -> bool:
+        with self._lock:
+            return not self.conn.execute(
+                "SELECT EXISTS(SELECT 1 FROM converters) OR EXISTS(SELECT 1 FROM metadata) OR EXISTS(SELECT 1 FROM journal)"
+            ).fetchone()[0]
+
+    # --- Journal ---
+
+    def append(self, op: str, converter_id: str, **payload) -> Dict[str, Any]:
+        """Append one entry to the journal and apply it to the catalog"""
+        if op not in JOURNAL_OPS:
+            raise ValueError(f"Unknown journal op '{op}'")
+        with self.transaction():
+            entry = {"timestamp": self._timestamp, "op": op, "converter_id": converter_id, "payload": payload}
+            cursor = self.conn.execute(
+                "INSERT INTO journal (timestamp, op, converter_id, payload) VALUES (?, ?, ?, ?)",
+                (entry["timestamp"], op, converter_id, json.dumps(payload, ensure_ascii=False))
+            )
+            entry["seq"] = cursor.lastrowid
+            self._apply(entry)
+        return entry
+
+    def _apply(self, entry: Dict[str, Any]):
+        new_data, new_meta = apply_entry(self.data, self.meta, entry)
+        self._touched.add(entry["converter_id"])
+        if entry["op"] == "rename":
+            self._touched.add(entry["payload"]["new_id"])
+        self._moved_data.update(new_data)
+        self._moved_meta.update(new_meta)
+        self.pending += 1
+
+    def journal(self, converter_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Entries not yet folded into a checkpoint, oldest first"""
+        query = "SELECT seq, timestamp, op, converter_id, payload FROM journal"
+        params = ()
+        if converter_id is not None:
+            query += " WHERE converter_id = ?"
+            params = (converter_id,)
+        with self._lock:
+            rows = self.conn.execute(query + " ORDER BY seq", params).fetchall()
+        return [
+            {"seq": seq, "timestamp": timestamp, "op": op, "converter_id": cid, "payload": json.loads(payload)}
+            for seq, timestamp, op, cid, payload in rows
+        ]
+
+    def _load(self):
+        """Catalog from the last checkpoint plus the journal entries written since"""
+        with self._lock:
+            self.data, self.meta = self._read_tables()
+            self._touched, self._moved_data, self._moved_meta = set(), set(), set()
+            self.pending = 0
+            for entry in self.journal():
+                self._apply(entry)
+
+    # --- Edits ---
+
+    def add_converter(self, converter_id: str, info: Dict[str, Any], price: Optional[float] = None,
+                      meta: Optional[Dict[str, Any]] = None):
+        """New converter; price starts its price history, meta adds fields to its metadata"""
+        self.append("add", converter_id, info=info, price=price, meta=meta)
+
+    def update_converter(self, converter_id: str, fields: Dict[str, Any], meta: Optional[Dict[str, Any]] = None):
+        self.append("update", converter_id, fields=fields, meta=meta)
+
+    def change_price(self, converter_id: str, price: float, meta: Optional[Dict[str, Any]] = None):
+        self.append("price", converter_id, price=price, meta=meta)
+
+    def rename_converter(self, converter_id: str, new_id: str):
+        """Move a converter and its metadata to a new id, like data[new_id] = data.pop(converter_id)"""
+        self.append("rename", converter_id, new_id=new_id)
+
+    def delete_converter(self, converter_id: str, meta: Optional[Dict[str, Any]] = None):
+        """Remove from the catalog; the metadata entry stays with its deleted_at"""
+        self.append("delete", converter_id, meta=meta)
+
+    def put_lamp(self, converter_id: str, lamp_name: str, value: Dict[str, Any], meta: Optional[Dict[str, Any]] = None):
+        self.append("lamp", converter_id, lamp=lamp_name, value=value, meta=meta)
+
+    def delete_lamp(self, converter_id: str, lamp_name: str, meta: Optional[Dict[str, Any]] = None):
+        self.append("lamp_delete", converter_id, lamp=lamp_name, meta=meta)
+
+    # --- Reads ---
+
+    def has_converter(self, converter_id: str) -> bool:
+        with self._lock:
+            return converter_id in self.data
+
+    def get_converter(self, converter_id: str) -> Optional[Dict[str, Any]]:
+        """A copy of the converter as it appears in the catalog JSON, lamps included"""
+        with self._lock:
+            return copy.deepcopy(self.data.get(converter_id))
+
+    def get_meta(self, converter_id: str) -> Optional[Dict[str, Any]]:
+        """A copy of the converter's entry in converters_metadata.json"""
+        with self._lock:
+            return copy.deepcopy(self.meta.get(converter_id))
+
+    def state(self, converter_id: str) -> Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]:
+        """Copies of the converter and its metadata, read together.
+
+        Any edit of the converter changes its metadata, so comparing two
+        states tells whether it was edited in between.
+        """
+        with self._lock:
+            return copy.deepcopy(self.data.get(converter_id)), copy.deepcopy(self.meta.get(converter_id))
+
+    def snapshot(self) -> Tuple[Dict[str, Any], Dict[str, Any], int]:
+        """Copies of (data, meta) in the catalog JSON format and the version they reflect"""
+        with self._lock:
+            return copy.deepcopy(self.data), copy.deepcopy(self.meta), self.version
+
+    def listing(self, order_by: Optional[str] = None, limit: Optional[int] = None,
+                include_deleted: bool = True, price_changes: bool = False) -> List[Dict[str, Any]]:
+        """Catalog converters with their price, lamp names and metadata, in catalog order.
+
+        order_by "created_at" or "updated_at" returns the newest first (limit
+        applies after sorting); price_changes keeps converters whose price
+        history has more than one entry.
+        """
+        with self._lock:
+            records = []
+            for converter_id, info in self.data.items():
+                meta = self.meta.get(converter_id, {})
+                if not include_deleted and meta.get("deleted_at"):
+                    continue
+                if price_changes and len(meta.get("price_history", [])) <= 1:
+                    continue
+                records.append({
+                    "id": converter_id,
+                    "price": info.get("Listprice", ""),
+                    "lamps": list(info.get("lamps", {})),
+                    "meta": copy.deepcopy(meta)
+                })
+        if order_by in ("created_at", "updated_at"):
+            # Converters without metadata sort last, like "" did in the JSON version
+            records = sorted(records, key=lambda r: r["meta"].get(order_by) or "", reverse=True)
+            if limit:
+                records = records[:int(limit)]
+        return records
+
+    # --- Checkpoint tables ---
+
+    def _read_tables(self) -> Tuple[Dict[str, Any], Dict[str, Any]]:
+        lamps, history = {}, {}
+        for converter_id, name, value in self.conn.execute(
+            "SELECT converter_id, name, value FROM lamps ORDER BY converter_id, position"
+        ):
+            lamps.setdefault(converter_id, {})[name] = json.loads(value)
+        for converter_id, entry in self.conn.execute("SELECT converter_id, entry FROM price_history ORDER BY seq"):
+            history.setdefault(converter_id, []).append(json.loads(entry))
+        data = {}
+        for converter_id, info in self.conn.execute("SELECT id, info FROM converters ORDER BY position"):
+            info = json.loads(info)
+            if "lamps" in info:
+                info["lamps"] = lamps.get(converter_id, {})
+            data[converter_id] = info
+        meta = {}
+        for converter_id, doc in self.conn.execute("SELECT converter_id, doc FROM metadata ORDER BY position"):
+            doc = json.loads(doc)
+            if "price_history" in doc:
+                doc["price_history"] = history.get(converter_id, [])
+            meta[converter_id] = doc
+        return data, meta
+
+    def _write_converter(self, converter_id: str, info: Dict[str, Any]):
+        """Insert or replace one converter row and its lamps; a new one goes to the end"""
+        stored = dict(info)
+        lamps = stored.get("lamps")
+        if "lamps" in stored:
+            # Placeholder that keeps the key's position for the export
+            stored["lamps"] = None
+        self.conn.execute(
+            """INSERT INTO converters (id, position, info)
+               VALUES (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM converters), ?)
+               ON CONFLICT(id) DO UPDATE SET info = excluded.info""",
+            (converter_id, json.dumps(stored, ensure_ascii=False))
+        )
+        self.conn.execute("DELETE FROM lamps WHERE converter_id = ?", (converter_id,))
+        self.conn.executemany(
+            "INSERT INTO lamps (converter_id, name, position, value) VALUES (?, ?, ?, ?)",
+            [(converter_id, name, position, json.dumps(value, ensure_ascii=False))
+             for position, (name, value) in enumerate((lamps or {}).items())]
+        )
+
+    def _write_meta(self, converter_id: str, meta: Dict[str, Any]):
+        """Insert or replace one metadata row and its price history; a new one goes to the end"""
+        stored = dict(meta)
+        history = stored.get("price_history")
+        if "price_history" in stored:
+            stored["price_history"] = None
+        self.conn.execute(
+            """INSERT INTO metadata (converter_id, position, created_at, updated_at, deleted_at, doc)
+               VALUES (?, (SELECT COALESCE(MAX(position), 0) + 1 FROM metadata), ?, ?, ?, ?)
+               ON CONFLICT(converter_id) DO UPDATE SET
+                   created_at = excluded.created_at, updated_at = excluded.updated_at,
+                   deleted_at = excluded.deleted_at, doc = excluded.doc""",
+            (converter_id, stored.get("created_at"), stored.get("updated_at"), stored.get("deleted_at"),
+             json.dumps(stored, ensure_ascii=False))
+        )
+        self.conn.execute("DELETE FROM price_history WHERE converter_id = ?", (converter_id,))
+        self.conn.executemany(
+            "INSERT INTO price_history (converter_id, entry) VALUES (?, ?)",
+            [(converter_id, json.dumps(entry, ensure_ascii=False)) for entry in history or []]
+        )
+
+    def _fold_journal(self):
+        """Write the converters the journal touched to the tables and drop the folded entries"""
+        # Ids re-inserted into the dicts moved to their end; rewrite them in dict order
+        moved_data = [cid for cid in self.data if cid in self._moved_data]
+        moved_meta = [cid for cid in self.meta if cid in self._moved_meta]
+        self.conn.execute("BEGIN IMMEDIATE")
+        try:
+            for converter_id in self._touched:
+                if converter_id not in self.data or converter_id in self._moved_data:
+                    self.conn.execute("DELETE FROM converters WHERE id = ?", (converter_id,))
+                    self.conn.execute("DELETE FROM lamps WHERE converter_id = ?", (converter_id,))
+                if converter_id not in self.meta or converter_id in self._moved_meta:
+                    self.conn.execute("DELETE FROM metadata WHERE converter_id = ?", (converter_id,))
+                    self.conn.execute("DELETE FROM price_history WHERE converter_id = ?", (converter_id,))
+            for converter_id in self._touched - self._moved_data:
+                if converter_id in self.data:
+                    self._write_converter(converter_id, self.data[converter_id])
+            for converter_id in moved_data:
+                self._write_converter(converter_id, self.data[converter_id])
+            for converter_id in self._touched - self._moved_meta:
+                if converter_id in self.meta:
+                    self._write_meta(converter_id, self.meta[converter_id])
+            for converter_id in moved_meta:
+                self._write_meta(converter_id, self.meta[converter_id])
+            self.conn.execute("DELETE FROM journal")
+            # Cleared once the JSON files are written, see checkpoint()
+            self.conn.execute("INSERT OR REPLACE INTO store_state (name, value) VALUES ('export_pending', '1')")
+        except BaseException:
+            self.conn.execute("ROLLBACK")
+            raise
+        self.conn.execute("COMMIT")
+        self._touched, self._moved_data, self._moved_meta = set(), set(), set()
+        self.pending = 0
+
+    # --- JSON import/export ---
+
+    def import_json(self):
+        """Load both catalog JSON files into the (empty) tables"""
+        data = load_json_file(self.data_path)
+        meta = load_json_file(self.meta_path)
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                for converter_id, info in data.items():
+                    self._write_converter(converter_id, info)
+                for converter_id, entry in meta.items():
+                    self._write_meta(converter_id, entry)
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+            self.conn.execute("COMMIT")
+
+    def checkpoint(self, data_path: Optional[str] = None, meta_path: Optional[str] = None) -> int:
+        """Fold the journal into the tables and write both JSON files; returns the exported version"""
+        with self._checkpoint_lock:
+            with self._lock:
+                if self._depth:
+                    raise RuntimeError("Cannot checkpoint inside a transaction")
+                if self.pending:
+                    self._fold_journal()
+                data, meta = copy.deepcopy(self.data), copy.deepcopy(self.meta)
+                version = self.version
+            write_json_atomic(data, data_path or self.data_path)
+            write_json_atomic(meta, meta_path or self.meta_path)
+            if data_path is None and meta_path is None:
+                with self._lock:
+                    self.conn.execute("DELETE FROM store_state WHERE name = 'export_pending'")
+                with self._changed:
+                    self.exported_version = max(self.exported_version, version)
+        return version
+
+    export_json = checkpoint
+
+    # --- Background checkpoints ---
+
+    def start_exporter(self):
+        """Checkpoint export_seconds after the last edit, or once checkpoint_entries are pending (no-op when 0)"""
+        if self.export_seconds <= 0 or self._exporter is not None:
+            return
+        self._exporter = threading.Thread(target=self._export_loop, name="catalog-checkpoint", daemon=True)
+        self._exporter.start()
+
+    def _export_loop(self):
+        while True:
+            with self._changed:
+                while self.version == self.exported_version:
+                    self._changed.wait()
+                seen = self.version
+            # Wait for edits to settle so a burst of changes is written once
+            deadline = time.monotonic() + self.export_seconds
+            while time.monotonic() < deadline and self.pending < self.checkpoint_entries:
+                with self._changed:
+                    self._changed.wait(timeout=deadline - time.monotonic())
+                    if self.version != seen:
+                        seen = self.version
+                        deadline = time.monotonic() + self.export_seconds
+            try:
+                self.checkpoint()
+            except (OSError, sqlite3.Error) as e:
+                print(f"Error checkpointing catalog: {str(e)}")
+                time.sleep(self.export_seconds)
+
+    def flush(self):
+        """Checkpoint now if there are edits the files don't have yet"""
+        if self.pending or self.version != self.exported_version:
+            self.checkpoint()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import, inspect or checkpoint the converter catalog store")
+    parser.add_argument("--data", default="./converters_with_links_and_pricelist.json")
+    parser.add_argument("--meta", default="./converters_metadata.json")
+    parser.add_argument("--db", help="SQLite file (default: CATALOG_DB_PATH or next to --data)")
+    parser.add_argument("--export", action="store_true", help="Checkpoint and write both JSON files from the store")
+    parser.add_argument("--journal", action="store_true", help="Print the journal entries not yet checkpointed")
+    parser.add_argument("--reimport", action="store_true", help="Replace the store's contents with the JSON files")
+    args = parser.parse_args()
+
+    store = CatalogStore(args.db or default_db_path(args.data), args.data, args.meta, export_seconds=0)
+    if args.journal:
+        for entry in store.journal():
+            print(json.dumps(entry, ensure_ascii=False))
+    if args.reimport:
+        with store._lock:
+            store.conn.execute("BEGIN IMMEDIATE")
+            for table in ("converters", "lamps", "metadata", "price_history", "journal", "store_state"):
+                store.conn.execute(f"DELETE FROM {table}")
+            store.conn.execute("COMMIT")
+            store.import_json()
+            store._load()
+            store.exported_version = store.version
+        print(f"Imported {args.data} and {args.meta}")
+    if args.export:
+        store.checkpoint()
+        print(f"Exported {args.data} and {args.meta}")
+
+
+if __name__ == "__main__":
+    main()
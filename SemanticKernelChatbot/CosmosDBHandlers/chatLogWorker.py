@@ -0,0 +1,307 @@
+# chatLogWorker.py
+import asyncio
+import contextvars
+import json
+import logging
+import os
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+from CosmosDBHandlers.containerPolicies import LEGACY_PARTITION_KEYS, with_partition_key
+from CosmosDBHandlers.embeddingCodec import decode_embedding, encode_embedding, has_embedding
+from tracing.chatTracer import tracer, record_cosmos_response
+
+
+class ChatLogWorker:
+    """Background logging pipeline for chat interactions and generated SQL.
+
+    Every record is appended to a local spool file before it is queued, so
+    nothing is lost when the process crashes or Cosmos DB is unavailable.
+    A single worker task embeds chat questions in batches through the shared
+    embedding service, writes the records to Cosmos DB in bulk, then
+    acknowledges them in the spool.
+    Unacknowledged records are replayed on the next start.
+    """
+
+    def __init__(
+        self,
+        chat_memory_handler,
+        logger: Optional[logging.Logger] = None,
+        spool_path: Optional[str] = None,
+        max_queue_size: int = 1000,
+        batch_size: int = 32,
+        batch_interval: float = 0.5,
+        embedding_watermark: float = 0.8,
+        retry_interval: float = 30.0
+    ):
+        self.handler = chat_memory_handler
+        self.logger = logger or logging.getLogger(__name__)
+        self.spool_path = spool_path or os.getenv("CHAT_LOG_SPOOL_PATH", "chat_log_spool.jsonl")
+        self.max_queue_size = max_queue_size
+        self.batch_size = batch_size
+        self.batch_interval = batch_interval
+        # Above this fill ratio new chat records are written without an embedding
+        self.embedding_watermark = embedding_watermark
+        self.retry_interval = retry_interval
+
+        self.queue: Optional[asyncio.Queue] = None
+        self._task: Optional[asyncio.Task] = None
+        self._spool = None
+        self._unacked = 0
+        # Set when records exist only in the spool (queue overflow or failed writes)
+        self._needs_replay = False
+
+    # ------------------------------------------------------------------
+    # Producer side
+    # ------------------------------------------------------------------
+    def submit(self, kind: str, item: Dict, embed: bool = False):
+        """Spool and enqueue a record without waiting for Cosmos DB"""
+        self._ensure_started()
+
+        if embed and self.queue.qsize() >= self.max_queue_size * self.embedding_watermark:
+            # Shed the expensive part first: keep the row, skip its embedding
+            embed = False
+            self.logger.warning("Chat log queue under pressure, skipping embedding")
+
+        record = {"id": item["id"], "kind": kind, "embed": embed, "item": item}
+        self._append_spool({"op": "put", **record})
+        self._unacked += 1
+
+        try:
+            self.queue.put_nowait(record)
+        except asyncio.QueueFull:
+            # The row stays in the spool and is written by the next replay
+            self._needs_replay = True
+            self.logger.warning(f"Chat log queue full, deferring {kind} record {item['id']} to spool replay")
+
+    async def flush(self, timeout: float = 10.0):
+        """Wait until all queued records have been written"""
+        if self.queue is None:
+            return
+        try:
+            await asyncio.wait_for(self.queue.join(), timeout=timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning("Timed out flushing chat log queue, records remain in spool")
+
+    # ------------------------------------------------------------------
+    # Worker side
+    # ------------------------------------------------------------------
+    def _ensure_started(self):
+        if self._task is not None and not self._task.done():
+            return
+        self.queue = asyncio.Queue(maxsize=self.max_queue_size)
+        pending = self._load_pending()
+        self._rewrite_spool(pending)
+        self._spool = open(self.spool_path, "a", encoding="utf-8")
+        self._unacked = len(pending)
+        if pending:
+            self.logger.info(f"Replaying {len(pending)} spooled chat log records")
+            self._needs_replay = True
+        # A fresh context, so the worker's spans are roots of their own traces
+        # rather than children of the request that happened to start it
+        self._task = asyncio.get_running_loop().create_task(self._run(), context=contextvars.Context())
+
+    async def _run(self):
+        while True:
+            if self._needs_replay and self.queue.empty():
+                self._replay()
+            await self._faq_clusterer_tick()
+
+            batch = await self._next_batch()
+            if not batch:
+                continue
+            try:
+                with tracer.span("log_batch", records=len(batch)):
+                    written = await self._process_batch(batch)
+                for record_id in written:
+                    self._append_spool({"op": "ack", "id": record_id})
+                self._unacked -= len(written)
+                if len(written) < len(batch):
+                    self._needs_replay = True
+            except Exception as e:
+                self.logger.error(f"Chat log batch failed, will retry from spool: {str(e)}")
+                self._needs_replay = True
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+            if self._needs_replay and self.queue.empty():
+                await asyncio.sleep(self.retry_interval)
+            elif self._unacked == 0 and self.queue.empty():
+                self._rewrite_spool([])
+
+    async def _next_batch(self) -> List[Dict]:
+        """Collect up to batch_size records, waiting at most batch_interval after the first"""
+        try:
+            first = await asyncio.wait_for(self.queue.get(), timeout=self.retry_interval)
+        except asyncio.TimeoutError:
+            return []
+        batch = [first]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.batch_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _process_batch(self, batch: List[Dict]) -> List[str]:
+        await self._embed_batch(batch)
+
+        # One transactional batch per logical partition, whatever key the container has
+        fields = {
+            "chat": getattr(self.handler, "chat_partition_path", LEGACY_PARTITION_KEYS["chat"]).lstrip("/"),
+            "sql": getattr(self.handler, "sql_partition_path", LEGACY_PARTITION_KEYS["sql"]).lstrip("/")
+        }
+        groups = defaultdict(list)
+        for record in batch:
+            kind = "chat" if record["kind"] == "chat" else "sql"
+            with_partition_key(record["item"], kind)
+            groups[(kind, record["item"].get(fields[kind]))].append(record["item"])
+
+        # The partitions are independent, so their batches are written concurrently
+        results = await asyncio.gather(*(
+            self._write_group(kind, partition_key, items) for (kind, partition_key), items in groups.items()
+        ))
+        written = []
+        written_items = defaultdict(list)
+        for (kind, _), items in zip(groups, results):
+            if items:
+                written.extend(item["id"] for item in items)
+                written_items[kind].extend(items)
+
+        if written_items.get("chat"):
+            await self._cluster_questions(written_items["chat"])
+        for kind, items in written_items.items():
+            await self._update_rollups(kind, items)
+        return written
+
+    async def _write_group(self, kind: str, partition_key, items: List[Dict]) -> List[Dict]:
+        """Write one partition's records; returns them, or nothing if the write failed"""
+        container = self.handler.chat_container if kind == "chat" else self.handler.sql_container
+        try:
+            with tracer.span("cosmos_write", container=container.id, item_count=len(items)) as span:
+                await asyncio.to_thread(self._write_items, container, partition_key, items)
+                record_cosmos_response(span, container)
+            return items
+        except Exception as e:
+            self.logger.error(f"Failed to write {len(items)} {kind} log records: {str(e)}")
+            return []
+
+    async def _update_rollups(self, kind: str, items: List[Dict]):
+        """Fold written records into the dashboard counters"""
+        rollups = getattr(self.handler, "stats_rollups", None)
+        if rollups is None:
+            return
+        try:
+            with tracer.span("rollup_update", kind=kind, item_count=len(items)) as span:
+                span.set_attribute("documents", await asyncio.to_thread(rollups.apply, kind, items))
+        except Exception as e:
+            # The records are written; only the counters drift until the next --rebuild
+            self.logger.error(f"Failed to update {kind} rollups: {str(e)}")
+
+    async def _cluster_questions(self, items: List[Dict]):
+        """Count written questions towards their FAQ cluster"""
+        clusterer = getattr(self.handler, "faq_clusterer", None)
+        if clusterer is None:
+            return
+        # Decoded from what was written, so online and batch clustering see the same vectors
+        embedded = [(item["question"], decode_embedding(item)) for item in items]
+        embedded = [(question, vector) for question, vector in embedded if vector is not None]
+        if not embedded:
+            return
+        try:
+            if not clusterer.loaded:
+                await asyncio.to_thread(clusterer.load)
+            for question, vector in embedded:
+                clusterer.observe(question, vector)
+        except Exception as e:
+            self.logger.error(f"Online FAQ clustering failed: {str(e)}")
+
+    async def _faq_clusterer_tick(self):
+        clusterer = getattr(self.handler, "faq_clusterer", None)
+        if clusterer is not None and clusterer.loaded:
+            await clusterer.maybe_persist()
+
+    async def _embed_batch(self, batch: List[Dict]):
+        """Embed all chat questions of a batch with a single embed_documents call"""
+        to_embed = [r for r in batch if r["embed"] and not has_embedding(r["item"])]
+        if not to_embed:
+            return
+        try:
+            with tracer.span("embedding", texts=len(to_embed)):
+                embeddings = await self.handler.embedding_service.embed_many(
+                    [r["item"]["question"] for r in to_embed]
+                )
+            for record, embedding in zip(to_embed, embeddings):
+                record["item"].update(encode_embedding(embedding))
+        except Exception as e:
+            # Rows are more valuable than their embeddings: write them without
+            self.logger.error(f"Batch embedding failed, logging without embeddings: {str(e)}")
+
+    def _write_items(self, container, partition_key, items: List[Dict]):
+        if partition_key is None:
+            for item in items:
+                container.upsert_item(body=item)
+            return
+        # Transactional batches are limited to 100 operations per partition key
+        for start in range(0, len(items), 100):
+            operations = [("upsert", (item,)) for item in items[start:start + 100]]
+            container.execute_item_batch(batch_operations=operations, partition_key=partition_key)
+
+    # ------------------------------------------------------------------
+    # Spool file
+    # ------------------------------------------------------------------
+    def _append_spool(self, entry: Dict):
+        try:
+            self._spool.write(json.dumps(entry, ensure_ascii=False) + "\n")
+            self._spool.flush()
+        except Exception as e:
+            self.logger.error(f"Failed to append to chat log spool: {str(e)}")
+
+    def _load_pending(self) -> List[Dict]:
+        """Return spooled records that were never acknowledged"""
+        pending: Dict[str, Dict] = {}
+        try:
+            with open(self.spool_path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except json.JSONDecodeError:
+                        continue  # torn write from a crash
+                    if entry.get("op") == "put":
+                        pending[entry["id"]] = {k: v for k, v in entry.items() if k != "op"}
+                    elif entry.get("op") == "ack":
+                        pending.pop(entry["id"], None)
+        except FileNotFoundError:
+            pass
+        return list(pending.values())
+
+    def _rewrite_spool(self, pending: List[Dict]):
+        """Compact the spool to the given pending records with an atomic replace"""
+        if self._spool is not None:
+            self._spool.close()
+        tmp_path = self.spool_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for record in pending:
+                f.write(json.dumps({"op": "put", **record}, ensure_ascii=False) + "\n")
+        os.replace(tmp_path, self.spool_path)
+        if self._spool is not None:
+            self._spool = open(self.spool_path, "a", encoding="utf-8")
+
+    def _replay(self):
+        """Re-queue spooled records; only called while the queue is empty"""
+        self._needs_replay = False
+        pending = self._load_pending()
+        self._rewrite_spool(pending)
+        self._unacked = len(pending)
+        for record in pending:
+            try:
+                self.queue.put_nowait(record)
+            except asyncio.QueueFull:
+                self._needs_replay = True
+                break
@@ -0,0 +1,213 @@
+# containerMigration.py
+"""Copy a container into a newly provisioned one.
+
+Settings Cosmos DB fixes at creation time (partition key, vector index,
+vector embedding policy) can only be changed by creating a new container
+and copying the data. The copy reads the source change feed from the
+beginning and writes every page into the target in bulk: documents are
+grouped by their target partition and written as concurrent
+transactional batches. The change-feed continuation is checkpointed
+after every page, so an interrupted run resumes where it stopped, and
+running it again later only copies what changed since - run it once
+while the chatbots are live, then stop them, run it a final time and
+switch CHAT_HISTORY_CONTAINER / GENERATED_QUERIES_CONTAINER to the target.
+
+    python -m CosmosDBHandlers.containerMigration --target ChatHistoryV2 --vector-index diskANN
+    python -m CosmosDBHandlers.containerMigration --kind sql --target GeneratedQueriesV2
+
+Targets are partitioned by the synthetic pk (see containerPolicies.py);
+documents get it on the way.
+
+--embedding-storage re-encodes the stored embeddings on the way (see
+embeddingCodec.py), e.g. into int8 for a container with an int8 vector
+index.
+
+Deletes are not carried over: the change feed only reports inserts and
+updates.
+"""
+import argparse
+import json
+import logging
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional
+
+# Server-generated properties; the target assigns its own
+SYSTEM_PROPERTIES = ("_rid", "_self", "_etag", "_attachments", "_ts", "_lsn")
+# Transactional batch limits: 100 operations and 2 MB per request
+MAX_BATCH_OPERATIONS = 100
+MAX_BATCH_BYTES = 1_800_000
+
+
+def batch_chunks(docs: Iterable[Dict], max_operations: int = MAX_BATCH_OPERATIONS,
+                 max_bytes: int = MAX_BATCH_BYTES) -> List[List[Dict]]:
+    """Split one partition's documents into chunks that fit a transactional batch"""
+    chunks, current, size = [], [], 0
+    for doc in docs:
+        doc_size = len(json.dumps(doc))
+        if current and (len(current) >= max_operations or size + doc_size > max_bytes):
+            chunks.append(current)
+            current, size = [], 0
+        current.append(doc)
+        size += doc_size
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+class ContainerMigration:
+    """Resumable change-feed copy from one container to another"""
+
+    def __init__(self, source, target, checkpoint_path: str, transform: Optional[Callable[[Dict], Dict]] = None,
+                 partition_key_path: Optional[str] = None, workers: int = 16, page_size: int = 1000,
+                 logger: Optional[logging.Logger] = None):
+        self.source = source
+        self.target = target
+        self.checkpoint_path = checkpoint_path
+        # Optional per-document rewrite, e.g. adding a new partition key property
+        self.transform = transform
+        # With the target's key, pages are written as transactional batches; without, one upsert per document
+        self.partition_key_path = partition_key_path
+        self.workers = workers
+        self.page_size = page_size
+        self.logger = logger or logging.getLogger(__name__)
+
+    def load_checkpoint(self) -> Dict:
+        try:
+            with open(self.checkpoint_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {"source": self.source.id, "target": self.target.id, "continuation": None, "copied": 0}
+
+    def _save_checkpoint(self, checkpoint: Dict):
+        checkpoint["updated_at"] = datetime.now(timezone.utc).isoformat()
+        tmp_path = self.checkpoint_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(checkpoint, f, indent=2)
+        os.replace(tmp_path, self.checkpoint_path)
+
+    def _prepare(self, doc: Dict) -> Dict:
+        for name in SYSTEM_PROPERTIES:
+            doc.pop(name, None)
+        return self.transform(doc) if self.transform else doc
+
+    def run_once(self) -> int:
+        """Copy everything the source changed since the checkpoint; returns documents copied"""
+        checkpoint = self.load_checkpoint()
+        if (checkpoint.get("source"), checkpoint.get("target")) != (self.source.id, self.target.id):
+            raise ValueError(f"{self.checkpoint_path} belongs to {checkpoint.get('source')} -> {checkpoint.get('target')}")
+
+        token = checkpoint.get("continuation")
+        options = {"continuation": token} if token else {"start_time": "Beginning"}
+        feed = self.source.query_items_change_feed(max_item_count=self.page_size, **options)
+        copied = 0
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for page in feed.by_page():
+                docs = [self._prepare(doc) for doc in page]
+                # Read before the upserts, which may share the client and its headers
+                token = self.source.client_connection.last_response_headers.get("etag") or token
+                self._write(pool, docs)
+                copied += len(docs)
+                checkpoint["continuation"] = token
+                checkpoint["copied"] = checkpoint.get("copied", 0) + len(docs)
+                self._save_checkpoint(checkpoint)
+                if docs:
+                    self.logger.info(f"Copied {checkpoint['copied']} documents into {self.target.id}")
+        # An empty feed still moves the continuation forward
+        checkpoint["continuation"] = self.source.client_connection.last_response_headers.get("etag") or token
+        self._save_checkpoint(checkpoint)
+        return copied
+
+    def _write(self, pool: ThreadPoolExecutor, docs: List[Dict]):
+        if not self.partition_key_path:
+            list(pool.map(self.target.upsert_item, docs))
+            return
+        field = self.partition_key_path.lstrip("/")
+        groups = defaultdict(list)
+        for doc in docs:
+            groups[doc.get(field)].append(doc)
+        jobs = [(key, chunk) for key, group in groups.items() for chunk in batch_chunks(group)]
+        list(pool.map(lambda job: self.target.execute_item_batch(
+            batch_operations=[("upsert", (doc,)) for doc in job[1]], partition_key=job[0]
+        ), jobs))
+
+    def follow(self, interval: float):
+        """Keep the target in sync until interrupted, for a cutover with little downtime"""
+        while True:
+            self.run_once()
+            time.sleep(interval)
+
+
+def main():
+    from azure.cosmos import PartitionKey
+    from CosmosDBHandlers.containerPolicies import (
+        CHAT_HISTORY_CONTAINER, CHAT_VECTOR_INDEX_TYPE, EMBEDDING_DIMENSIONS, EMBEDDING_STORAGE,
+        GENERATED_QUERIES_CONTAINER, LOG_PARTITION_KEY, VECTOR_INDEX_TYPES, chat_history_policies,
+        with_partition_key
+    )
+    from CosmosDBHandlers.embeddingCodec import STORAGE_TYPES, recode_embedding
+
+    parser = argparse.ArgumentParser(description="Copy ChatHistory or GeneratedQueries into a newly provisioned container")
+    parser.add_argument("--kind", choices=("chat", "sql"), default="chat",
+                        help="chat: ChatHistory, sql: GeneratedQueries")
+    parser.add_argument("--source", help="Defaults to the configured container of the kind")
+    parser.add_argument("--target", required=True, help="New container, created if it does not exist")
+    parser.add_argument("--vector-index", choices=VECTOR_INDEX_TYPES, default=CHAT_VECTOR_INDEX_TYPE)
+    parser.add_argument("--embedding-storage", choices=STORAGE_TYPES, default=EMBEDDING_STORAGE)
+    parser.add_argument("--dimensions", type=int, default=EMBEDDING_DIMENSIONS,
+                        help="Cut longer embeddings to this size (text-embedding-3 only)")
+    parser.add_argument("--database", default="TAL_ChatData")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent batch writes")
+    parser.add_argument("--checkpoint", help="Defaults to migration_<source>_<target>.json")
+    parser.add_argument("--follow", type=float, default=0.0,
+                        help="Keep copying new changes every N seconds until interrupted")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    from azure.cosmos import CosmosClient
+    from dotenv import load_dotenv
+    load_dotenv()
+    client = CosmosClient(os.getenv("AZURE_COSMOS_DB_ENDPOINT"), os.getenv("AZURE_COSMOS_DB_KEY"))
+    database = client.get_database_client(args.database)
+    source = args.source or (CHAT_HISTORY_CONTAINER if args.kind == "chat" else GENERATED_QUERIES_CONTAINER)
+
+    if args.kind == "chat":
+        indexing_policy, vector_embedding_policy = chat_history_policies(
+            args.vector_index, args.dimensions, args.embedding_storage
+        )
+        target = database.create_container_if_not_exists(
+            id=args.target,
+            partition_key=PartitionKey(path=LOG_PARTITION_KEY),
+            indexing_policy=indexing_policy,
+            vector_embedding_policy=vector_embedding_policy
+        )
+
+        def transform(doc: Dict) -> Dict:
+            return recode_embedding(with_partition_key(doc, "chat"), args.embedding_storage, args.dimensions)
+    else:
+        target = database.create_container_if_not_exists(id=args.target, partition_key=PartitionKey(path=LOG_PARTITION_KEY))
+
+        def transform(doc: Dict) -> Dict:
+            return with_partition_key(doc, "sql")
+
+    migration = ContainerMigration(
+        database.get_container_client(source), target,
+        args.checkpoint or f"migration_{source}_{args.target}.json",
+        transform=transform, partition_key_path=LOG_PARTITION_KEY,
+        workers=args.workers, logger=logger
+    )
+    if args.follow:
+        try:
+            migration.follow(args.follow)
+        except KeyboardInterrupt:
+            pass
+    else:
+        logger.info(f"Copied {migration.run_once()} documents from {source} into {args.target}")
+
+
+if __name__ == "__main__":
+    main()
@@ -2,15 +2,38 @@
 # cosmosConnector.py
 from azure.cosmos import exceptions
 from datetime import datetime, timedelta, timezone
+import json
 import uuid
-from langchain_openai import AzureOpenAIEmbeddings
 import os
 from azure.cosmos import CosmosClient, PartitionKey
 from typing import List, Optional, Dict
 import logging
 import os
 from dotenv import load_dotenv
+from CosmosDBHandlers.chatLogWorker import ChatLogWorker
+from CosmosDBHandlers.embeddingService import get_embedding_service
+from CosmosDBHandlers.faqClustering import OnlineFAQClusterer, FAQ_CLUSTER_SET
+from CosmosDBHandlers.statsRollups import StatsRollupWriter, ROLLUP_INDEXING_POLICY
+from CosmosDBHandlers.sqlFingerprint import fingerprint_sql, error_class
+from CosmosDBHandlers.containerPolicies import (
+    CHAT_HISTORY_CONTAINER, CHAT_HISTORY_PARTITION_KEY, CHAT_VECTOR_INDEX_TYPE, EMBEDDING_STORAGE,
+    GENERATED_QUERIES_CONTAINER, GENERATED_QUERIES_PARTITION_KEY, LOG_PARTITION_KEY, TTL_PER_ITEM,
+    chat_history_policies, partition_key_path, with_partition_key, with_retention
+)
+from CosmosDBHandlers.embeddingCodec import similar_documents
+from tracing.chatTracer import tracer, record_cosmos_response
 load_dotenv()
+
+# Width of the numeric time buckets stored on every log record
+TIMELINE_BUCKET_SECONDS = 900
+
+
+def time_fields(now: Optional[datetime] = None) -> Dict:
+    """ISO timestamp plus epoch seconds and 15-minute bucket for server-side grouping"""
+    now = now or datetime.now(timezone.utc)
+    epoch = int(now.timestamp())
+    return {"timestamp": now.isoformat(), "epoch": epoch, "bucket": epoch - epoch % TIMELINE_BUCKET_SECONDS}
+
 # Initialize Cosmos DB containers
 
 class ChatMemoryHandler():
@@ -20,62 +43,92 @@ class ChatMemoryHandler():
             os.getenv("AZURE_COSMOS_DB_KEY")
         )
         self.logger = logger
-        self.indexing_policy = {
-            "indexingMode": "consistent",
-            "includedPaths": [{"path": "/*"}],  # Indexes all properties, including nested
-            "excludedPaths": [
-                {
-                    "path": '/"_etag"/?'
-                },
-                {
-                    "path": "/embedding/*"
-                }
-                ],
-        }
-
-
-        self.vector_embedding_policy = {
-            "vectorEmbeddings": [
-                {
-                    "path": "/embedding",
-                    "dataType": "float32",
-                    "distanceFunction": "cosine",
-                    "dimensions": 1536,
-                }
-            ]
-        }
-
-        self.embedding_model = AzureOpenAIEmbeddings(
-            azure_endpoint=os.environ["OPENAI_API_ENDPOINT"],
-            azure_deployment=os.environ["OPENAI_EMBEDDINGS_MODEL_DEPLOYMENT"],
-            api_key=os.environ["AZURE_OPENAI_KEY"]
-        )
+        # The vector index can't be changed on an existing container, see containerPolicies.py
+        self.indexing_policy, self.vector_embedding_policy = chat_history_policies()
+
+        self.embedding_service = get_embedding_service(logger)
 
         self.database = self.cosmos_client.create_database_if_not_exists("TAL_ChatData")
 
         # Container for chat history
         self.chat_container = self.database.create_container_if_not_exists(
-            id="ChatHistory",
-            partition_key=PartitionKey(path="/functionUsed"),
+            id=CHAT_HISTORY_CONTAINER,
+            partition_key=PartitionKey(path=CHAT_HISTORY_PARTITION_KEY),
             indexing_policy=self.indexing_policy,
-            vector_embedding_policy=self.vector_embedding_policy
+            vector_embedding_policy=self.vector_embedding_policy,
+            # Records expire by their own ttl (LOG_RETENTION_DAYS), see retention.py
+            default_ttl=TTL_PER_ITEM
         )
+        self._check_vector_index()
 
         # Container for SQL queries
         self.sql_container = self.database.create_container_if_not_exists(
-            id="GeneratedQueries", 
-            partition_key=PartitionKey(path="/state")
+            id=GENERATED_QUERIES_CONTAINER,
+            partition_key=PartitionKey(path=GENERATED_QUERIES_PARTITION_KEY),
+            default_ttl=TTL_PER_ITEM
+        )
+        # Containers created before the synthetic pk keep their key; the log worker groups writes by it
+        self.chat_partition_path = partition_key_path(self.chat_container, CHAT_HISTORY_PARTITION_KEY)
+        self.sql_partition_path = partition_key_path(self.sql_container, GENERATED_QUERIES_PARTITION_KEY)
+        if LOG_PARTITION_KEY not in (self.chat_partition_path, self.sql_partition_path) and self.logger:
+            self.logger.info("Chat logs use the partition keys /functionUsed and /state; "
+                             "see python -m CosmosDBHandlers.containerMigration --help to move to /pk")
+
+        # Materialized FAQ clusters written by faqClustering.py, one partition
+        self.faq_container = self.database.create_container_if_not_exists(
+            id="FAQClusters",
+            partition_key=PartitionKey(path="/clusterSet"),
+            indexing_policy={
+                "indexingMode": "consistent",
+                "includedPaths": [{"path": "/*"}],
+                "excludedPaths": [{"path": '/"_etag"/?'}, {"path": "/centroid/*"}]
+            }
+        )
+        # Keeps FAQ counts current between batch clustering runs
+        self.faq_clusterer = OnlineFAQClusterer(self.faq_container, logger=logger)
+
+        # Hourly/daily/all-time counters for the dashboard, one partition per record kind
+        self.rollup_container = self.database.create_container_if_not_exists(
+            id="StatsRollups",
+            partition_key=PartitionKey(path="/kind"),
+            indexing_policy=ROLLUP_INDEXING_POLICY,
+            # Hourly and per-minute rollups expire, daily and all-time ones are kept
+            default_ttl=TTL_PER_ITEM
         )
+        self.stats_rollups = StatsRollupWriter(self.rollup_container, logger=logger)
+
+        # Writes go through a background worker so callers never wait on Cosmos
+        self.log_worker = ChatLogWorker(self, logger=logger)
+
+        # FAQs are precomputed into this file so startup never clusters on demand
+        self.faq_snapshot_path = os.getenv("FAQ_SNAPSHOT_PATH", "faq_snapshot.json")
     
+    def _check_vector_index(self):
+        """Warn when ChatHistory was provisioned before it had a vector index"""
+        if CHAT_VECTOR_INDEX_TYPE == "none" or EMBEDDING_STORAGE == "binary":
+            return
+        try:
+            policy = self.chat_container.read().get("indexingPolicy", {})
+        except Exception:
+            return
+        if not policy.get("vectorIndexes") and self.logger:
+            self.logger.warning(
+                f"{CHAT_HISTORY_CONTAINER} has no vector index, similarity queries scan every document. "
+                f"Copy it into a new container with python -m CosmosDBHandlers.containerMigration"
+            )
+
     async def _generate_embedding(self, query: str) -> List[float]:
         """Generate embedding for the given query using Azure OpenAI"""
         try:
-            return self.embedding_model.embed_query(query)
+            with tracer.span("embedding", texts=1):
+                return await self.embedding_service.embed(query)
         except Exception as e:
             self.logger.error(f"Embedding generation failed: {str(e)}")
             raise
 
-    async def log_interaction(self, session_id: str, question: str, function_used: str, answer: str):
+    async def log_interaction(self, session_id: str, question: str, function_used: str, answer: str,
+                              tier: Optional[str] = None, metrics: Optional[Dict] = None):
+        """Queue a chat interaction; the embedding is added by the log worker"""
         try:
             chat_item = {
                 "id": str(uuid.uuid4()),
@@ -83,121 +136,121 @@ class ChatMemoryHandler():
                 "question": question,
                 "functionUsed": function_used,
                 "answer": answer,
-                "timestamp": datetime.now(timezone.utc).isoformat(),
-                "embedding": await self._generate_embedding(question)
+                "tier": tier,
+                **time_fields()
             }
-            self.chat_container.create_item(body=chat_item)
+            # Latency and token counts, so tiers can be compared on the dashboard
+            chat_item.update(metrics or {})
+            self.log_worker.submit("chat", with_retention(with_partition_key(chat_item, "chat")), embed=True)
         except Exception as e:
             self.logger.error(f"Failed to log chat interaction: {str(e)}")
 
 
-    async def log_sql_query(self, original_question: str, generated_sql: str, state: str="success"):
+    async def log_sql_query(self, original_question: str, generated_sql: str, state: str="success",
+                            error: Optional[Exception] = None):
         try:
             sql_item = {
                 "id": str(uuid.uuid4()),
                 "originalQuestion": original_question,
                 "generatedSql": generated_sql,
                 "state": state,
-                "timestamp": datetime.now(timezone.utc).isoformat()
+                # Query shape with literals masked, so failures and hot queries group by shape
+                **fingerprint_sql(generated_sql),
+                "errorClass": error_class(state, error),
+                **time_fields()
             }
-            self.sql_container.create_item(body=sql_item)
+            if error is not None:
+                sql_item["error"] = str(error)[:1000]
+            self.log_worker.submit("sql", with_retention(with_partition_key(sql_item, "sql")))
         except Exception as e:
             self.logger.error(f"Failed to log SQL query: {str(e)}")
 
     async def get_semantic_faqs(self, limit: int = 6, threshold: float = 0.1) -> List[Dict]:
-        """Retrieve FAQs using vector embeddings for semantic similarity"""
-        try:            
+        """Read the largest precomputed FAQ clusters (see faqClustering.py) in one query"""
+        try:
             query = """
-            SELECT c.question FROM c
+            SELECT TOP @limit c.representative_question, c.similar_questions, c.total_occurrences, c.similarity_scores, c.member_count
+            FROM c
+            WHERE c.clusterSet = @set
+            ORDER BY c.total_occurrences DESC
             """
-            raw_results = list(self.chat_container.query_items(
-                query=query,
-                enable_cross_partition_query=True,
-                max_item_count=-1
-            ))
-
-            from collections import Counter
-            question_counts = Counter(item['question'] for item in raw_results)
-            top_questions = question_counts.most_common(limit)
-
-            # Generate embeddings for top questions
-            faq_embeddings = {}
-            for question_text, count in top_questions:
-                embedding = await self._generate_embedding(question_text)
-                faq_embeddings[question_text] = {
-                    'embedding': embedding,
-                    'count': count
-                }
-
-            # Cluster similar questions
-            clustered_faqs = []
-            processed = set()
-            
-            for text, data in faq_embeddings.items():
-                if text in processed:
-                    continue
-
-                query = """
-                SELECT TOP 50 c.question, VectorDistance(c.embedding, @embedding) as distance
-                FROM c
-                ORDER BY VectorDistance(c.embedding, @embedding)
-                """
-                parameters = [{"name": "@embedding", "value": data['embedding']}]
-                    
-                similar_results = list(self.chat_container.query_items(
+            with tracer.span("cosmos_query", container="FAQClusters", query="faq_clusters") as span:
+                clusters = list(self.faq_container.query_items(
                     query=query,
-                    parameters=parameters,
-                    enable_cross_partition_query=True
+                    parameters=[{"name": "@limit", "value": limit}, {"name": "@set", "value": FAQ_CLUSTER_SET}],
+                    partition_key=FAQ_CLUSTER_SET
                 ))
-                
-                similarity_threshold = threshold  
-                filtered_results = []
-                for item in similar_results:
-                    similarity = 1 - item['distance']  # Convert distance to similarity
-                    if similarity <= similarity_threshold:
-                        filtered_results.append(item['question'])
-
-                # Count occurrences of similar questions
-                similar_question_counts = Counter(filtered_results)
-                cluster_count = sum(similar_question_counts.values())
-                
-                clustered_faqs.append({
-                    "representative_question": text,
-                    "similar_questions": list(similar_question_counts.keys()),
-                    "total_occurrences": cluster_count,
-                    "similarity_scores": {q: 1 - item['distance'] for item in similar_results for q in [item['question']] if 1 - item['distance'] >= similarity_threshold}
-                })
-                
-                # Mark all similar questions as processed
-                processed.update(filtered_results)
-                clustered_faqs.append({
-                    "representative_question": text,
-                    "similar_questions": [text],
-                    "total_occurrences": data['count'],
-                    "similarity_scores": {text: 1.0}
-                })
-                processed.add(text)
-
-            return sorted(clustered_faqs[:limit], key=lambda x: x['total_occurrences'], reverse=True)
-            
+                record_cosmos_response(span, self.faq_container, len(clusters))
+
+            for cluster in clusters:
+                scores = cluster.get("similarity_scores") or {}
+                cluster["similar_questions"] = [q for q in cluster.get("similar_questions", []) if scores.get(q, 1.0) >= threshold]
+            return clusters
+
         except exceptions.CosmosHttpResponseError as ex:
-            print(f"Cosmos DB error: {ex}")
-            self.logger.error(f"Semantic FAQ retrieval failed: {str(e)}")
+            if self.logger:
+                self.logger.error(f"Semantic FAQ retrieval failed: {str(ex)}")
             return []
         except Exception as e:
             if self.logger:
                 self.logger.error(f"Semantic FAQ retrieval failed: {str(e)}")
             return []
 
+    async def search_similar_questions(self, question: str, limit: int = 5) -> List[Dict]:
+        """Logged interactions whose questions are closest to the given one"""
+        try:
+            embedding = await self._generate_embedding(question)
+            with tracer.span("cosmos_query", container=CHAT_HISTORY_CONTAINER, query="similar_questions") as span:
+                items = await asyncio.to_thread(
+                    similar_documents, self.chat_container, embedding, limit,
+                    on_page=lambda headers: span.add("ru", float(headers.get("x-ms-request-charge", 0)))
+                )
+                span.set_attribute("item_count", len(items))
+            return items
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Similar question search failed: {str(e)}")
+            return []
 
-import asyncio
+    def load_faq_snapshot(self) -> Dict:
+        """Read the last precomputed FAQ snapshot; empty if none exists yet"""
+        try:
+            with open(self.faq_snapshot_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {"generated_at": None, "faqs": []}
+        except Exception as e:
+            if self.logger:
+                self.logger.error(f"Failed to read FAQ snapshot: {str(e)}")
+            return {"generated_at": None, "faqs": []}
 
+    async def refresh_faq_snapshot(self, limit: int = 11, threshold: float = 0.1) -> Dict:
+        """Recompute semantic FAQs and atomically replace the snapshot file"""
+        with tracer.span("faq_refresh", limit=limit) as span:
+            faqs = await self.get_semantic_faqs(limit=limit, threshold=threshold)
+            span.set_attribute("faq_count", len(faqs))
+            if not faqs:
+                # Keep serving the previous snapshot rather than blanking the examples
+                return self.load_faq_snapshot()
 
+            snapshot = {
+                "generated_at": datetime.now(timezone.utc).isoformat(),
+                "faqs": faqs
+            }
+            tmp_path = f"{self.faq_snapshot_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(snapshot, f, ensure_ascii=False)
+            os.replace(tmp_path, self.faq_snapshot_path)
+            return snapshot
+
+
+import asyncio
 
-handler = ChatMemoryHandler()
 
 async def main():
-    faqs = await handler.get_semantic_faqs()
+    handler = ChatMemoryHandler()
+    # Also usable as a scheduled job to rebuild the FAQ snapshot
+    faqs = (await handler.refresh_faq_snapshot())["faqs"]
     for faq in faqs:
         
         print("\n",faq["representative_question"],faq["similar_questions"],"\n")
@@ -1,6 +1,5 @@
 # cosmosConnector.py
 from jsonschema import ValidationError
-from langchain_openai import AzureOpenAIEmbeddings
 from models.converterModels import PowerConverter
 import os
 from azure.cosmos import CosmosClient, exceptions
@@ -11,27 +10,26 @@ from dotenv import load_dotenv
 from semantic_kernel.functions import kernel_function
 from rapidfuzz import process, fuzz
 from CosmosDBHandlers.cosmosChatHistoryHandler import ChatMemoryHandler
+from CosmosDBHandlers.embeddingService import get_embedding_service
+from tracing.chatTracer import tracer, record_cosmos_response
 load_dotenv()
 # Initialize logging
 logger = logging.getLogger(__name__)
 
 class CosmosLampHandler:
     
-    def __init__(self, logger: Optional[logging.Logger] = None):
+    def __init__(self, logger: Optional[logging.Logger] = None, chat_memory_handler: Optional[ChatMemoryHandler] = None):
         self.client = CosmosClient(
             os.getenv("AZURE_COSMOS_DB_ENDPOINT"),
             os.getenv("AZURE_COSMOS_DB_KEY")
         )
-        self.chat_memory_handler = ChatMemoryHandler()
+        # Share the app's handler so SQL logs go through the same log worker and spool
+        self.chat_memory_handler = chat_memory_handler or ChatMemoryHandler()
         self.database = self.client.get_database_client("TAL_DB")
         self.container = self.database.get_container_client("Converters")
         self.logger = logging.Logger("test")
         # self.logger = logger
-        self.embedding_model = AzureOpenAIEmbeddings(
-            azure_endpoint=os.environ["OPENAI_API_ENDPOINT"],
-            azure_deployment=os.environ["OPENAI_EMBEDDINGS_MODEL_DEPLOYMENT"],
-            api_key=os.environ["AZURE_OPENAI_KEY"]
-        )
+        self.embedding_service = get_embedding_service(logger)
     
     def _fuzzy_match_lamp(self, query: str, targets: list[str], threshold=60) -> list:
         """Advanced partial matching"""
@@ -58,10 +56,18 @@ class CosmosLampHandler:
             .strip()
         )
 
+    def _query_items(self, query: str, **kwargs) -> List[Dict]:
+        """Run a converters query inside a trace span with RU and item count"""
+        with tracer.span("cosmos_query", container="Converters", query=query) as span:
+            items = list(self.container.query_items(query=query, **kwargs))
+            record_cosmos_response(span, self.container, len(items))
+            return items
+
     async def _generate_embedding(self, query: str) -> List[float]:
         """Generate embedding for the given query using Azure OpenAI"""
         try:
-            return self.embedding_model.embed_query(query)
+            with tracer.span("embedding", texts=1):
+                return await self.embedding_service.embed(query)
         except Exception as e:
             self.logger.error(f"Embedding generation failed: {str(e)}")
             raise
@@ -73,7 +79,7 @@ class CosmosLampHandler:
             query = "SELECT * FROM c WHERE c.artnr = @artnr"
             
             # Collect results properly
-            result = self.container.query_items(
+            result = self._query_items(
                 query=query,
                 parameters=parameters           
             )
@@ -98,10 +104,10 @@ class CosmosLampHandler:
             query = "SELECT * FROM c WHERE c.artnr = @artnr"
             
             # Collect results properly
-            results = [item for item in list(self.container.query_items(
+            results = [item for item in self._query_items(
                 query=query,
                 parameters=parameters
-            ))]
+            )]
             
             if not results:
                 return []
@@ -121,9 +127,9 @@ class CosmosLampHandler:
                 *
             FROM c WHERE IS_DEFINED(c.lamps)"""
             converters = []
-            results = list(self.container.query_items(
+            results = self._query_items(
                                                     query=query,
-                                                    enable_cross_partition_query=True))
+                                                    enable_cross_partition_query=True)
             for item in results:
                 lamp_keys = item.get("lamps", {}).keys()
                 lamp_type = self._normalize_lamp_name(lamp_type)
@@ -151,10 +157,10 @@ class CosmosLampHandler:
             SELECT c.lamps FROM c 
             WHERE c.artnr = @artnr
             """
-            results_iter = list(self.container.query_items(
+            results_iter = self._query_items(
                 query=query,
                 parameters=parameters
-            ))
+            )
 
             results = [item for item in results_iter]  # Collect results asynchronously
 
@@ -192,10 +198,10 @@ class CosmosLampHandler:
         try:
             # Base query construction
             query = "SELECT * FROM c WHERE IS_DEFINED(c.dimmability)"
-            results = list(self.container.query_items(
+            results = self._query_items(
                 query=query,
                 enable_cross_partition_query=True
-            ))
+            )
             
             converters = []
             for item in results:
@@ -238,10 +244,10 @@ class CosmosLampHandler:
     async def query_converters(self, query: str, user_input:str) -> List[PowerConverter]:
         try:
             print(f"Executing query: {query}")
-            items = list(self.container.query_items(
+            items = self._query_items(
                 query=query,
                 enable_cross_partition_query=True
-            ))
+            )
             print(f"Query returned {len(items)} items")
             items = items[:10] 
 
@@ -258,9 +264,9 @@ class CosmosLampHandler:
             return str(items)
         
         except exceptions.CosmosHttpResponseError as ex:
-            await self.chat_memory_handler.log_sql_query(user_input, query, "error")
+            await self.chat_memory_handler.log_sql_query(user_input, query, "error", error=ex)
             print(f"Cosmos DB error: {ex}")
-            self.logger.error(f"Bad request SQL failed: {str(e)}")
+            self.logger.error(f"Bad request SQL failed: {str(ex)}")
             return [] 
         
         except Exception as e:
@@ -303,10 +309,10 @@ class CosmosLampHandler:
                 
             query = "SELECT * FROM c" + (" WHERE " + " AND ".join(query_parts) if query_parts else "")
             
-            results = list(self.container.query_items(
+            results = self._query_items(
                 query=query,
                 enable_cross_partition_query=True
-            ))
+            )
             
             converters = []
             for item in results:
@@ -0,0 +1,157 @@
+# embeddingCodec.py
+"""Compact storage of question embeddings in ChatHistory.
+
+EMBEDDING_STORAGE selects what the log worker writes:
+
+    float32  the embedding as returned, about 30 KB of JSON at 1536 dimensions
+    int8     scaled to -127..127 per vector, about 6 KB; Cosmos DB indexes it
+             as an int8 vector
+    binary   one sign bit per dimension, base64 in embeddingBits (256
+             characters at 1536 dimensions); not indexable, searched by
+             Hamming distance and rescored with the full query vector
+
+Cosine similarity ignores the length of a vector, so int8 needs no stored
+scale. Readers decode whatever a document holds, so containers with a mix
+of old and new records keep working.
+"""
+import base64
+import math
+import os
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+from CosmosDBHandlers.containerPolicies import EMBEDDING_DIMENSIONS, EMBEDDING_STORAGE, SIMILAR_QUESTIONS_QUERY
+
+STORAGE_TYPES = ("float32", "int8", "binary")
+BINARY_FIELD = "embeddingBits"
+# Hamming-distance candidates per result that are rescored with the float query
+BINARY_RESCORE_FACTOR = int(os.getenv("BINARY_RESCORE_FACTOR", "10"))
+
+BINARY_CANDIDATES_QUERY = f"SELECT c.id, c.{BINARY_FIELD} FROM c WHERE IS_DEFINED(c.{BINARY_FIELD})"
+DOCUMENTS_BY_ID_QUERY = (
+    "SELECT c.id, c.question, c.answer, c.functionUsed, c.timestamp FROM c WHERE ARRAY_CONTAINS(@ids, c.id)"
+)
+
+
+def _unit(vector, dimensions: Optional[int] = None) -> Optional[np.ndarray]:
+    """Float32 unit vector; longer vectors are cut to dimensions (text-embedding-3 allows that)"""
+    array = np.asarray(vector, dtype=np.float32)
+    if dimensions and len(array) > dimensions:
+        array = array[:dimensions]
+    norm = np.linalg.norm(array)
+    return array / norm if norm else None
+
+
+def quantize_int8(vector) -> List[int]:
+    array = np.asarray(vector, dtype=np.float32)
+    scale = float(np.abs(array).max()) or 1.0
+    return np.rint(array * (127.0 / scale)).astype(np.int8).tolist()
+
+
+def pack_bits(vector) -> str:
+    return base64.b64encode(np.packbits(np.asarray(vector) > 0).tobytes()).decode("ascii")
+
+
+def unpack_bits(bits: str, dimensions: Optional[int] = None) -> np.ndarray:
+    """Sign vector of +1/-1 from a packed code"""
+    unpacked = np.unpackbits(np.frombuffer(base64.b64decode(bits), dtype=np.uint8))
+    if dimensions:
+        unpacked = unpacked[:dimensions]
+    return unpacked.astype(np.float32) * 2 - 1
+
+
+def encode_embedding(vector: List[float], storage: str = EMBEDDING_STORAGE,
+                     dimensions: int = EMBEDDING_DIMENSIONS) -> Dict:
+    """Document fields holding the embedding in the configured storage"""
+    if storage not in STORAGE_TYPES:
+        raise ValueError(f"Unknown embedding storage {storage!r}, expected one of {STORAGE_TYPES}")
+    unit = _unit(vector, dimensions)
+    if unit is None:
+        return {}
+    if storage == "int8":
+        return {"embedding": quantize_int8(unit)}
+    if storage == "binary":
+        return {BINARY_FIELD: pack_bits(unit)}
+    return {"embedding": unit.tolist() if len(vector) > dimensions else vector}
+
+
+def has_embedding(doc: Dict) -> bool:
+    return bool(doc.get("embedding") or doc.get(BINARY_FIELD))
+
+
+def decode_embedding(doc: Dict, dimensions: Optional[int] = None) -> Optional[np.ndarray]:
+    """Unit float32 vector of a document in any storage, None if it has none"""
+    if doc.get("embedding"):
+        return _unit(doc["embedding"], dimensions)
+    if doc.get(BINARY_FIELD):
+        return _unit(unpack_bits(doc[BINARY_FIELD], dimensions))
+    return None
+
+
+def recode_embedding(doc: Dict, storage: str = EMBEDDING_STORAGE, dimensions: int = EMBEDDING_DIMENSIONS) -> Dict:
+    """Rewrite a document's embedding into another storage, e.g. while migrating.
+    Sign codes cannot be expanded again and are kept as they are."""
+    if not doc.get("embedding"):
+        return doc
+    vector = doc.pop("embedding")
+    doc.update(encode_embedding(vector, storage, dimensions))
+    return doc
+
+
+def similarity_threshold(threshold: float, storage: str = EMBEDDING_STORAGE) -> float:
+    """Cosine threshold on decoded vectors. Two vectors at cosine s have sign codes
+    whose normalized dot product is 2/pi * asin(s), so binary thresholds move down."""
+    if storage == "binary":
+        return 2 / math.pi * math.asin(max(-1.0, min(1.0, threshold)))
+    return threshold
+
+
+def query_embedding(vector: List[float], storage: str = EMBEDDING_STORAGE,
+                    dimensions: int = EMBEDDING_DIMENSIONS) -> List:
+    """The @embedding parameter for VectorDistance against this storage"""
+    return encode_embedding(vector, "int8" if storage == "int8" else "float32", dimensions)["embedding"]
+
+
+def _query(container, query: str, parameters: List[Dict], on_page: Optional[Callable[[Dict], None]]) -> List[Dict]:
+    """All results of a cross-partition query; on_page sees the headers of every page"""
+    result = container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True)
+    items: List[Dict] = []
+    for page in result.by_page() if hasattr(result, "by_page") else [result]:
+        items.extend(page)
+        if on_page is not None:
+            on_page(container.client_connection.last_response_headers or {})
+    return items
+
+
+def similar_documents(container, vector: List[float], limit: int = 5, storage: str = EMBEDDING_STORAGE,
+                      dimensions: int = EMBEDDING_DIMENSIONS,
+                      on_page: Optional[Callable[[Dict], None]] = None) -> List[Dict]:
+    """Logged questions closest to the vector, most similar first"""
+    if storage != "binary":
+        return _query(container, SIMILAR_QUESTIONS_QUERY, [
+            {"name": "@limit", "value": limit},
+            {"name": "@embedding", "value": query_embedding(vector, storage, dimensions)}
+        ], on_page)
+
+    query = _unit(vector, dimensions)
+    rows = _query(container, BINARY_CANDIDATES_QUERY, [], on_page)
+    if query is None or not rows:
+        return []
+    codes = np.vstack([np.frombuffer(base64.b64decode(row[BINARY_FIELD]), dtype=np.uint8) for row in rows])
+    query_code = np.packbits(query > 0)
+    if codes.shape[1] != len(query_code):
+        raise ValueError(f"Stored sign codes have {codes.shape[1] * 8} bits, the query {len(query)} dimensions")
+
+    hamming = np.unpackbits(codes ^ query_code, axis=1).sum(axis=1)
+    candidates = np.argsort(hamming, kind="stable")[:limit * BINARY_RESCORE_FACTOR]
+    # Asymmetric rescoring: the full query against the stored signs
+    signs = np.unpackbits(codes[candidates], axis=1)[:, :len(query)].astype(np.float32) * 2 - 1
+    scores = signs @ query / math.sqrt(len(query))
+    order = np.argsort(-scores, kind="stable")[:limit]
+    best = {rows[candidates[i]]["id"]: float(scores[i]) for i in order}
+
+    docs = _query(container, DOCUMENTS_BY_ID_QUERY, [{"name": "@ids", "value": list(best)}], on_page)
+    for doc in docs:
+        doc["similarity"] = best[doc["id"]]
+    return sorted(docs, key=lambda doc: -doc["similarity"])
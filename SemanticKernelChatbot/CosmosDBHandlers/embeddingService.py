@@ -0,0 +1,184 @@
+# embeddingService.py
+import asyncio
+import bisect
+import logging
+import os
+import threading
+import time
+import weakref
+from typing import Dict, List, Optional, Tuple
+
+from langchain_openai import AzureOpenAIEmbeddings
+from dotenv import load_dotenv
+load_dotenv()
+
+
+class TokenBucket:
+    """Per-minute rate limit that refills continuously"""
+
+    def __init__(self, per_minute: float):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.updated = time.monotonic()
+        # Shared by event loops in different threads (e.g. background refresh jobs)
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        # A single request larger than the bucket would wait forever
+        amount = min(amount, self.capacity)
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                wait = (amount - self.tokens) / self.rate
+            await asyncio.sleep(wait)
+
+
+class Histogram:
+    """Fixed-bucket histogram for batch sizes and latencies"""
+
+    def __init__(self, bounds: List[float]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.total = 0.0
+        self.n = 0
+
+    def record(self, value: float):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.total += value
+        self.n += 1
+
+    def to_dict(self) -> Dict:
+        labels = [f"<={b}" for b in self.bounds] + [f">{self.bounds[-1]}"]
+        return {
+            "count": self.n,
+            "mean": self.total / self.n if self.n else 0,
+            "buckets": dict(zip(labels, self.counts))
+        }
+
+
+class EmbeddingService:
+    """Shared embedding client that coalesces concurrent requests.
+
+    Requests arriving within max_wait_ms of each other are sent as one
+    embed_documents call, identical texts in a batch are embedded once,
+    and calls are throttled by per-minute token and request budgets.
+    """
+
+    def __init__(
+        self,
+        embedding_model=None,
+        logger: Optional[logging.Logger] = None,
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0,
+        tokens_per_minute: Optional[int] = None,
+        requests_per_minute: Optional[int] = None
+    ):
+        # Only text-embedding-3 deployments accept a dimensions parameter
+        dimensions = os.getenv("EMBEDDING_DIMENSIONS")
+        self.embedding_model = embedding_model or AzureOpenAIEmbeddings(
+            azure_endpoint=os.environ["OPENAI_API_ENDPOINT"],
+            azure_deployment=os.environ["OPENAI_EMBEDDINGS_MODEL_DEPLOYMENT"],
+            api_key=os.environ["AZURE_OPENAI_KEY"],
+            **({"dimensions": int(dimensions)} if dimensions else {})
+        )
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.token_bucket = TokenBucket(tokens_per_minute or int(os.getenv("OPENAI_EMBEDDINGS_TPM", "120000")))
+        self.request_bucket = TokenBucket(requests_per_minute or int(os.getenv("OPENAI_EMBEDDINGS_RPM", "720")))
+
+        self.batch_sizes = Histogram([1, 2, 4, 8, 16, 32, 64])
+        self.latencies_ms = Histogram([50, 100, 200, 400, 800, 1600, 3200])
+        self.requested = 0
+        self.round_trips = 0
+
+        # Pending batch per event loop; futures cannot cross loops
+        self._batches = weakref.WeakKeyDictionary()
+
+    async def embed(self, text: str) -> List[float]:
+        """Embed a single text, batched with other concurrent callers"""
+        return (await self.embed_many([text]))[0]
+
+    async def embed_many(self, texts: List[str]) -> List[List[float]]:
+        """Embed several texts, sharing a batch with concurrent callers"""
+        loop = asyncio.get_running_loop()
+        state = self._batches.get(loop)
+        if state is None:
+            state = self._batches[loop] = {"pending": [], "flush_handle": None}
+
+        futures = []
+        for text in texts:
+            future = loop.create_future()
+            state["pending"].append((text, future))
+            futures.append(future)
+        self.requested += len(texts)
+
+        if len(state["pending"]) >= self.max_batch_size:
+            self._flush(loop)
+        elif state["flush_handle"] is None:
+            state["flush_handle"] = loop.call_later(self.max_wait, self._flush, loop)
+
+        return list(await asyncio.gather(*futures))
+
+    def _flush(self, loop):
+        state = self._batches[loop]
+        if state["flush_handle"] is not None:
+            state["flush_handle"].cancel()
+            state["flush_handle"] = None
+        pending = state["pending"]
+        while pending:
+            batch, pending = pending[:self.max_batch_size], pending[self.max_batch_size:]
+            loop.create_task(self._send(batch))
+        state["pending"] = pending
+
+    async def _send(self, batch: List[Tuple[str, asyncio.Future]]):
+        unique_texts = list(dict.fromkeys(text for text, _ in batch))
+        try:
+            # Rough token estimate; the real count is only known after the call
+            await self.request_bucket.acquire(1)
+            await self.token_bucket.acquire(sum(len(t) // 4 + 1 for t in unique_texts))
+
+            start = time.perf_counter()
+            vectors = await asyncio.to_thread(self.embedding_model.embed_documents, unique_texts)
+            self.latencies_ms.record((time.perf_counter() - start) * 1000)
+            self.batch_sizes.record(len(unique_texts))
+            self.round_trips += 1
+
+            by_text = dict(zip(unique_texts, vectors))
+            for text, future in batch:
+                if not future.done():
+                    future.set_result(by_text[text])
+        except Exception as e:
+            self.logger.error(f"Embedding generation failed: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def get_stats(self) -> Dict:
+        """Batch-size and latency histograms plus round-trip savings"""
+        return {
+            "requested_texts": self.requested,
+            "round_trips": self.round_trips,
+            "batch_size": self.batch_sizes.to_dict(),
+            "latency_ms": self.latencies_ms.to_dict()
+        }
+
+
+_embedding_service: Optional[EmbeddingService] = None
+
+
+def get_embedding_service(logger: Optional[logging.Logger] = None) -> EmbeddingService:
+    """Process-wide embedding service shared by all handlers"""
+    global _embedding_service
+    if _embedding_service is None:
+        _embedding_service = EmbeddingService(logger=logger)
+    return _embedding_service
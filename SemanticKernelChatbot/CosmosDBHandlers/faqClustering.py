@@ -0,0 +1,500 @@
+# faqClustering.py
+"""Batch job that clusters logged questions into FAQs.
+
+Reads the stored question embeddings from ChatHistory in one pass,
+clusters them with vectorized numpy (greedy leader clustering on
+normalized dot products, refined with a few spherical k-means steps) and
+materializes the largest clusters into the FAQClusters container, where
+get_semantic_faqs reads them with a single query.
+
+Between runs OnlineFAQClusterer keeps the clusters current: the chat log
+worker assigns each newly embedded question to its nearest centroid.
+
+Run from the SemanticKernelChatbot directory, e.g. nightly:
+
+    python -m CosmosDBHandlers.faqClustering --similarity 0.85
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from CosmosDBHandlers.containerMigration import MAX_BATCH_OPERATIONS, batch_chunks
+from CosmosDBHandlers.containerPolicies import EMBEDDING_DIMENSIONS
+from CosmosDBHandlers.embeddingCodec import BINARY_FIELD, decode_embedding, similarity_threshold
+from tracing.chatTracer import tracer
+
+FAQ_CLUSTER_SET = "faq"
+MAX_CLUSTERS = 50
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def group_exact_questions(rows: Iterable[Dict]) -> Tuple[List[str], np.ndarray, np.ndarray]:
+    """Collapse identical questions; returns texts, mean unit embeddings and counts"""
+    index: Dict[str, int] = {}
+    texts: List[str] = []
+    sums: List[np.ndarray] = []
+    counts: List[int] = []
+    for row in rows:
+        question = (row.get("question") or "").strip()
+        # Stored as float32, int8 or sign bits; records of another size are skipped
+        vector = decode_embedding(row, EMBEDDING_DIMENSIONS)
+        if not question or vector is None or len(vector) != EMBEDDING_DIMENSIONS:
+            continue
+        key = " ".join(question.lower().split())
+        if key not in index:
+            index[key] = len(texts)
+            texts.append(question)
+            sums.append(vector.copy())
+            counts.append(1)
+        else:
+            i = index[key]
+            sums[i] += vector
+            counts[i] += 1
+    if not texts:
+        return [], np.zeros((0, 0), dtype=np.float32), np.zeros(0, dtype=np.int64)
+    return texts, normalize_rows(np.vstack(sums)), np.asarray(counts, dtype=np.int64)
+
+
+def cluster_embeddings(
+    vectors: np.ndarray,
+    counts: np.ndarray,
+    similarity: float = 0.85,
+    iterations: int = 3
+) -> Tuple[np.ndarray, np.ndarray]:
+    """Cluster unit vectors; returns (labels, centroids).
+
+    Leaders are taken in order of frequency and absorb every unassigned
+    question above the similarity threshold (one matrix-vector product per
+    leader). Count-weighted spherical k-means steps then move centroids to
+    the middle of their clusters and reassign with one matrix product.
+    """
+    n = len(vectors)
+    labels = np.full(n, -1, dtype=np.int64)
+    leaders: List[int] = []
+    for i in np.argsort(-counts, kind="stable"):
+        if labels[i] != -1:
+            continue
+        unassigned = np.flatnonzero(labels == -1)
+        sims = vectors[unassigned] @ vectors[i]
+        labels[unassigned[sims >= similarity]] = len(leaders)
+        leaders.append(i)
+
+    centroids = vectors[leaders]
+    for _ in range(iterations):
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, vectors * counts[:, None])
+        centroids = normalize_rows(sums)
+        sims = vectors @ centroids.T
+        best = sims.argmax(axis=1)
+        # Keep a question in its own cluster unless another centroid is close enough
+        keep = sims[np.arange(n), best] < similarity
+        best[keep] = labels[keep]
+        if np.array_equal(best, labels):
+            break
+        labels = best
+    return labels, centroids
+
+
+def build_clusters(
+    texts: List[str],
+    vectors: np.ndarray,
+    counts: np.ndarray,
+    labels: np.ndarray,
+    centroids: np.ndarray,
+    max_clusters: int = MAX_CLUSTERS,
+    max_members: int = 20
+) -> List[Dict]:
+    """Cluster documents, largest first, in the shape get_semantic_faqs returns"""
+    totals = np.bincount(labels, weights=counts, minlength=len(centroids))
+    clusters = []
+    for rank, label in enumerate(np.argsort(-totals, kind="stable")[:max_clusters]):
+        members = np.flatnonzero(labels == label)
+        if len(members) == 0:
+            continue
+        member_sims = vectors[members] @ centroids[label]
+        # Most asked wording first; closeness to the centroid breaks ties
+        order = members[np.lexsort((-member_sims, -counts[members]))]
+        sims_by_member = dict(zip(members.tolist(), member_sims.tolist()))
+        top = order[:max_members]
+        clusters.append({
+            "id": f"cluster-{rank:03d}",
+            "clusterSet": FAQ_CLUSTER_SET,
+            "rank": rank,
+            "representative_question": texts[order[0]],
+            "similar_questions": [texts[i] for i in top],
+            "question_counts": {texts[i]: int(counts[i]) for i in top},
+            "similarity_scores": {texts[i]: round(sims_by_member[i], 4) for i in top},
+            "total_occurrences": int(totals[label]),
+            "member_count": int(len(members)),
+            "centroid": [round(float(x), 6) for x in centroids[label]]
+        })
+    return clusters
+
+
+class FAQClusterJob:
+    def __init__(self, chat_memory_handler, logger: Optional[logging.Logger] = None):
+        self.handler = chat_memory_handler
+        self.logger = logger or logging.getLogger(__name__)
+        self._loaded = 0
+
+    def load_rows(self) -> Iterable[Dict]:
+        """Stream question embeddings page by page; one pass over the container"""
+        query = (f"SELECT c.question, c.embedding, c.{BINARY_FIELD} FROM c "
+                 f"WHERE IS_DEFINED(c.embedding) OR IS_DEFINED(c.{BINARY_FIELD})")
+        for row in self.handler.chat_container.query_items(
+            query=query,
+            enable_cross_partition_query=True
+        ):
+            self._loaded += 1
+            yield row
+
+    def run(self, similarity: float = 0.85, max_clusters: int = MAX_CLUSTERS, dry_run: bool = False) -> Dict:
+        started = time.perf_counter()
+        self._loaded = 0
+        texts, vectors, counts = group_exact_questions(self.load_rows())
+        loaded = time.perf_counter()
+        if not texts:
+            self.logger.warning("No embedded questions found; FAQ clusters left unchanged")
+            return {"questions": self._loaded, "clusters_written": 0}
+
+        labels, centroids = cluster_embeddings(vectors, counts, similarity=similarity_threshold(similarity))
+        generated_at = datetime.now(timezone.utc).isoformat()
+        clusters = build_clusters(texts, vectors, counts, labels, centroids, max_clusters=max_clusters)
+        for cluster in clusters:
+            cluster["generated_at"] = generated_at
+            # Online clustering reloads when it sees a newer baseline
+            cluster["baseline_at"] = generated_at
+            cluster["similarity_threshold"] = similarity
+        clustered = time.perf_counter()
+
+        if not dry_run:
+            self.write_clusters(clusters)
+
+        return {
+            "questions": self._loaded,
+            "unique_questions": len(texts),
+            "clusters_found": int(len(centroids)),
+            "clusters_written": 0 if dry_run else len(clusters),
+            "load_s": round(loaded - started, 2),
+            "cluster_s": round(clustered - loaded, 2),
+            "write_s": round(time.perf_counter() - clustered, 2),
+            "top": [(c["representative_question"], c["total_occurrences"]) for c in clusters[:10]],
+            "clusters": clusters
+        }
+
+    def write_clusters(self, clusters: List[Dict]):
+        """Replace the materialized clusters; batches are sized by operation count and bytes"""
+        container = self.handler.faq_container
+        existing = {item["id"] for item in container.query_items(
+            query="SELECT c.id FROM c WHERE c.clusterSet = @set",
+            parameters=[{"name": "@set", "value": FAQ_CLUSTER_SET}],
+            partition_key=FAQ_CLUSTER_SET
+        )}
+        for chunk in batch_chunks(clusters):
+            container.execute_item_batch(
+                batch_operations=[("upsert", (cluster,)) for cluster in chunk],
+                partition_key=FAQ_CLUSTER_SET
+            )
+        # Clusters opened online since the last run are superseded by this one
+        stale = sorted(existing - {c["id"] for c in clusters})
+        for start in range(0, len(stale), MAX_BATCH_OPERATIONS):
+            container.execute_item_batch(
+                batch_operations=[("delete", (item_id,)) for item_id in stale[start:start + MAX_BATCH_OPERATIONS]],
+                partition_key=FAQ_CLUSTER_SET
+            )
+
+
+
+class OnlineFAQClusterer:
+    """Incremental FAQ clustering at log time.
+
+    Keeps the FAQClusters centroids in memory and assigns each logged
+    question with one matrix-vector product: the nearest cluster gets its
+    count and running centroid updated, or a new cluster is opened when no
+    centroid is similar enough. Changed clusters are upserted every
+    persist_interval seconds; a slower compaction pass merges clusters
+    whose centroids have converged and drops the smallest ones beyond
+    max_clusters, which keeps the per-question cost bounded.
+    """
+
+    def __init__(
+        self,
+        faq_container,
+        logger: Optional[logging.Logger] = None,
+        similarity: Optional[float] = None,
+        merge_similarity: float = 0.92,
+        persist_interval: float = 60.0,
+        compaction_interval: float = 900.0,
+        max_clusters: int = 2000,
+        max_members: int = 20
+    ):
+        self.container = faq_container
+        self.logger = logger or logging.getLogger(__name__)
+        # Thresholds are cosines of the original embeddings; sign codes compare lower
+        self.similarity = similarity_threshold(similarity or float(os.getenv("FAQ_CLUSTER_SIMILARITY", "0.85")))
+        self.merge_similarity = similarity_threshold(merge_similarity)
+        self.persist_interval = persist_interval
+        self.compaction_interval = compaction_interval
+        self.max_clusters = max_clusters
+        self.max_members = max_members
+
+        self.loaded = False
+        self.baseline_at: Optional[str] = None
+        self.ids: List[str] = []
+        self.clusters: List[Dict] = []
+        self._sums: Optional[np.ndarray] = None
+        self._centroids: Optional[np.ndarray] = None
+        self.dirty: set = set()
+        self.deleted: set = set()
+        self._last_persist = time.monotonic()
+        self._last_compaction = time.monotonic()
+
+    # ---- state --------------------------------------------------------
+    @property
+    def size(self) -> int:
+        return len(self.ids)
+
+    def load(self):
+        """Read the current clusters, centroids included, from FAQClusters"""
+        docs = list(self.container.query_items(
+            query="SELECT * FROM c WHERE c.clusterSet = @set AND IS_DEFINED(c.centroid)",
+            parameters=[{"name": "@set", "value": FAQ_CLUSTER_SET}],
+            partition_key=FAQ_CLUSTER_SET
+        ))
+        self.ids, self.clusters = [], []
+        self._sums = self._centroids = None
+        self.dirty, self.deleted = set(), set()
+        self.baseline_at = max((d.get("baseline_at") or "" for d in docs), default=None) or None
+        if docs:
+            centroids = normalize_rows(np.asarray([d["centroid"] for d in docs], dtype=np.float32))
+            totals = np.asarray([max(1, d.get("total_occurrences", 1)) for d in docs], dtype=np.float32)
+            self._allocate(centroids.shape[1], len(docs))
+            self._centroids[:len(docs)] = centroids
+            self._sums[:len(docs)] = centroids * totals[:, None]
+            for doc in docs:
+                self.ids.append(doc["id"])
+                self.clusters.append({
+                    "total_occurrences": int(doc.get("total_occurrences", 0)),
+                    "member_count": int(doc.get("member_count", 0)),
+                    "question_counts": dict(doc.get("question_counts") or {}),
+                    "similarity_scores": dict(doc.get("similarity_scores") or {})
+                })
+        self.loaded = True
+        self.logger.info(f"Loaded {len(docs)} FAQ clusters for online assignment")
+
+    def _allocate(self, dimensions: int, needed: int):
+        """Grow the centroid buffers geometrically so adding a cluster is amortized O(D)"""
+        capacity = 0 if self._sums is None else len(self._sums)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2, 64)
+        sums = np.zeros((new_capacity, dimensions), dtype=np.float32)
+        centroids = np.zeros((new_capacity, dimensions), dtype=np.float32)
+        if capacity:
+            sums[:self.size] = self._sums[:self.size]
+            centroids[:self.size] = self._centroids[:self.size]
+        self._sums, self._centroids = sums, centroids
+
+    # ---- assignment ---------------------------------------------------
+    def observe(self, question: str, embedding: List[float]) -> Optional[str]:
+        """Assign one logged question; returns the cluster id"""
+        question = (question or "").strip()
+        if not question or embedding is None or not len(embedding):
+            return None
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm == 0:
+            return None
+        vector /= norm
+
+        best, similarity = -1, -1.0
+        if self.size:
+            sims = self._centroids[:self.size] @ vector
+            best = int(sims.argmax())
+            similarity = float(sims[best])
+
+        if best >= 0 and similarity >= self.similarity:
+            self._sums[best] += vector
+            self._centroids[best] = self._sums[best] / (np.linalg.norm(self._sums[best]) or 1.0)
+        else:
+            best = self._open_cluster(vector)
+            similarity = 1.0
+
+        cluster = self.clusters[best]
+        cluster["total_occurrences"] += 1
+        counts = cluster["question_counts"]
+        if question not in counts:
+            cluster["member_count"] += 1
+        counts[question] = counts.get(question, 0) + 1
+        cluster["similarity_scores"][question] = round(similarity, 4)
+        self._trim_members(cluster)
+        self.dirty.add(self.ids[best])
+        return self.ids[best]
+
+    def _open_cluster(self, vector: np.ndarray) -> int:
+        self._allocate(len(vector), self.size + 1)
+        index = self.size
+        self._sums[index] = vector
+        self._centroids[index] = vector
+        self.ids.append(f"online-{uuid.uuid4().hex[:12]}")
+        self.clusters.append({"total_occurrences": 0, "member_count": 0, "question_counts": {}, "similarity_scores": {}})
+        return index
+
+    def _trim_members(self, cluster: Dict):
+        """Bound the tracked wordings per cluster, keeping the most frequent"""
+        counts = cluster["question_counts"]
+        if len(counts) <= self.max_members * 4:
+            return
+        keep = sorted(counts, key=counts.get, reverse=True)[:self.max_members * 2]
+        cluster["question_counts"] = {q: counts[q] for q in keep}
+        cluster["similarity_scores"] = {q: cluster["similarity_scores"].get(q, 0.0) for q in keep}
+
+    # ---- compaction ---------------------------------------------------
+    def compact(self):
+        """Merge converged clusters and drop the smallest beyond max_clusters"""
+        if self.size < 2:
+            return
+        totals = np.asarray([c["total_occurrences"] for c in self.clusters], dtype=np.float64)
+        centroids = self._centroids[:self.size]
+        sims = centroids @ centroids.T
+        np.fill_diagonal(sims, -1.0)
+
+        removed = np.zeros(self.size, dtype=bool)
+        for i in np.argsort(-totals, kind="stable"):
+            if removed[i]:
+                continue
+            for j in np.flatnonzero((sims[i] >= self.merge_similarity) & ~removed):
+                self._merge(i, j)
+                removed[j] = True
+
+        survivors = np.flatnonzero(~removed)
+        if len(survivors) > self.max_clusters:
+            order = survivors[np.argsort(-totals[survivors], kind="stable")]
+            removed[order[self.max_clusters:]] = True
+            survivors = np.sort(order[:self.max_clusters])
+
+        if removed.any():
+            self.deleted.update(self.ids[i] for i in np.flatnonzero(removed))
+            self.dirty.difference_update(self.deleted)
+            self.ids = [self.ids[i] for i in survivors]
+            self.clusters = [self.clusters[i] for i in survivors]
+            self._sums[:len(survivors)] = self._sums[survivors]
+            self._centroids[:len(survivors)] = normalize_rows(self._sums[:len(survivors)])
+            self.logger.info(f"FAQ compaction removed {int(removed.sum())} clusters, {self.size} remain")
+
+    def _merge(self, into: int, source: int):
+        self._sums[into] += self._sums[source]
+        self._centroids[into] = self._sums[into] / (np.linalg.norm(self._sums[into]) or 1.0)
+        target, other = self.clusters[into], self.clusters[source]
+        target["total_occurrences"] += other["total_occurrences"]
+        target["member_count"] += other["member_count"]
+        for question, count in other["question_counts"].items():
+            target["question_counts"][question] = target["question_counts"].get(question, 0) + count
+            target["similarity_scores"].setdefault(question, other["similarity_scores"].get(question, 0.0))
+        self._trim_members(target)
+        self.dirty.add(self.ids[into])
+
+    # ---- persistence --------------------------------------------------
+    async def maybe_persist(self):
+        """Called from the log worker loop; does Cosmos I/O off the event loop"""
+        now = time.monotonic()
+        if now - self._last_compaction >= self.compaction_interval:
+            self._last_compaction = now
+            self.compact()
+        if (self.dirty or self.deleted) and now - self._last_persist >= self.persist_interval:
+            self._last_persist = now
+            try:
+                with tracer.span("faq_cluster_persist", clusters=len(self.dirty), deleted=len(self.deleted)):
+                    await asyncio.to_thread(self.persist)
+            except Exception as e:
+                self.logger.error(f"Failed to persist FAQ clusters: {str(e)}")
+
+    def persist(self):
+        baseline = list(self.container.query_items(
+            query="SELECT VALUE MAX(c.baseline_at) FROM c WHERE c.clusterSet = @set",
+            parameters=[{"name": "@set", "value": FAQ_CLUSTER_SET}],
+            partition_key=FAQ_CLUSTER_SET
+        ))
+        if baseline and baseline[0] and baseline[0] != self.baseline_at:
+            # The batch job re-clustered everything; its counts supersede ours
+            self.logger.info("New FAQ cluster baseline found, reloading")
+            self.load()
+            return
+
+        index = {cluster_id: i for i, cluster_id in enumerate(self.ids)}
+        # Ids no longer in memory were merged away; their delete is already queued
+        self.dirty.intersection_update(index)
+        docs = [self._to_doc(index[cluster_id]) for cluster_id in self.dirty]
+        # Full cluster documents reach the 2 MB batch limit well before 100 operations
+        for chunk in batch_chunks(docs):
+            self.container.execute_item_batch(
+                batch_operations=[("upsert", (doc,)) for doc in chunk],
+                partition_key=FAQ_CLUSTER_SET
+            )
+            # A failed chunk keeps its ids (and the ones after it) dirty for the next persist
+            self.dirty.difference_update(doc["id"] for doc in chunk)
+        deleted = sorted(self.deleted)
+        for start in range(0, len(deleted), MAX_BATCH_OPERATIONS):
+            chunk = deleted[start:start + MAX_BATCH_OPERATIONS]
+            self.container.execute_item_batch(
+                batch_operations=[("delete", (cluster_id,)) for cluster_id in chunk],
+                partition_key=FAQ_CLUSTER_SET
+            )
+            self.deleted.difference_update(chunk)
+
+    def _to_doc(self, index: int) -> Dict:
+        cluster = self.clusters[index]
+        counts = cluster["question_counts"]
+        top = sorted(counts, key=counts.get, reverse=True)[:self.max_members]
+        return {
+            "id": self.ids[index],
+            "clusterSet": FAQ_CLUSTER_SET,
+            "representative_question": top[0] if top else "",
+            "similar_questions": top,
+            "question_counts": {q: counts[q] for q in top},
+            "similarity_scores": {q: cluster["similarity_scores"].get(q, 0.0) for q in top},
+            "total_occurrences": cluster["total_occurrences"],
+            "member_count": cluster["member_count"],
+            "centroid": [round(float(x), 6) for x in self._centroids[index]],
+            "baseline_at": self.baseline_at,
+            "updated_at": datetime.now(timezone.utc).isoformat(),
+            "similarity_threshold": self.similarity
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cluster logged questions into FAQClusters")
+    parser.add_argument("--similarity", type=float, default=float(os.getenv("FAQ_CLUSTER_SIMILARITY", "0.85")),
+                        help="Cosine similarity needed to join a cluster")
+    parser.add_argument("--max-clusters", type=int, default=MAX_CLUSTERS)
+    parser.add_argument("--dry-run", action="store_true", help="Cluster without writing to Cosmos DB")
+    parser.add_argument("--output", help="Also write the clusters as JSON to this file")
+    args = parser.parse_args()
+
+    from CosmosDBHandlers.cosmosChatHistoryHandler import ChatMemoryHandler
+    logging.basicConfig(level=logging.INFO)
+    job = FAQClusterJob(ChatMemoryHandler(logger=logging.getLogger("faqClustering")))
+    report = job.run(similarity=args.similarity, max_clusters=min(args.max_clusters, MAX_CLUSTERS), dry_run=args.dry_run)
+
+    clusters = report.pop("clusters", [])
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump([{k: v for k, v in c.items() if k != "centroid"} for c in clusters], f, ensure_ascii=False, indent=2)
+    print(json.dumps(report, indent=2, ensure_ascii=False))
+
+
+if __name__ == "__main__":
+    main()
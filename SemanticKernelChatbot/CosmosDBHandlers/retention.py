@@ -0,0 +1,282 @@
+# retention.py
+"""Tiered retention of the chat logs.
+
+Raw ChatHistory and GeneratedQueries records expire through their ttl
+LOG_RETENTION_DAYS after they were written. Cosmos DB only expires whole
+items, so question embeddings are patched out of chat records older than
+EMBEDDING_RETENTION_DAYS by this job instead. Before either happens,
+every finished day is compacted: its daily rollups (counts per function,
+tier and state, top SQL questions and shapes, sessions, tokens and
+latency histograms) are recomputed from the raw records and marked
+compacted, and a "faq" rollup counts how many of the day's questions fell
+into each FAQ cluster. The daily and all-time rollups are never expired;
+the dashboard reads them for ranges beyond the raw window.
+
+Run from the SemanticKernelChatbot directory, e.g. nightly after the FAQ
+clustering:
+
+    python -m CosmosDBHandlers.retention
+
+Containers created before retention existed need TTL enabled once:
+
+    python -m CosmosDBHandlers.retention --enable-ttl
+"""
+import argparse
+import logging
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from CosmosDBHandlers.containerPolicies import (
+    EMBEDDING_DIMENSIONS, EMBEDDING_RETENTION_DAYS, LOG_PARTITION_KEY, LOG_RETENTION_DAYS, TTL_PER_ITEM,
+    day_partition_keys
+)
+from CosmosDBHandlers.embeddingCodec import BINARY_FIELD, decode_embedding, similarity_threshold
+from CosmosDBHandlers.faqClustering import FAQ_CLUSTER_SET, normalize_rows
+from CosmosDBHandlers.statsRollups import (
+    CHAT_ROLLUP_FIELDS, SQL_ROLLUP_FIELDS, apply_delta, compute_deltas, compute_latency_deltas, empty_rollup,
+    rollup_id
+)
+
+# FAQ clusters listed per daily faq rollup; the rest count as unclustered
+MAX_FAQ_CLUSTERS_PER_DAY = 50
+
+
+def _day_range(day: str):
+    start = datetime.strptime(day, "%Y-%m-%d").replace(tzinfo=timezone.utc)
+    return start.isoformat(), (start + timedelta(days=1)).isoformat()
+
+
+class RetentionJob:
+    """Compacts finished days into rollups and trims old embeddings"""
+
+    def __init__(self, chat_memory_handler, logger: Optional[logging.Logger] = None, workers: int = 8,
+                 max_retries: int = 5):
+        self.handler = chat_memory_handler
+        self.container = chat_memory_handler.rollup_container
+        self.logger = logger or logging.getLogger(__name__)
+        self.workers = workers
+        self.max_retries = max_retries
+        self.similarity = similarity_threshold(float(os.getenv("FAQ_CLUSTER_SIMILARITY", "0.85")))
+        self._faq_centroids = None
+
+    # ---- ttl ------------------------------------------------------------
+    def enable_ttl(self) -> List[str]:
+        """Turn on per-item TTL for containers created without it; returns the ones changed.
+        Replacing a container resets every property not passed, so all of them are carried over."""
+        changed = []
+        for container in (self.handler.chat_container, self.handler.sql_container, self.container):
+            properties = container.read()
+            if properties.get("defaultTtl") is not None:
+                continue
+            self.handler.database.replace_container(
+                container,
+                partition_key=properties["partitionKey"],
+                indexing_policy=properties.get("indexingPolicy"),
+                default_ttl=TTL_PER_ITEM,
+                conflict_resolution_policy=properties.get("conflictResolutionPolicy"),
+                computed_properties=properties.get("computedProperties"),
+                full_text_policy=properties.get("fullTextPolicy"),
+                vector_embedding_policy=properties.get("vectorEmbeddingPolicy")
+            )
+            changed.append(container.id)
+        return changed
+
+    # ---- compaction -----------------------------------------------------
+    def pending_days(self, today: str) -> List[str]:
+        """Finished days that have rollups but were not compacted yet"""
+        days = set()
+        for kind in ("chat", "sql"):
+            days.update(self.container.query_items(
+                query="SELECT VALUE c.bucket FROM c WHERE c.granularity = 'day' AND NOT IS_DEFINED(c.compactedAt)",
+                partition_key=kind
+            ))
+        return sorted(day for day in days if day < today)
+
+    def _records(self, container, partition_path: str, day: str, fields: str) -> List[Dict]:
+        start, end = _day_range(day)
+        query = f"SELECT {fields} FROM c WHERE c.timestamp >= @start AND c.timestamp < @end"
+        parameters = [{"name": "@start", "value": start}, {"name": "@end", "value": end}]
+        if partition_path == LOG_PARTITION_KEY:
+            # Only the day's own partitions are read
+            keys = day_partition_keys(1, now=datetime.fromisoformat(start))
+            query += f" AND c.pk IN ({', '.join(f'@pk{i}' for i in range(len(keys)))})"
+            parameters += [{"name": f"@pk{i}", "value": key} for i, key in enumerate(keys)]
+        return list(container.query_items(query=query, parameters=parameters, enable_cross_partition_query=True))
+
+    def compact_day(self, day: str) -> Dict[str, int]:
+        """Recompute the day's rollups from its raw records; returns records per rollup kind"""
+        chat = self._records(self.handler.chat_container, self.handler.chat_partition_path, day,
+                             f"{CHAT_ROLLUP_FIELDS}, c.question, c.embedding, c.{BINARY_FIELD}")
+        sql = self._records(self.handler.sql_container, self.handler.sql_partition_path, day, SQL_ROLLUP_FIELDS)
+        deltas = {
+            "chat": compute_deltas("chat", chat),
+            "sql": compute_deltas("sql", sql),
+            "latency": compute_latency_deltas(chat)
+        }
+        compacted = {}
+        for kind, kind_deltas in deltas.items():
+            delta = kind_deltas.get(rollup_id(kind, "day", day))
+            doc = self._replace(kind, rollup_id(kind, "day", day), lambda stored: self._day_rollup(kind, day, delta, stored))
+            compacted[kind] = doc.get("total", 0) if doc else 0
+        faq = self._faq_rollup(day, chat)
+        if faq is not None:
+            doc = self._replace("faq", faq["id"], lambda stored: faq if stored is None or faq["total"] >= stored.get("total", 0) else stored)
+            compacted["faq"] = doc.get("total", 0) if doc else 0
+        return compacted
+
+    @staticmethod
+    def _day_rollup(kind: str, day: str, delta: Optional[Dict], stored: Optional[Dict]) -> Optional[Dict]:
+        """The recomputed rollup, unless raw records already expired and the stored one counts more"""
+        if delta is None:
+            return stored
+        rebuilt = apply_delta(empty_rollup(kind, "day", day), delta)
+        if stored is not None and stored.get("total", 0) > rebuilt["total"]:
+            return stored
+        return rebuilt
+
+    def _replace(self, kind: str, doc_id: str, build: Callable[[Optional[Dict]], Optional[Dict]]) -> Optional[Dict]:
+        """Write build(stored) with an ETag condition, so a late log batch updating the same day is not lost"""
+        for _ in range(self.max_retries):
+            try:
+                stored = self.container.read_item(item=doc_id, partition_key=kind)
+            except exceptions.CosmosResourceNotFoundError:
+                stored = None
+            doc = build(stored)
+            if doc is None:
+                return None
+            doc["compactedAt"] = datetime.now(timezone.utc).isoformat()
+            try:
+                if stored is None:
+                    self.container.create_item(body=doc)
+                else:
+                    self.container.replace_item(
+                        item=doc_id, body=doc, etag=stored["_etag"], match_condition=MatchConditions.IfNotModified
+                    )
+                return doc
+            except (exceptions.CosmosResourceExistsError, exceptions.CosmosAccessConditionFailedError):
+                continue
+        self.logger.error(f"Gave up compacting rollup {doc_id} after {self.max_retries} conflicts")
+        return None
+
+    def _load_faq_centroids(self):
+        if self._faq_centroids is None:
+            docs = [d for d in self.handler.faq_container.query_items(
+                query="SELECT c.representative_question, c.centroid FROM c WHERE c.clusterSet = @set AND IS_DEFINED(c.centroid)",
+                parameters=[{"name": "@set", "value": FAQ_CLUSTER_SET}],
+                partition_key=FAQ_CLUSTER_SET
+            ) if d.get("centroid")]
+            questions = [d["representative_question"] for d in docs]
+            centroids = normalize_rows(np.asarray([d["centroid"] for d in docs], dtype=np.float32)) if docs else None
+            self._faq_centroids = (questions, centroids)
+        return self._faq_centroids
+
+    def _faq_rollup(self, day: str, chat: List[Dict]) -> Optional[Dict]:
+        """How many of the day's embedded questions fell into each current FAQ cluster"""
+        vectors = [v for v in (decode_embedding(row, EMBEDDING_DIMENSIONS) for row in chat) if v is not None]
+        questions, centroids = self._load_faq_centroids()
+        vectors = [v for v in vectors if centroids is None or len(v) == centroids.shape[1]]
+        if not vectors:
+            return None
+        counts = Counter()
+        if centroids is not None:
+            sims = np.vstack(vectors) @ centroids.T
+            best = sims.argmax(axis=1)
+            for row, label in enumerate(best):
+                if sims[row, label] >= self.similarity:
+                    counts[questions[label]] += 1
+        clustered = counts.most_common(MAX_FAQ_CLUSTERS_PER_DAY)
+        return {
+            "id": rollup_id("faq", "day", day),
+            "kind": "faq",
+            "granularity": "day",
+            "bucket": day,
+            "total": len(vectors),
+            "clusters": [{"question": question, "count": n} for question, n in clustered],
+            "unclustered": len(vectors) - sum(n for _, n in clustered)
+        }
+
+    # ---- embeddings -----------------------------------------------------
+    def strip_embeddings(self, before_day: str) -> int:
+        """Remove embeddings from chat records logged before the day; returns records patched"""
+        container = self.handler.chat_container
+        field = self.handler.chat_partition_path.lstrip("/")
+        rows = container.query_items(
+            query=f"""
+            SELECT c.id, c.{field} AS partitionKey, c.ttl, c._ts,
+                   IS_DEFINED(c.embedding) AS hasEmbedding, IS_DEFINED(c.{BINARY_FIELD}) AS hasBits
+            FROM c
+            WHERE c.timestamp < @before AND (IS_DEFINED(c.embedding) OR IS_DEFINED(c.{BINARY_FIELD}))
+            """,
+            parameters=[{"name": "@before", "value": _day_range(before_day)[0]}],
+            enable_cross_partition_query=True
+        )
+        now = int(datetime.now(timezone.utc).timestamp())
+
+        def patch(row: Dict) -> int:
+            operations = []
+            if row.get("hasEmbedding"):
+                operations.append({"op": "remove", "path": "/embedding"})
+            if row.get("hasBits"):
+                operations.append({"op": "remove", "path": f"/{BINARY_FIELD}"})
+            if isinstance(row.get("ttl"), int) and row["ttl"] > 0:
+                # A write restarts the ttl; keep the record's original expiry
+                remaining = row["ttl"] - (now - row["_ts"])
+                if remaining <= 0:
+                    return 0
+                operations.append({"op": "set", "path": "/ttl", "value": remaining})
+            try:
+                container.patch_item(item=row["id"], partition_key=row.get("partitionKey"), patch_operations=operations)
+                return 1
+            except exceptions.CosmosResourceNotFoundError:
+                return 0  # expired meanwhile
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            return sum(pool.map(patch, rows))
+
+    def run(self, days: Optional[List[str]] = None, now: Optional[datetime] = None) -> Dict:
+        """Compact the given (or all pending) days, then trim embeddings of compacted days"""
+        today = (now or datetime.now(timezone.utc)).strftime("%Y-%m-%d")
+        pending = self.pending_days(today)
+        report = {"compacted": {}, "embeddings_removed": 0}
+        for day in days or pending:
+            report["compacted"][day] = self.compact_day(day)
+            self.logger.info(f"Compacted {day}: {report['compacted'][day]}")
+
+        if EMBEDDING_RETENTION_DAYS > 0:
+            cutoff = ((now or datetime.now(timezone.utc)) - timedelta(days=EMBEDDING_RETENTION_DAYS)).strftime("%Y-%m-%d")
+            # Never before their day's FAQ counts are rolled up
+            remaining = sorted(set(pending) - set(report["compacted"]))
+            before = min([cutoff] + remaining[:1])
+            report["embeddings_removed"] = self.strip_embeddings(before)
+        return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compact chat logs into daily rollups and trim old embeddings")
+    parser.add_argument("--enable-ttl", action="store_true",
+                        help="Turn on per-item TTL for ChatHistory, GeneratedQueries and StatsRollups")
+    parser.add_argument("--day", action="append", help="Compact this day (YYYY-MM-DD) again; repeatable")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    from CosmosDBHandlers.cosmosChatHistoryHandler import ChatMemoryHandler
+    job = RetentionJob(ChatMemoryHandler(logger=logger), logger=logger)
+
+    if args.enable_ttl:
+        logger.info(f"TTL enabled on: {job.enable_ttl() or 'nothing, all containers had it'}")
+    if LOG_RETENTION_DAYS <= 0:
+        logger.info("LOG_RETENTION_DAYS is not set; raw records are kept, days are still compacted")
+    report = job.run(days=args.day)
+    logger.info(f"Compacted {len(report['compacted'])} days, removed {report['embeddings_removed']} embeddings")
+
+
+if __name__ == "__main__":
+    main()
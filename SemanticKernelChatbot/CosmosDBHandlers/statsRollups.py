@@ -0,0 +1,398 @@
+# statsRollups.py
+"""Materialized counters for the analytics dashboard.
+
+For every hour, day and for all time there is one small document per
+record kind ("chat" or "sql") holding the number of records, counts per
+dimension (functionUsed and tier for chats, state for generated SQL), the
+most frequent SQL questions and query shapes (see sqlFingerprint.py), a
+HyperLogLog sketch of chat session ids and token and cost sums per
+function and prompt source. "latency" documents hold mergeable
+latency histograms (see latencyHistogram.py) per minute, hour and day,
+end-to-end per functionUsed and per tool, each split by model tier.
+The log worker folds each written batch into these documents, so the
+dashboard reads a handful of documents however many chats are stored.
+Hourly and per-minute documents expire after HOURLY_ROLLUP_RETENTION_DAYS
+and MINUTE_ROLLUP_RETENTION_DAYS; daily and all-time documents are kept
+and outlive the raw records (see retention.py).
+
+Rebuild all rollups from the raw containers (e.g. after first deploying
+this, or if updates were lost) from the SemanticKernelChatbot directory:
+
+    python -m CosmosDBHandlers.statsRollups --rebuild
+"""
+import argparse
+import asyncio
+import logging
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
+
+from CosmosDBHandlers.containerPolicies import (
+    HOURLY_ROLLUP_RETENTION_DAYS, LOG_RETENTION_DAYS, MINUTE_ROLLUP_RETENTION_DAYS
+)
+from CosmosDBHandlers.hyperLogLog import HyperLogLog
+from CosmosDBHandlers.latencyHistogram import LatencyHistogram, DEFAULT_ACCURACY
+from CosmosDBHandlers.sqlFingerprint import fingerprint_sql
+
+ROLLUP_KINDS = ("chat", "sql", "latency")
+ROLLUP_DIMENSIONS = {"chat": ("functionUsed", "tier"), "sql": ("state",), "latency": ()}
+# Top SQL questions kept per rollup document; the long tail is dropped
+MAX_TRACKED_QUESTIONS = 100
+MAX_TRACKED_SHAPES = 100
+HLL_PRECISION = 12
+# Token counts and cost of chat records summed per function and per prompt source
+TOKEN_METRICS = ("promptTokens", "cachedTokens", "completionTokens", "toolOutputTokens",
+                 "localPromptTokens", "localCompletionTokens", "estimatedCostUsd")
+SOURCE_TOKEN_METRICS = ("calls", "promptTokens", "cachedTokens", "completionTokens", "toolOutputTokens",
+                        "estimatedCostUsd")
+ROLLUP_RETENTION_DAYS = {"hour": HOURLY_ROLLUP_RETENTION_DAYS, "minute": MINUTE_ROLLUP_RETENTION_DAYS}
+
+# Record fields the rollups are computed from
+CHAT_ROLLUP_FIELDS = ", ".join(f"c.{field}" for field in (
+    "sessionId", "functionUsed", "tier", "latencyMs", "toolLatencyMs", "tokensBySource", *TOKEN_METRICS, "timestamp"
+))
+SQL_ROLLUP_FIELDS = "c.originalQuestion, c.generatedSql, c.fingerprint, c.shape, c.state, c.timestamp"
+
+ROLLUP_INDEXING_POLICY = {
+    "indexingMode": "consistent",
+    "includedPaths": [{"path": "/granularity/?"}, {"path": "/bucket/?"}],
+    "excludedPaths": [{"path": "/*"}]
+}
+
+
+def rollup_id(kind: str, granularity: str, bucket: str) -> str:
+    return kind if granularity == "all" else f"{kind}-{granularity}-{bucket}"
+
+
+def _utc(timestamp: str) -> datetime:
+    ts = datetime.fromisoformat(timestamp.replace("Z", "+00:00"))
+    return ts.astimezone(timezone.utc) if ts.tzinfo is not None else ts
+
+
+def rollup_buckets(timestamp: str) -> List[Tuple[str, str]]:
+    """(granularity, bucket) pairs a record with this ISO timestamp counts towards"""
+    ts = _utc(timestamp)
+    return [("hour", ts.strftime("%Y-%m-%dT%H")), ("day", ts.strftime("%Y-%m-%d")), ("all", "all")]
+
+
+def latency_buckets(timestamp: str) -> List[Tuple[str, str]]:
+    """Latency histograms are kept per minute, hour and day (no all-time document)"""
+    ts = _utc(timestamp)
+    return [("minute", ts.strftime("%Y-%m-%dT%H:%M")), ("hour", ts.strftime("%Y-%m-%dT%H")), ("day", ts.strftime("%Y-%m-%d"))]
+
+
+def empty_rollup(kind: str, granularity: str, bucket: str) -> Dict:
+    doc = {
+        "id": rollup_id(kind, granularity, bucket),
+        "kind": kind,
+        "granularity": granularity,
+        "bucket": bucket,
+        "total": 0,
+        "counts": {dimension: {} for dimension in ROLLUP_DIMENSIONS[kind]}
+    }
+    if ROLLUP_RETENTION_DAYS.get(granularity, 0) > 0:
+        doc["ttl"] = ROLLUP_RETENTION_DAYS[granularity] * 86400
+    if kind == "chat":
+        doc["sessions"] = ""
+        doc["hllPrecision"] = HLL_PRECISION
+        doc["tokens"] = {}
+        doc["sources"] = {}
+    elif kind == "sql":
+        doc["questions"] = []
+        doc["shapes"] = []
+    else:
+        doc["functions"] = {}
+        doc["tools"] = {}
+        doc["accuracy"] = DEFAULT_ACCURACY
+    return doc
+
+
+def compute_deltas(kind: str, items: Iterable[Dict]) -> Dict[str, Dict]:
+    """Aggregate records into per-document increments keyed by rollup id"""
+    deltas: Dict[str, Dict] = {}
+    for item in items:
+        if not item.get("timestamp"):
+            continue
+        for granularity, bucket in rollup_buckets(item["timestamp"]):
+            doc_id = rollup_id(kind, granularity, bucket)
+            delta = deltas.get(doc_id)
+            if delta is None:
+                delta = deltas[doc_id] = {
+                    "kind": kind,
+                    "granularity": granularity,
+                    "bucket": bucket,
+                    "total": 0,
+                    "counts": {dimension: Counter() for dimension in ROLLUP_DIMENSIONS[kind]},
+                    "questions": Counter(),
+                    "shapes": Counter(),
+                    "shape_failures": Counter(),
+                    "shape_text": {},
+                    "sessions": HyperLogLog(HLL_PRECISION) if kind == "chat" else None,
+                    "tokens": {},
+                    "sources": {}
+                }
+            delta["total"] += 1
+            for dimension in ROLLUP_DIMENSIONS[kind]:
+                delta["counts"][dimension][str(item.get(dimension))] += 1
+            if kind == "chat":
+                if item.get("sessionId"):
+                    delta["sessions"].add(item["sessionId"])
+                _add_tokens(delta, item)
+            elif kind == "sql":
+                if item.get("originalQuestion"):
+                    delta["questions"][item["originalQuestion"]] += 1
+                if item.get("generatedSql") is not None or item.get("fingerprint"):
+                    # Records logged before fingerprinting are fingerprinted here
+                    shape = item if item.get("fingerprint") else fingerprint_sql(item["generatedSql"])
+                    delta["shapes"][shape["fingerprint"]] += 1
+                    delta["shape_text"][shape["fingerprint"]] = shape.get("shape")
+                    if item.get("state") != "success":
+                        delta["shape_failures"][shape["fingerprint"]] += 1
+    return deltas
+
+
+def _add_tokens(delta: Dict, item: Dict):
+    tokens = delta["tokens"].setdefault(str(item.get("functionUsed")), Counter())
+    for metric in TOKEN_METRICS:
+        if isinstance(item.get(metric), (int, float)):
+            tokens[metric] += item[metric]
+    for usage in item.get("tokensBySource") or []:
+        sums = delta["sources"].setdefault(str(usage.get("source")), Counter())
+        for metric in SOURCE_TOKEN_METRICS:
+            if isinstance(usage.get(metric), (int, float)):
+                sums[metric] += usage[metric]
+
+
+def _merge_sums(stored: Dict, increments: Dict[str, Counter]):
+    for name, sums in increments.items():
+        current = stored.setdefault(name, {})
+        for metric, value in sums.items():
+            current[metric] = round(current.get(metric, 0) + value, 6)
+
+
+def compute_latency_deltas(items: Iterable[Dict]) -> Dict[str, Dict]:
+    """Chat records into latency histogram increments keyed by rollup id"""
+    deltas: Dict[str, Dict] = {}
+    for item in items:
+        if not item.get("timestamp") or not isinstance(item.get("latencyMs"), (int, float)):
+            continue
+        tier = str(item.get("tier"))
+        for granularity, bucket in latency_buckets(item["timestamp"]):
+            doc_id = rollup_id("latency", granularity, bucket)
+            delta = deltas.get(doc_id)
+            if delta is None:
+                delta = deltas[doc_id] = {
+                    "kind": "latency", "granularity": granularity, "bucket": bucket, "total": 0,
+                    "functions": {}, "tools": {}
+                }
+            delta["total"] += 1
+            function = delta["functions"].setdefault(str(item.get("functionUsed")), {})
+            function.setdefault(tier, LatencyHistogram()).add(item["latencyMs"])
+            for tool, ms in (item.get("toolLatencyMs") or {}).items():
+                delta["tools"].setdefault(tool, {}).setdefault(tier, LatencyHistogram()).add(ms)
+    return deltas
+
+
+def rollup_delta(doc: Dict) -> Dict:
+    """A stored chat or sql rollup in the increment form apply_delta takes, so rollups can be summed"""
+    shapes = doc.get("shapes", [])
+    return {
+        "kind": doc["kind"],
+        "granularity": doc["granularity"],
+        "bucket": doc["bucket"],
+        "total": doc.get("total", 0),
+        "counts": {dimension: Counter(values) for dimension, values in doc.get("counts", {}).items()},
+        "questions": Counter({q["question"]: q["count"] for q in doc.get("questions", [])}),
+        "shapes": Counter({s["fingerprint"]: s["count"] for s in shapes}),
+        "shape_failures": Counter({s["fingerprint"]: s.get("failed", 0) for s in shapes}),
+        "shape_text": {s["fingerprint"]: s.get("shape") for s in shapes},
+        "sessions": HyperLogLog.from_base64(doc.get("sessions"), doc.get("hllPrecision", HLL_PRECISION))
+        if doc["kind"] == "chat" else None,
+        "tokens": {name: Counter(sums) for name, sums in doc.get("tokens", {}).items()},
+        "sources": {name: Counter(sums) for name, sums in doc.get("sources", {}).items()}
+    }
+
+
+def apply_latency_delta(doc: Dict, delta: Dict) -> Dict:
+    doc["total"] = doc.get("total", 0) + delta["total"]
+    accuracy = doc.setdefault("accuracy", DEFAULT_ACCURACY)
+    for scope in ("functions", "tools"):
+        stored = doc.setdefault(scope, {})
+        for name, tiers in delta[scope].items():
+            for tier, histogram in tiers.items():
+                current = LatencyHistogram.from_dict(stored.get(name, {}).get(tier), accuracy)
+                stored.setdefault(name, {})[tier] = current.merge(histogram).to_dict()
+    doc["updated_at"] = datetime.now(timezone.utc).isoformat()
+    return doc
+
+
+def apply_delta(doc: Dict, delta: Dict) -> Dict:
+    """Fold an increment into a rollup document in place"""
+    if delta["kind"] == "latency":
+        return apply_latency_delta(doc, delta)
+    doc["total"] = doc.get("total", 0) + delta["total"]
+    counts = doc.setdefault("counts", {})
+    for dimension, increments in delta["counts"].items():
+        current = counts.setdefault(dimension, {})
+        for value, n in increments.items():
+            current[value] = current.get(value, 0) + n
+
+    if delta["tokens"]:
+        _merge_sums(doc.setdefault("tokens", {}), delta["tokens"])
+    if delta["sources"]:
+        _merge_sums(doc.setdefault("sources", {}), delta["sources"])
+    if delta["sessions"] is not None:
+        sketch = HyperLogLog.from_base64(doc.get("sessions"), doc.get("hllPrecision", HLL_PRECISION))
+        doc["sessions"] = sketch.merge(delta["sessions"]).to_base64()
+    if delta["questions"]:
+        questions = Counter({q["question"]: q["count"] for q in doc.get("questions", [])})
+        questions.update(delta["questions"])
+        doc["questions"] = [
+            {"question": q, "count": c} for q, c in questions.most_common(MAX_TRACKED_QUESTIONS)
+        ]
+    if delta["shapes"]:
+        shapes = {s["fingerprint"]: s for s in doc.get("shapes", [])}
+        for fingerprint, n in delta["shapes"].items():
+            entry = shapes.setdefault(
+                fingerprint, {"fingerprint": fingerprint, "shape": delta["shape_text"][fingerprint], "count": 0, "failed": 0}
+            )
+            entry["count"] += n
+            entry["failed"] += delta["shape_failures"][fingerprint]
+        doc["shapes"] = sorted(shapes.values(), key=lambda s: s["count"], reverse=True)[:MAX_TRACKED_SHAPES]
+    doc["updated_at"] = datetime.now(timezone.utc).isoformat()
+    return doc
+
+
+class StatsRollupWriter:
+    """Folds written log records into the rollup documents.
+
+    Each document is updated with an ETag-conditioned replace, so several
+    chatbot instances can update the same hour without losing counts.
+    """
+
+    def __init__(self, rollup_container, logger: Optional[logging.Logger] = None, max_retries: int = 5):
+        self.container = rollup_container
+        self.logger = logger or logging.getLogger(__name__)
+        self.max_retries = max_retries
+
+    def apply(self, kind: str, items: List[Dict]) -> int:
+        """Add a batch of written records; returns the number of documents updated"""
+        updated = 0
+        deltas = compute_deltas(kind, items)
+        if kind == "chat":
+            deltas.update(compute_latency_deltas(items))
+        for doc_id, delta in deltas.items():
+            if self._merge(doc_id, delta):
+                updated += 1
+        return updated
+
+    def _merge(self, doc_id: str, delta: Dict) -> bool:
+        for _ in range(self.max_retries):
+            try:
+                existing = self.container.read_item(item=doc_id, partition_key=delta["kind"])
+            except exceptions.CosmosResourceNotFoundError:
+                existing = None
+
+            if existing is None:
+                doc = apply_delta(empty_rollup(delta["kind"], delta["granularity"], delta["bucket"]), delta)
+                try:
+                    self.container.create_item(body=doc)
+                    return True
+                except exceptions.CosmosResourceExistsError:
+                    continue  # another writer created it first
+            else:
+                doc = apply_delta(existing, delta)
+                try:
+                    self.container.replace_item(
+                        item=doc_id, body=doc, etag=existing["_etag"], match_condition=MatchConditions.IfNotModified
+                    )
+                    return True
+                except exceptions.CosmosAccessConditionFailedError:
+                    continue  # changed since we read it, retry on the new version
+        self.logger.error(f"Gave up updating rollup {doc_id} after {self.max_retries} conflicts")
+        return False
+
+    def rebuild(self, chat_container, sql_container) -> Dict[str, int]:
+        """Recompute every rollup from the raw containers, replacing what is stored.
+
+        Compacted days whose raw records have expired (see retention.py)
+        keep their stored daily rollups; with retention on, the all-time
+        documents are summed from the daily ones.
+        """
+        chat_items = list(chat_container.query_items(
+            query=f"SELECT {CHAT_ROLLUP_FIELDS} FROM c",
+            enable_cross_partition_query=True
+        ))
+        sql_items = sql_container.query_items(
+            query=f"SELECT {SQL_ROLLUP_FIELDS} FROM c",
+            enable_cross_partition_query=True
+        )
+        sources = {
+            "chat": compute_deltas("chat", chat_items),
+            "sql": compute_deltas("sql", sql_items),
+            "latency": compute_latency_deltas(chat_items)
+        }
+        written = {}
+        for kind, deltas in sources.items():
+            docs = {
+                doc_id: apply_delta(empty_rollup(kind, d["granularity"], d["bucket"]), d)
+                for doc_id, d in deltas.items()
+            }
+            self._keep_compacted_days(kind, docs)
+            stale = [
+                doc_id for doc_id in self.container.query_items(
+                    query="SELECT VALUE c.id FROM c", partition_key=kind
+                ) if doc_id not in docs
+            ]
+            for doc in docs.values():
+                self.container.upsert_item(body=doc)
+            for doc_id in stale:
+                self.container.delete_item(item=doc_id, partition_key=kind)
+            written[kind] = len(docs)
+        return written
+
+    def _keep_compacted_days(self, kind: str, docs: Dict[str, Dict]):
+        stored_days = self.container.query_items(
+            query="SELECT * FROM c WHERE c.granularity = 'day' AND IS_DEFINED(c.compactedAt)", partition_key=kind
+        )
+        for stored in stored_days:
+            rebuilt = docs.get(stored["id"])
+            if rebuilt is None or rebuilt.get("total", 0) < stored.get("total", 0):
+                docs[stored["id"]] = stored
+            else:
+                rebuilt["compactedAt"] = stored["compactedAt"]
+        if kind == "latency" or LOG_RETENTION_DAYS <= 0:
+            return
+        all_time = empty_rollup(kind, "all", "all")
+        for doc in docs.values():
+            if doc["granularity"] == "day":
+                apply_delta(all_time, rollup_delta(doc))
+        docs[rollup_id(kind, "all", "all")] = all_time
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Maintain the dashboard statistics rollups")
+    parser.add_argument("--rebuild", action="store_true",
+                        help="Recompute all rollups from ChatHistory and GeneratedQueries")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    from CosmosDBHandlers.cosmosChatHistoryHandler import ChatMemoryHandler
+    handler = ChatMemoryHandler(logger=logger)
+
+    if args.rebuild:
+        # Stop the chatbots first; batches logged during the rebuild may be counted twice
+        written = await asyncio.to_thread(
+            handler.stats_rollups.rebuild, handler.chat_container, handler.sql_container
+        )
+        logger.info(f"Rebuilt rollups: {written}")
+    else:
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,235 @@
+# loadTest.py
+"""Replay logged questions against handle_query with stubbed services.
+
+Azure OpenAI is replaced by a scripted chat completion (real Semantic Kernel
+function calling, simulated token latency), embeddings by a deterministic
+stub and Cosmos DB by an in-memory container with simulated blocking
+latency. Everything else - the kernel, the plugins, the log worker and the
+tracer - is the production code path.
+
+Run from the SemanticKernelChatbot directory:
+
+    python benchmarks/loadTest.py --questions ../ChatbotHugg/chatbot_data.json \
+        --requests 200 --concurrency 20 --rate 5
+"""
+import argparse
+import asyncio
+import importlib.util
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+import uuid
+from typing import Dict, List, Optional
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+
+def load_questions(path: str) -> List[str]:
+    """Questions from a ChatHistory export (JSON array or JSON lines) or chatbot_data.json"""
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read().strip()
+    try:
+        records = json.loads(text)
+        if isinstance(records, dict):
+            records = records.get("Documents") or records.get("items") or [records]
+    except json.JSONDecodeError:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    questions = []
+    for record in records:
+        question = record.get("question") or record.get("originalQuestion") or record.get("prompt")
+        if question:
+            questions.append(question)
+    if not questions:
+        raise ValueError(f"No questions found in {path}")
+    return questions
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+def rss_mb() -> Optional[float]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except (OSError, ValueError):
+        return None
+
+
+def install_stubs(args) -> Dict:
+    """Point the app at local stand-ins before it is imported"""
+    work_dir = tempfile.mkdtemp(prefix="tal-loadtest-")
+    os.environ.setdefault("AZURE_OPENAI_DEPLOYMENT_NAME", "scripted")
+    os.environ.setdefault("AZURE_OPENAI_ENDPOINT", "https://loadtest.openai.azure.com/")
+    os.environ.setdefault("AZURE_OPENAI_KEY", "loadtest")
+    os.environ.setdefault("AZURE_OPENAI_API_VERSION", "2024-10-21")
+    os.environ.setdefault("OPENAI_API_ENDPOINT", "https://loadtest.openai.azure.com/")
+    os.environ.setdefault("OPENAI_EMBEDDINGS_MODEL_DEPLOYMENT", "scripted")
+    os.environ.setdefault("AZURE_COSMOS_DB_ENDPOINT", "https://localhost:8081/")
+    os.environ.setdefault("AZURE_COSMOS_DB_KEY", "loadtest")
+    os.environ["CHAT_LOG_SPOOL_PATH"] = os.path.join(work_dir, "chat_log_spool.jsonl")
+    os.environ["CHAT_TRACE_PATH"] = os.path.join(work_dir, "chat_traces.jsonl")
+
+    import azure.cosmos
+    from benchmarks.localCosmos import LocalCosmosClient
+    LocalCosmosClient.latency_ms = args.cosmos_latency_ms
+    LocalCosmosClient.write_latency_ms = args.cosmos_latency_ms
+    with open(os.path.join(APP_DIR, "converters_improved.json"), "r", encoding="utf-8") as f:
+        converters = json.load(f)
+    LocalCosmosClient.seed("TAL_DB", "Converters", converters, "/artnr")
+    azure.cosmos.CosmosClient = LocalCosmosClient
+
+    from CosmosDBHandlers import embeddingService
+    from benchmarks.stubServices import ScriptedChatCompletion, StubEmbeddings
+    embeddings = StubEmbeddings(latency=args.embedding_latency_ms / 1000.0)
+    embeddingService._embedding_service = embeddingService.EmbeddingService(embedding_model=embeddings)
+
+    import tracing.kernelTracing
+    ScriptedChatCompletion.first_token_latency = args.first_token_ms / 1000.0
+    ScriptedChatCompletion.token_latency = args.token_latency_ms / 1000.0
+    tracing.kernelTracing.TracedAzureChatCompletion = ScriptedChatCompletion
+
+    return {"work_dir": work_dir, "embeddings": embeddings}
+
+
+def import_app(app_file: str):
+    path = os.path.join(APP_DIR, app_file)
+    spec = importlib.util.spec_from_file_location("chatbot_app", path)
+    module = importlib.util.module_from_spec(spec)
+    cwd = os.getcwd()
+    os.chdir(APP_DIR)
+    try:
+        spec.loader.exec_module(module)
+    finally:
+        os.chdir(cwd)
+    return module
+
+
+async def monitor_loop_lag(samples: List[float], stop: asyncio.Event, interval: float = 0.01):
+    """Measure how late the event loop wakes up a sleeping task"""
+    loop = asyncio.get_running_loop()
+    while not stop.is_set():
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval) * 1000)
+
+
+async def run_load(app, questions: List[str], args) -> Dict:
+    latencies: List[float] = []
+    errors: List[str] = []
+    lag_samples: List[float] = []
+    memory_samples: List[float] = []
+    semaphore = asyncio.Semaphore(args.concurrency)
+    stop = asyncio.Event()
+    rng = random.Random(args.seed)
+    sessions = [str(uuid.uuid4()) for _ in range(max(1, args.sessions))]
+
+    async def one_request(question: str, session_id: str):
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await app.handle_query(question, session_id)
+                latencies.append((time.perf_counter() - start) * 1000)
+            except Exception as e:
+                errors.append(str(e))
+
+    async def sample_memory():
+        while not stop.is_set():
+            memory_samples.append(tracemalloc.get_traced_memory()[0] / (1024 * 1024))
+            await asyncio.sleep(0.5)
+
+    lag_task = asyncio.create_task(monitor_loop_lag(lag_samples, stop))
+    memory_task = asyncio.create_task(sample_memory())
+    rss_start = rss_mb()
+
+    started = time.perf_counter()
+    tasks = []
+    for i in range(args.requests):
+        question = questions[i % len(questions)] if args.in_order else rng.choice(questions)
+        tasks.append(asyncio.create_task(one_request(question, rng.choice(sessions))))
+        if args.rate > 0:
+            # Open-loop Poisson arrivals
+            await asyncio.sleep(rng.expovariate(args.rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    log_worker = app.chat_memory_plugin.chat_memory_handler.log_worker
+    await log_worker.flush(timeout=60)
+    stop.set()
+    await asyncio.gather(lag_task, memory_task)
+
+    return {
+        "requests": args.requests,
+        "completed": len(latencies),
+        "errors": len(errors),
+        "error_samples": errors[:5],
+        "elapsed_s": round(elapsed, 2),
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 50), 1),
+            "p95": round(percentile(latencies, 95), 1),
+            "p99": round(percentile(latencies, 99), 1),
+            "mean": round(statistics.mean(latencies), 1) if latencies else 0,
+            "max": round(max(latencies), 1) if latencies else 0
+        },
+        "event_loop_lag_ms": {
+            "p50": round(percentile(lag_samples, 50), 2),
+            "p99": round(percentile(lag_samples, 99), 2),
+            "max": round(max(lag_samples), 2) if lag_samples else 0
+        },
+        "memory_mb": {
+            "traced_start": round(memory_samples[0], 1) if memory_samples else None,
+            "traced_end": round(tracemalloc.get_traced_memory()[0] / (1024 * 1024), 1),
+            "traced_peak": round(tracemalloc.get_traced_memory()[1] / (1024 * 1024), 1),
+            "rss_start": round(rss_start, 1) if rss_start else None,
+            "rss_end": round(rss_mb(), 1) if rss_mb() else None
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test handle_query with stubbed Azure services")
+    parser.add_argument("--questions", default=os.path.join(APP_DIR, "..", "ChatbotHugg", "chatbot_data.json"),
+                        help="ChatHistory export (JSON/JSON lines) or chatbot_data.json")
+    parser.add_argument("--app", default="chatbot-gradio.py", help="App module defining handle_query")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=10, help="Max in-flight requests")
+    parser.add_argument("--rate", type=float, default=0.0, help="Arrivals per second (0 = closed loop)")
+    parser.add_argument("--sessions", type=int, default=20, help="Distinct simulated users")
+    parser.add_argument("--first-token-ms", type=float, default=300.0)
+    parser.add_argument("--token-latency-ms", type=float, default=20.0)
+    parser.add_argument("--cosmos-latency-ms", type=float, default=15.0)
+    parser.add_argument("--embedding-latency-ms", type=float, default=150.0)
+    parser.add_argument("--in-order", action="store_true", help="Replay questions in order instead of sampling")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    tracemalloc.start()
+    stubs = install_stubs(args)
+    app = import_app(args.app)
+    questions = load_questions(args.questions)
+
+    report = asyncio.run(run_load(app, questions, args))
+    report["embedding_round_trips"] = stubs["embeddings"].calls
+    report["trace_file"] = os.environ["CHAT_TRACE_PATH"]
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,319 @@
+# localCosmos.py
+"""In-memory stand-in for the parts of azure.cosmos the chatbot uses.
+
+Understands the query shapes the handlers and the NL2SQL prompt produce
+(SELECT [VALUE] [TOP n] ... FROM c [WHERE ...] [ORDER BY ...]) and blocks
+for a configurable latency per call, like the synchronous SDK does.
+
+With partition_ru_per_s set, writes to the same logical partition queue
+behind each other at that rate, like a partition at its throughput limit.
+"""
+import copy
+import math
+import re
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+from azure.cosmos import exceptions
+
+_UNDEFINED = object()
+
+_QUERY_RE = re.compile(
+    r"^\s*SELECT\s+(?P<value>VALUE\s+)?(?:TOP\s+(?P<top>\d+|@\w+)\s+)?(?P<proj>.*?)\s+FROM\s+c\b(?P<rest>.*)$",
+    re.IGNORECASE | re.DOTALL
+)
+_PATH_RE = re.compile(r'\bc((?:\.\w+|\[\s*"[^"]*"\s*\]|\[\s*\'[^\']*\'\s*\])+)')
+
+
+def _split_path(path: str) -> List[str]:
+    """'.lamps["B4"].min' -> ['lamps', 'B4', 'min']"""
+    return [attr or key[1:-1] for attr, key in re.findall(r'\.(\w+)|\[\s*("[^"]*"|\'[^\']*\')\s*\]', path)]
+
+
+def _get(doc: Dict, parts: List[str]):
+    value = doc
+    for part in parts:
+        if not isinstance(value, dict) or part not in value:
+            return _UNDEFINED
+        value = value[part]
+    return value
+
+
+def _like(value, pattern: str) -> bool:
+    if not isinstance(value, str):
+        return False
+    regex = "^" + re.escape(pattern).replace("%", ".*").replace("_", ".") + "$"
+    return re.match(regex, value, re.IGNORECASE | re.DOTALL) is not None
+
+
+def _cosine(a, b) -> float:
+    if not isinstance(a, list) or not isinstance(b, list):
+        return 0.0
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+def _split_top_level(text: str, sep: str = ",") -> List[str]:
+    parts, depth, current = [], 0, ""
+    for ch in text:
+        if ch in "([":
+            depth += 1
+        elif ch in ")]":
+            depth -= 1
+        if ch == sep and depth == 0:
+            parts.append(current.strip())
+            current = ""
+        else:
+            current += ch
+    if current.strip():
+        parts.append(current.strip())
+    return parts
+
+
+class LocalContainer:
+    def __init__(self, id: str, client: "LocalCosmosClient", partition_key_path: Optional[str] = None):
+        self.id = id
+        self.client = client
+        self.client_connection = client
+        self.partition_key_path = partition_key_path
+        self.items: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+        self._partition_locks: Dict[Any, threading.Lock] = {}
+
+    def read(self, **kwargs) -> Dict:
+        return {"id": self.id, "partitionKey": {"paths": [self.partition_key_path] if self.partition_key_path else []}}
+
+    def _throttle(self, partition_key, units: int = 1):
+        """Hold the partition for the time its throughput needs for this write"""
+        rate = self.client.partition_ru_per_s
+        if not rate:
+            return
+        with self._lock:
+            lock = self._partition_locks.setdefault(partition_key, threading.Lock())
+        with lock:
+            time.sleep(self.client.request_charge * 2 * units / rate)
+
+    def _partition_of(self, body: Dict):
+        if not self.partition_key_path:
+            return None
+        value = _get(body, self.partition_key_path.strip("/").split("/"))
+        return None if value is _UNDEFINED else value
+
+    # ---- writes -------------------------------------------------------
+    def create_item(self, body: Dict, **kwargs) -> Dict:
+        self.client._simulate(write=True)
+        with self._lock:
+            if body["id"] in self.items:
+                raise exceptions.CosmosResourceExistsError(status_code=409, message=f"Item {body['id']} already exists")
+            self._store(body)
+        return body
+
+    def upsert_item(self, body: Dict, **kwargs) -> Dict:
+        headers = self.client._simulate(write=True)
+        self._throttle(self._partition_of(body))
+        with self._lock:
+            self._store(body)
+        if kwargs.get("response_hook"):
+            kwargs["response_hook"](headers, body)
+        return body
+
+    def replace_item(self, item, body: Dict, etag: Optional[str] = None, match_condition=None, **kwargs) -> Dict:
+        self.client._simulate(write=True)
+        item_id = item if isinstance(item, str) else item["id"]
+        with self._lock:
+            if item_id not in self.items:
+                raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"Item {item_id} not found")
+            if match_condition is not None and etag != self.items[item_id].get("_etag"):
+                raise exceptions.CosmosAccessConditionFailedError(status_code=412, message="Precondition failed")
+            self._store(body)
+        return body
+
+    def _store(self, body: Dict):
+        stored = copy.deepcopy(body)
+        stored["_etag"] = uuid.uuid4().hex
+        self.items[body["id"]] = stored
+
+    def execute_item_batch(self, batch_operations, partition_key=None, **kwargs):
+        headers = self.client._simulate(write=True, units=len(batch_operations))
+        self._throttle(partition_key, len(batch_operations))
+        with self._lock:
+            for operation, args in batch_operations:
+                body = args[0]
+                if operation in ("create", "upsert", "replace"):
+                    self._store(body)
+                elif operation == "delete":
+                    self.items.pop(body, None)
+        if kwargs.get("response_hook"):
+            kwargs["response_hook"](headers, None)
+        return [{"statusCode": 200} for _ in batch_operations]
+
+    def read_item(self, item: str, partition_key=None, **kwargs) -> Dict:
+        self.client._simulate()
+        if item not in self.items:
+            raise exceptions.CosmosResourceNotFoundError(status_code=404, message=f"Item {item} not found")
+        return copy.deepcopy(self.items[item])
+
+    def delete_item(self, item, partition_key=None, **kwargs):
+        self.client._simulate(write=True)
+        with self._lock:
+            self.items.pop(item if isinstance(item, str) else item["id"], None)
+
+    # ---- queries ------------------------------------------------------
+    def query_items(self, query: str, parameters: Optional[List[Dict]] = None, **kwargs) -> List[Any]:
+        params = {p["name"]: p["value"] for p in (parameters or [])}
+        with self._lock:
+            docs = list(self.items.values())
+        partition_key = kwargs.get("partition_key")
+        if partition_key is not None and self.partition_key_path:
+            parts = self.partition_key_path.strip("/").split("/")
+            docs = [d for d in docs if _get(d, parts) == partition_key]
+        self.client._simulate(units=max(1, len(docs) // 100))
+        return self._execute(query, params, docs)
+
+    def _execute(self, query: str, params: Dict, docs: List[Dict]) -> List[Any]:
+        match = _QUERY_RE.match(query.strip().rstrip(";"))
+        if not match:
+            raise ValueError(f"Unsupported query: {query}")
+
+        rest = match.group("rest")
+        order_by = None
+        order_match = re.search(r"\bORDER\s+BY\b(.*)$", rest, re.IGNORECASE | re.DOTALL)
+        if order_match:
+            order_by = order_match.group(1).strip()
+            rest = rest[:order_match.start()]
+        where_match = re.search(r"\bWHERE\b(.*)$", rest, re.IGNORECASE | re.DOTALL)
+        if where_match:
+            predicate = self._compile(where_match.group(1), params)
+            docs = [d for d in docs if self._matches(predicate, d, params)]
+
+        if order_by:
+            docs = self._order(docs, order_by, params)
+
+        proj = match.group("proj").strip()
+        if re.fullmatch(r"COUNT\(\s*1\s*\)", proj, re.IGNORECASE):
+            return [len(docs)]
+
+        top = match.group("top")
+        if top:
+            docs = docs[:int(params[top] if top.startswith("@") else top)]
+        return [self._project(d, proj, params, bool(match.group("value"))) for d in docs]
+
+    def _compile(self, condition: str, params: Dict) -> str:
+        expr = re.sub(
+            r"IS_DEFINED\(\s*c((?:\.\w+|\[[^\]]*\])+)\s*\)",
+            lambda m: f"(_get(doc, {_split_path(m.group(1))!r}) is not _UNDEFINED)",
+            condition,
+            flags=re.IGNORECASE
+        )
+        expr = _PATH_RE.sub(lambda m: f"_get(doc, {_split_path(m.group(1))!r})", expr)
+        expr = re.sub(r"(_get\(doc, \[[^\]]*\]\))\s+LIKE\s+('[^']*'|\"[^\"]*\")", r"_like(\1, \2)", expr, flags=re.IGNORECASE)
+        expr = re.sub(r"@\w+", lambda m: f"params[{m.group(0)!r}]", expr)
+        expr = re.sub(r"<>", "!=", expr)
+        expr = re.sub(r"(?<![<>!=])=(?!=)", "==", expr)
+        for sql_word, py_word in (("AND", "and"), ("OR", "or"), ("NOT", "not"), ("true", "True"), ("false", "False"), ("null", "None")):
+            expr = re.sub(rf"\b{sql_word}\b", py_word, expr, flags=re.IGNORECASE)
+        return expr
+
+    def _matches(self, predicate: str, doc: Dict, params: Dict) -> bool:
+        try:
+            return bool(eval(predicate, {"__builtins__": {}}, {
+                "doc": doc, "params": params, "_get": _get, "_like": _like, "_UNDEFINED": _UNDEFINED,
+                "ARRAY_CONTAINS": lambda values, value: value in values
+            }))
+        except TypeError:
+            # Comparisons against undefined or mismatched types are false in Cosmos
+            return False
+
+    def _order(self, docs: List[Dict], order_by: str, params: Dict) -> List[Dict]:
+        descending = bool(re.search(r"\bDESC\s*$", order_by, re.IGNORECASE))
+        order_by = re.sub(r"\s+(ASC|DESC)\s*$", "", order_by, flags=re.IGNORECASE)
+        vector = re.match(r"VectorDistance\(\s*c((?:\.\w+)+)\s*,\s*(@\w+)\s*\)", order_by, re.IGNORECASE)
+        if vector:
+            field, param = _split_path(vector.group(1)), params.get(vector.group(2))
+            return sorted(docs, key=lambda d: _cosine(_get(d, field), param), reverse=True)
+        field = _split_path(order_by[1:]) if order_by.startswith("c") else []
+
+        def key(doc):
+            value = _get(doc, field)
+            return (value is _UNDEFINED or value is None, value if value not in (_UNDEFINED, None) else 0)
+
+        try:
+            return sorted(docs, key=key, reverse=descending)
+        except TypeError:
+            return docs
+
+    def _project(self, doc: Dict, proj: str, params: Dict, value_only: bool):
+        if proj == "*":
+            return copy.deepcopy(doc)
+        result = {}
+        for part in _split_top_level(proj):
+            alias_match = re.match(r"(.*?)\s+AS\s+(\w+)$", part, re.IGNORECASE | re.DOTALL)
+            expr, alias = (alias_match.group(1), alias_match.group(2)) if alias_match else (part, None)
+            vector = re.match(r"VectorDistance\(\s*c((?:\.\w+)+)\s*,\s*(@\w+)\s*\)", expr, re.IGNORECASE)
+            if vector:
+                result[alias or "$1"] = _cosine(_get(doc, _split_path(vector.group(1))), params.get(vector.group(2)))
+                continue
+            path = _split_path(expr.strip()[1:]) if expr.strip().startswith("c") else []
+            value = _get(doc, path)
+            if value_only:
+                return copy.deepcopy(value) if value is not _UNDEFINED else None
+            if value is not _UNDEFINED:
+                result[alias or path[-1]] = copy.deepcopy(value)
+        return result
+
+
+class LocalDatabase:
+    def __init__(self, id: str, client: "LocalCosmosClient"):
+        self.id = id
+        self.client = client
+        self.containers: Dict[str, LocalContainer] = {}
+
+    def create_container_if_not_exists(self, id: str, partition_key=None, **kwargs) -> LocalContainer:
+        if id not in self.containers:
+            path = getattr(partition_key, "path", None) if partition_key is not None else None
+            self.containers[id] = LocalContainer(id, self.client, path)
+        return self.containers[id]
+
+    def get_container_client(self, container: str) -> LocalContainer:
+        return self.create_container_if_not_exists(container)
+
+
+class LocalCosmosClient:
+    """Drop-in for CosmosClient; all instances share one in-memory account"""
+
+    databases: Dict[str, LocalDatabase] = {}
+    latency_ms: float = 0.0
+    write_latency_ms: float = 0.0
+    request_charge: float = 2.8
+    # Write request units per second one logical partition absorbs; 0 disables the limit
+    partition_ru_per_s: float = 0.0
+
+    def __init__(self, url: Optional[str] = None, credential: Optional[str] = None, **kwargs):
+        self.last_response_headers: Dict[str, str] = {}
+
+    def create_database_if_not_exists(self, id: str, **kwargs) -> LocalDatabase:
+        if id not in LocalCosmosClient.databases:
+            LocalCosmosClient.databases[id] = LocalDatabase(id, self)
+        return LocalCosmosClient.databases[id]
+
+    def get_database_client(self, database: str) -> LocalDatabase:
+        return self.create_database_if_not_exists(database)
+
+    def _simulate(self, write: bool = False, units: int = 1):
+        latency = self.write_latency_ms if write else self.latency_ms
+        if latency:
+            time.sleep(latency / 1000.0)
+        self.last_response_headers = {"x-ms-request-charge": str(self.request_charge * units * (2 if write else 1))}
+        return self.last_response_headers
+
+    @classmethod
+    def seed(cls, database: str, container: str, items: List[Dict], partition_key_path: Optional[str] = None):
+        db = cls().create_database_if_not_exists(database)
+        target = db.create_container_if_not_exists(container)
+        target.partition_key_path = partition_key_path
+        for item in items:
+            target.items[item["id"]] = copy.deepcopy(item)
+        return target
@@ -0,0 +1,214 @@
+# partitionWriteBenchmark.py
+"""Chat log write throughput per partition key layout.
+
+Writes the same synthetic chat and SQL log records into ChatHistory- and
+GeneratedQueries-shaped containers partitioned the legacy way
+(/functionUsed, /state) and by the synthetic pk (day + hash bucket, see
+containerPolicies.py). Records arrive in batches like the log worker
+takes them off its queue, are grouped by partition and written as
+concurrent transactional batches, so a layout that piles most records
+into one partition serializes behind it. Reported per layout: records per
+second, request units per record, throttled requests (429) and how the
+records spread over logical partitions.
+
+Run from the SemanticKernelChatbot directory against the local emulator
+
+    python benchmarks/partitionWriteBenchmark.py --emulator --records 20000
+
+or against the account in .env, where --throughput gives each container
+its own RU/s. A logical partition's writes all land on one physical
+partition, so the skew costs throughput once a container has several of
+them (more than 10,000 RU/s, or more than 50 GB). --local runs against the
+in-memory stand-in with --partition-ru-per-s as the per-partition limit.
+The benchmark database is deleted afterwards unless --keep is given.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Tuple
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from benchmarks.vectorSearchBenchmark import FUNCTIONS, connect
+from CosmosDBHandlers.containerMigration import batch_chunks
+from CosmosDBHandlers.containerPolicies import LEGACY_PARTITION_KEYS, LOG_PARTITION_KEY, with_partition_key
+
+LAYOUTS = {
+    "legacy": LEGACY_PARTITION_KEYS,
+    "pk": {"chat": LOG_PARTITION_KEY, "sql": LOG_PARTITION_KEY},
+}
+# Most questions go to a few functions and most generated SQL succeeds
+FUNCTION_WEIGHTS = [0.55, 0.2, 0.12, 0.08, 0.05]
+SQL_STATES = {"success": 0.85, "error": 0.1, "null": 0.05}
+
+
+def synthetic_logs(n: int, sessions: int, days: int, sql_share: float = 0.3) -> List[Tuple[str, Dict]]:
+    """(kind, record) pairs shaped like ChatMemoryHandler.log_interaction/log_sql_query write them"""
+    now = datetime.now(timezone.utc)
+    records = []
+    for i in range(n):
+        timestamp = now - timedelta(seconds=random.uniform(0, days * 86400))
+        if random.random() < sql_share:
+            kind, item = "sql", {
+                "id": str(uuid.uuid4()),
+                "originalQuestion": f"synthetic question {i}",
+                "generatedSql": f"SELECT * FROM c WHERE c.power > {i % 200}",
+                "state": random.choices(list(SQL_STATES), weights=list(SQL_STATES.values()))[0],
+                "timestamp": timestamp.isoformat()
+            }
+        else:
+            kind, item = "chat", {
+                "id": str(uuid.uuid4()),
+                "sessionId": f"session-{random.randrange(sessions)}",
+                "question": f"synthetic question {i}",
+                "answer": "synthetic answer " * 40,
+                "functionUsed": random.choices(FUNCTIONS, weights=FUNCTION_WEIGHTS)[0],
+                "timestamp": timestamp.isoformat(),
+                "epoch": int(timestamp.timestamp())
+            }
+        # The log worker adds pk to every record, whatever the container's key
+        records.append((kind, with_partition_key(item, kind)))
+    return records
+
+
+class BatchWriter:
+    """Grouped, concurrent transactional batches, as ChatLogWorker writes them"""
+
+    def __init__(self, containers: Dict[str, object], paths: Dict[str, str], workers: int):
+        self.containers = containers
+        self.fields = {kind: path.lstrip("/") for kind, path in paths.items()}
+        self.pool = ThreadPoolExecutor(max_workers=workers)
+        self._lock = threading.Lock()
+        self.request_charge = 0.0
+        self.throttled = 0
+        self.failed = 0
+
+    def _on_response(self, headers: Dict, _):
+        with self._lock:
+            self.request_charge += float(headers.get("x-ms-request-charge", 0))
+            self.throttled += int(headers.get("x-ms-throttle-retry-count", 0) or 0)
+
+    def _write_chunk(self, job):
+        kind, partition_key, items = job
+        try:
+            self.containers[kind].execute_item_batch(
+                batch_operations=[("upsert", (item,)) for item in items],
+                partition_key=partition_key,
+                response_hook=self._on_response
+            )
+        except Exception as e:
+            # Requests the SDK still got 429 for after its own retries
+            with self._lock:
+                self.failed += len(items)
+                self.throttled += int(getattr(e, "status_code", 0) == 429)
+
+    def write(self, batch: List[Tuple[str, Dict]]):
+        groups = defaultdict(list)
+        for kind, item in batch:
+            groups[(kind, item.get(self.fields[kind]))].append(item)
+        jobs = [(kind, key, chunk) for (kind, key), items in groups.items() for chunk in batch_chunks(items)]
+        list(self.pool.map(self._write_chunk, jobs))
+
+
+def partition_spread(records: List[Tuple[str, Dict]], paths: Dict[str, str]) -> Dict:
+    """Logical partitions written per container and the share of the busiest"""
+    spread = {}
+    for kind, path in paths.items():
+        counts = Counter(item.get(path.lstrip("/")) for k, item in records if k == kind)
+        total = sum(counts.values())
+        spread[kind] = {
+            "partitions": len(counts),
+            "max_partition_share": round(max(counts.values()) / total, 3) if total else 0.0
+        }
+    return spread
+
+
+def run_layout(database, layout: str, records: List[Tuple[str, Dict]], args) -> Dict:
+    from azure.cosmos import PartitionKey
+    paths = LAYOUTS[layout]
+    options = {"offer_throughput": args.throughput} if args.throughput else {}
+    containers = {
+        kind: database.create_container_if_not_exists(
+            id=f"{'ChatHistory' if kind == 'chat' else 'GeneratedQueries'}_{layout}",
+            partition_key=PartitionKey(path=path),
+            **options
+        )
+        for kind, path in paths.items()
+    }
+    writer = BatchWriter(containers, paths, args.workers)
+    start = time.perf_counter()
+    for offset in range(0, len(records), args.batch_size):
+        writer.write(records[offset:offset + args.batch_size])
+    elapsed = time.perf_counter() - start
+    writer.pool.shutdown()
+    return {
+        "records_per_s": round(len(records) / elapsed, 1),
+        "ru_per_record": round(writer.request_charge / len(records), 2),
+        "throttled": writer.throttled,
+        "failed": writer.failed,
+        "spread": partition_spread(records, paths)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare chat log write throughput per partition key layout")
+    parser.add_argument("--records", type=int, default=5000)
+    parser.add_argument("--sessions", type=int, default=2000, help="Distinct chat sessions")
+    parser.add_argument("--days", type=int, default=1, help="Spread the records' timestamps over this many days")
+    parser.add_argument("--batch-size", type=int, default=32, help="Records the log worker takes per batch")
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent batch writes")
+    parser.add_argument("--layouts", default="legacy,pk")
+    parser.add_argument("--throughput", type=int, default=0, help="Dedicated RU/s per container (account only)")
+    parser.add_argument("--partition-ru-per-s", type=float, default=500.0,
+                        help="Per-partition write limit of the in-memory stand-in (--local)")
+    parser.add_argument("--database", default="TAL_PartitionBenchmark")
+    parser.add_argument("--emulator", action="store_true", help="Use the local Cosmos DB emulator")
+    parser.add_argument("--local", action="store_true", help="Use the in-memory stand-in")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark database")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    layouts = args.layouts.split(",")
+    unknown = set(layouts) - set(LAYOUTS)
+    if unknown:
+        parser.error(f"Unknown layouts {sorted(unknown)}, expected {sorted(LAYOUTS)}")
+    random.seed(args.seed)
+    records = synthetic_logs(args.records, args.sessions, args.days)
+
+    client = connect(args)
+    if args.local:
+        client.partition_ru_per_s = args.partition_ru_per_s
+    database = client.create_database_if_not_exists(args.database)
+    report = {"records": args.records, "batch_size": args.batch_size, "layouts": {}}
+    try:
+        for layout in layouts:
+            result = run_layout(database, layout, records, args)
+            report["layouts"][layout] = result
+            spread = ", ".join(
+                f"{kind} {s['partitions']} partitions (busiest {s['max_partition_share']:.0%})"
+                for kind, s in result["spread"].items()
+            )
+            print(f"{layout:<8} {result['records_per_s']:>9} records/s  {result['ru_per_record']:>6} RU/record  "
+                  f"{result['throttled']:>5} throttled  {result['failed']:>5} failed  {spread}")
+    finally:
+        if not args.keep and not args.local:
+            client.delete_database(args.database)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+# stubServices.py
+"""Scripted stand-ins for Azure OpenAI used by the load-test harness"""
+import asyncio
+import hashlib
+import json
+import re
+import time
+import uuid
+from typing import ClassVar, List
+
+from semantic_kernel.contents import AuthorRole, ChatHistory, ChatMessageContent, FunctionCallContent, FunctionResultContent
+
+from tracing.kernelTracing import TracedAzureChatCompletion
+
+try:
+    from semantic_kernel.connectors.ai.completion_usage import CompletionUsage
+except ImportError:  # older semantic-kernel releases
+    CompletionUsage = None
+
+ARTNR_PATTERN = re.compile(r"\b(?:\d{5}|\d{6})\b")
+DIMMING_PATTERN = re.compile(r"\b(dali|1-10v|mains|casambi|touchdim)\b", re.IGNORECASE)
+CURRENT_PATTERN = re.compile(r"\b(\d{3,4})\s?ma\b", re.IGNORECASE)
+VOLTAGE_PATTERN = re.compile(r"\b(\d{2})\s?v\b", re.IGNORECASE)
+SQL_PATTERN = re.compile(r"\b(price|ip\s?\d+|efficiency|size|class|strain relief|cheapest|most efficient)\b", re.IGNORECASE)
+LAMP_PATTERN = re.compile(r"(?:for|with|of)\s+([a-z0-9²\s]+?)\s*(?:lamps?|luminaires?)?\s*\??$", re.IGNORECASE)
+
+
+def estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class ScriptedChatCompletion(TracedAzureChatCompletion):
+    """AzureChatCompletion whose model round trips are scripted locally.
+
+    Tool calls are chosen with the same decision flow the routing prompt
+    describes, so Semantic Kernel's auto function invocation, the plugins
+    and the tracing filters all run for real; only the HTTP call is
+    replaced by a sleep of first_token_latency + tokens * token_latency.
+    """
+
+    first_token_latency: ClassVar[float] = 0.3
+    token_latency: ClassVar[float] = 0.02
+    answer_tokens: ClassVar[int] = 80
+
+    async def _complete_round(self, chat_history: ChatHistory, settings) -> List[ChatMessageContent]:
+        prompt_tokens = sum(estimate_tokens(str(m.content or "")) for m in chat_history.messages)
+        last_user = next((m for m in reversed(chat_history.messages) if m.role == AuthorRole.USER), None)
+        text = str(last_user.content) if last_user else ""
+
+        if text.startswith("Convert to Cosmos DB SQL"):
+            reply = self._scripted_sql(text)
+            return [await self._reply(reply, prompt_tokens, estimate_tokens(reply))]
+
+        question = self._extract_question(text)
+        tools_used = self._tools_since_last_user(chat_history)
+        call = None
+        if getattr(settings, "tools", None) or getattr(settings, "function_choice_behavior", None):
+            call = self._next_tool_call(question, tools_used, chat_history)
+
+        if call is not None:
+            plugin, function, arguments = call
+            content = FunctionCallContent(
+                id=f"call_{uuid.uuid4().hex[:24]}",
+                plugin_name=plugin,
+                function_name=function,
+                name=f"{plugin}-{function}",
+                arguments=json.dumps(arguments)
+            )
+            return [await self._reply(None, prompt_tokens, 20, items=[content])]
+
+        answer = " ".join(["token"] * self.answer_tokens)
+        return [await self._reply(f"Scripted answer to: {question}. {answer}", prompt_tokens, self.answer_tokens)]
+
+    async def _reply(self, content, prompt_tokens: int, completion_tokens: int, items=None) -> ChatMessageContent:
+        await asyncio.sleep(self.first_token_latency + completion_tokens * self.token_latency)
+        metadata = {"id": uuid.uuid4().hex, "created": int(time.time())}
+        if CompletionUsage is not None:
+            metadata["usage"] = CompletionUsage(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens)
+        message = ChatMessageContent(role=AuthorRole.ASSISTANT, content=content, metadata=metadata, ai_model_id="scripted")
+        for item in items or []:
+            message.items.append(item)
+        return message
+
+    @staticmethod
+    def _extract_question(text: str) -> str:
+        match = re.search(r"Process this user query:\s*(.*?)\n\s*\n", text, re.DOTALL)
+        return (match.group(1) if match else text).strip()
+
+    @staticmethod
+    def _tools_since_last_user(chat_history: ChatHistory) -> List[FunctionCallContent]:
+        calls = []
+        for message in reversed(chat_history.messages):
+            if message.role == AuthorRole.USER:
+                break
+            calls.extend(item for item in message.items if isinstance(item, FunctionCallContent))
+        return list(reversed(calls))
+
+    def _next_tool_call(self, question: str, tools_used, chat_history: ChatHistory):
+        used = [c.function_name for c in tools_used]
+        artnr = ARTNR_PATTERN.search(question)
+
+        if SQL_PATTERN.search(question):
+            if "generate_sql" not in used:
+                return "NL2SQLPlugin", "generate_sql", {"question": question}
+            if "query_converters" not in used:
+                results = [i for i in chat_history.messages[-1].items if isinstance(i, FunctionResultContent)]
+                sql = str(results[-1].result) if results else "SELECT * FROM c"
+                return "CosmosDBPlugin", "query_converters", {"user_input": question, "query": sql}
+            return None
+        if used:
+            return None
+        if artnr:
+            lamp = LAMP_PATTERN.search(question)
+            if re.search(r"\b(how many|min|max|most|least)\b", question, re.IGNORECASE) and lamp:
+                return "CosmosDBPlugin", "get_lamp_limits", {"artnr": int(artnr.group()), "lamp_type": lamp.group(1).strip()}
+            return "CosmosDBPlugin", "get_compatible_lamps", {"artnr": int(artnr.group())}
+        dimming = DIMMING_PATTERN.search(question)
+        if dimming:
+            return "CosmosDBPlugin", "get_converters_by_dimming", {"dimming_type": dimming.group(1)}
+        current = CURRENT_PATTERN.search(question)
+        if current:
+            return "CosmosDBPlugin", "get_converters_by_voltage_current", {"current": f"{current.group(1)}mA"}
+        voltage = VOLTAGE_PATTERN.search(question)
+        if voltage:
+            return "CosmosDBPlugin", "get_converters_by_voltage_current", {"output_voltage": voltage.group(1)}
+        lamp = LAMP_PATTERN.search(question)
+        if lamp:
+            return "CosmosDBPlugin", "get_converters_by_lamp_type", {"lamp_type": lamp.group(1).strip()}
+        return None
+
+    @staticmethod
+    def _scripted_sql(text: str) -> str:
+        question = text.split("\n", 1)[0]
+        artnr = ARTNR_PATTERN.search(question)
+        if artnr:
+            return f"SELECT * FROM c WHERE c.artnr={artnr.group()}"
+        ip = re.search(r"ip\s?(\d+)", question, re.IGNORECASE)
+        if ip:
+            return f"SELECT * FROM c WHERE c.ip = {ip.group(1)}"
+        return "SELECT TOP 5 * FROM c ORDER BY c.listprice"
+
+
+class StubEmbeddings:
+    """Deterministic embed_documents with a fixed per-call latency"""
+
+    def __init__(self, latency: float = 0.15, dimensions: int = 1536):
+        self.latency = latency
+        self.dimensions = dimensions
+        self.calls = 0
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.calls += 1
+        time.sleep(self.latency)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+    def _vector(self, text: str) -> List[float]:
+        seed = hashlib.sha256(text.lower().encode("utf-8")).digest()
+        return [((seed[i % len(seed)] + i) % 255) / 255.0 - 0.5 for i in range(self.dimensions)]
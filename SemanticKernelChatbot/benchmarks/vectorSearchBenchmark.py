@@ -0,0 +1,224 @@
+# vectorSearchBenchmark.py
+"""Request units and latency of similarity search per vector index and embedding storage.
+
+Creates one ChatHistory-shaped container per vector index type and
+embedding storage (float32, int8, binary - see embeddingCodec.py) in a
+separate database, fills them with synthetic embeddings in steps (the
+history growing) and after every step runs the same similarity search
+as ChatMemoryHandler.search_similar_questions against each. Reported per
+container and size: query latency p50/p95, request units per query,
+write request units and JSON bytes per document, and recall@k against
+the exact nearest neighbours of the float32 vectors.
+
+Run from the SemanticKernelChatbot directory against the local emulator
+
+    python benchmarks/vectorSearchBenchmark.py --emulator --sizes 1000,5000,20000
+
+or against the account in .env (AZURE_COSMOS_DB_ENDPOINT/KEY). The
+benchmark database is deleted afterwards unless --keep is given; it never
+touches TAL_ChatData. --local runs against the in-memory stand-in to check
+the script itself, its request units are simulated.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, APP_DIR)
+
+from benchmarks.loadTest import percentile
+from CosmosDBHandlers.containerPolicies import (
+    CHAT_HISTORY_PARTITION_KEY, EMBEDDING_DIMENSIONS, VECTOR_INDEX_TYPES, chat_history_policies
+)
+from CosmosDBHandlers.embeddingCodec import STORAGE_TYPES, recode_embedding, similar_documents
+
+# Well-known key of the Azure Cosmos DB emulator, the same on every installation
+EMULATOR_ENDPOINT = "https://localhost:8081"
+EMULATOR_KEY = "C2y6yDjf5/R+ob0N8A7Cgv30VRDJIWEHLM+4QDU5DE2nQ9nDuVTqobD4b8mGGyPMbIZnqyMsEcaGQy67XIw/Jw=="
+FUNCTIONS = ["CosmosDBPlugin.get_compatible_lamps", "CosmosDBPlugin.get_converter_info",
+             "CosmosDBPlugin.get_compatible_converters", "NL2SQLPlugin.query_converters", "chat"]
+
+
+class SyntheticHistory:
+    """Clustered unit vectors, like questions that keep coming back in different words"""
+
+    def __init__(self, dimensions: int, topics: int = 50, spread: Tuple[float, float] = (0.2, 1.2), seed: int = 42):
+        self.rng = np.random.default_rng(seed)
+        self.dimensions = dimensions
+        # Noise per question, so neighbours are spread out rather than tied
+        self.spread = spread
+        self.centers = self._normalize(self.rng.standard_normal((topics, dimensions)))
+        self.ids: List[str] = []
+        self.vectors = np.empty((0, dimensions), dtype=np.float32)
+
+    @staticmethod
+    def _normalize(vectors: np.ndarray) -> np.ndarray:
+        return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+    def _near_topics(self, n: int) -> np.ndarray:
+        topics = self.rng.integers(0, len(self.centers), n)
+        spread = self.rng.uniform(*self.spread, (n, 1))
+        noise = self.rng.standard_normal((n, self.dimensions)) * spread / np.sqrt(self.dimensions)
+        return self._normalize(self.centers[topics] + noise)
+
+    def grow(self, n: int) -> List[Dict]:
+        vectors = self._near_topics(n)
+        start = len(self.ids)
+        docs = []
+        for i, vector in enumerate(vectors):
+            doc_id = f"bench-{start + i}"
+            self.ids.append(doc_id)
+            docs.append({
+                "id": doc_id,
+                "sessionId": f"session-{(start + i) % 500}",
+                "question": f"synthetic question {start + i}",
+                "answer": "synthetic answer",
+                "functionUsed": random.choice(FUNCTIONS),
+                "timestamp": "2025-01-01T00:00:00+00:00",
+                "embedding": vector.tolist()
+            })
+        self.vectors = np.vstack([self.vectors, vectors])
+        return docs
+
+    def queries(self, n: int) -> np.ndarray:
+        return self._near_topics(n)
+
+    def exact_top(self, query: np.ndarray, k: int) -> List[str]:
+        scores = self.vectors @ query
+        return [self.ids[i] for i in np.argsort(-scores)[:k]]
+
+
+def insert(container, docs: List[Dict], workers: int) -> float:
+    """Upsert concurrently; returns the total write request charge"""
+    charges: List[float] = []
+
+    def upsert(doc):
+        container.upsert_item(doc, response_hook=lambda headers, _: charges.append(
+            float(headers.get("x-ms-request-charge", 0))))
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        list(pool.map(upsert, docs))
+    return sum(charges)
+
+
+def run_query(container, vector: np.ndarray, top: int, storage: str, dimensions: int):
+    """(result ids, latency ms, request charge summed over all pages and queries)"""
+    charges: List[float] = []
+    start = time.perf_counter()
+    items = similar_documents(container, vector.tolist(), top, storage, dimensions,
+                              on_page=lambda headers: charges.append(float(headers.get("x-ms-request-charge", 0))))
+    latency = (time.perf_counter() - start) * 1000
+    return [item["id"] for item in items], latency, sum(charges)
+
+
+def summarize(latencies: List[float], charges: List[float], recalls: List[float]) -> Dict:
+    return {
+        "latency_ms": {"p50": round(percentile(latencies, 50), 1), "p95": round(percentile(latencies, 95), 1)},
+        "ru_per_query": {"mean": round(float(np.mean(charges)), 2), "p95": round(percentile(charges, 95), 2)},
+        "recall": round(float(np.mean(recalls)), 3)
+    }
+
+
+def connect(args):
+    if args.local:
+        from benchmarks.localCosmos import LocalCosmosClient
+        return LocalCosmosClient()
+    from azure.cosmos import CosmosClient
+    if args.emulator:
+        # The emulator serves a self-signed certificate
+        return CosmosClient(EMULATOR_ENDPOINT, EMULATOR_KEY, connection_verify=False)
+    from dotenv import load_dotenv
+    load_dotenv(os.path.join(APP_DIR, ".env"))
+    return CosmosClient(os.getenv("AZURE_COSMOS_DB_ENDPOINT"), os.getenv("AZURE_COSMOS_DB_KEY"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare similarity search with and without a vector index")
+    parser.add_argument("--sizes", default="1000,5000,20000", help="Documents per container after each step")
+    parser.add_argument("--index-types", default="none,quantizedFlat,diskANN")
+    parser.add_argument("--storage", default="float32",
+                        help="Embedding storage types to compare, e.g. float32,int8,binary")
+    parser.add_argument("--queries", type=int, default=30, help="Similarity queries per step")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--dimensions", type=int, default=EMBEDDING_DIMENSIONS)
+    parser.add_argument("--workers", type=int, default=16, help="Concurrent inserts")
+    parser.add_argument("--database", default="TAL_VectorBenchmark")
+    parser.add_argument("--emulator", action="store_true", help="Use the local Cosmos DB emulator")
+    parser.add_argument("--local", action="store_true", help="Use the in-memory stand-in (smoke test)")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark database")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="Write the report as JSON to this file")
+    args = parser.parse_args()
+
+    index_types = args.index_types.split(",")
+    unknown = set(index_types) - set(VECTOR_INDEX_TYPES)
+    if unknown:
+        parser.error(f"Unknown index types {sorted(unknown)}, expected {VECTOR_INDEX_TYPES}")
+    storages = args.storage.split(",")
+    unknown = set(storages) - set(STORAGE_TYPES)
+    if unknown:
+        parser.error(f"Unknown storage types {sorted(unknown)}, expected {STORAGE_TYPES}")
+    sizes = sorted(int(size) for size in args.sizes.split(","))
+    random.seed(args.seed)
+
+    from azure.cosmos import PartitionKey
+    client = connect(args)
+    database = client.create_database_if_not_exists(args.database)
+    containers = {}
+    for storage in storages:
+        # Sign codes have no vector index, one container covers them
+        for index_type in ["none"] if storage == "binary" else index_types:
+            indexing_policy, vector_embedding_policy = chat_history_policies(index_type, args.dimensions, storage)
+            containers[(storage, index_type)] = database.create_container_if_not_exists(
+                id=f"ChatHistory_{storage}_{index_type}",
+                partition_key=PartitionKey(path=CHAT_HISTORY_PARTITION_KEY),
+                indexing_policy=indexing_policy,
+                vector_embedding_policy=vector_embedding_policy
+            )
+
+    history = SyntheticHistory(args.dimensions, seed=args.seed)
+    report = {"dimensions": args.dimensions, "top": args.top, "queries": args.queries, "steps": []}
+    try:
+        for size in sizes:
+            docs = history.grow(size - len(history.ids))
+            queries = history.queries(args.queries)
+            expected = [set(history.exact_top(q, args.top)) for q in queries]
+            step = {"documents": size, "containers": {}}
+            for (storage, index_type), container in containers.items():
+                encoded = [recode_embedding(dict(doc), storage, args.dimensions) for doc in docs]
+                write_charge = insert(container, encoded, args.workers)
+                latencies, charges, recalls = [], [], []
+                for query, exact in zip(queries, expected):
+                    ids, latency, charge = run_query(container, query, args.top, storage, args.dimensions)
+                    latencies.append(latency)
+                    charges.append(charge)
+                    recalls.append(len(exact & set(ids)) / len(exact))
+                result = summarize(latencies, charges, recalls)
+                result["write_ru_per_doc"] = round(write_charge / len(docs), 2) if docs else 0.0
+                result["bytes_per_doc"] = round(float(np.mean([len(json.dumps(doc)) for doc in encoded[:200]])))
+                label = f"{storage}/{index_type}"
+                step["containers"][label] = result
+                print(f"{size:>8} docs  {label:<22} p50 {result['latency_ms']['p50']:>8} ms  "
+                      f"p95 {result['latency_ms']['p95']:>8} ms  {result['ru_per_query']['mean']:>9} RU/query  "
+                      f"{result['write_ru_per_doc']:>6} RU/write  {result['bytes_per_doc']:>6} B/doc  "
+                      f"recall@{args.top} {result['recall']}")
+            report["steps"].append(step)
+    finally:
+        if not args.keep and not args.local:
+            client.delete_database(args.database)
+
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,9 @@
 import asyncio
 import logging
+import threading
+import time
 import uuid
+from datetime import datetime
 from semantic_kernel import Kernel
 from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
 from semantic_kernel.functions import kernel_function
@@ -13,6 +16,10 @@ from semantic_kernel.connectors.ai.function_choice_behavior import FunctionChoic
 from models.converterModels import PowerConverter  
 from plugins.converterPlugin import ConverterPlugin
 from plugins.chatMemoryPlugin import ChatMemoryPlugin
+from tracing.chatTracer import tracer
+from tracing.kernelTracing import TracedAzureChatCompletion, add_tracing_filters, interaction_metrics
+from routing.modelCascade import ModelCascade
+from history.tokenBudgetReducer import TokenBudgetHistoryReducer
 import os
 import gradio as gr
 
@@ -32,7 +39,7 @@ logger.addHandler(handler)
 kernel = Kernel()
 
 # Add Azure OpenAI Chat Service
-kernel.add_service(AzureChatCompletion(
+kernel.add_service(TracedAzureChatCompletion(
     service_id="chat",
     deployment_name=os.getenv("AZURE_OPENAI_DEPLOYMENT_NAME"),
     endpoint=os.getenv("AZURE_OPENAI_ENDPOINT"),
@@ -161,16 +168,26 @@ class NL2SQLPlugin:
 
 
 # Register plugins
-kernel.add_plugin(ConverterPlugin(logger=logger), "CosmosDBPlugin")
-kernel.add_plugin(ChatMemoryPlugin(logger=logger), "ChatMemoryPlugin")
+chat_memory_plugin = ChatMemoryPlugin(logger=logger)
+kernel.add_plugin(ConverterPlugin(logger=logger, chat_memory_handler=chat_memory_plugin.chat_memory_handler), "CosmosDBPlugin")
+kernel.add_plugin(chat_memory_plugin, "ChatMemoryPlugin")
 kernel.add_plugin(NL2SQLPlugin(), "NL2SQLPlugin")
+add_tracing_filters(kernel)
+
+# Rule classifier / local model first, Azure only when needed
+cascade = ModelCascade(kernel, logger=logger)
 
 
 session_chat_histories = {}
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "4000"))
+HISTORY_RECENT_TOKENS = int(os.getenv("HISTORY_RECENT_TOKENS", "1500"))
+
 async def handle_query(user_input: str, session_state:str):
+    with tracer.span("handle_query", session_id=session_state, question_chars=len(user_input)):
+        return await _handle_query(user_input, session_state)
+
+async def _handle_query(user_input: str, session_state:str):
     global session_chat_histories
-    
-    from semantic_kernel.contents import ChatHistoryTruncationReducer
 
     
     settings = AzureChatPromptExecutionSettings(
@@ -253,11 +270,12 @@ async def handle_query(user_input: str, session_state:str):
     try:
 
         if session_state not in session_chat_histories:
-            chat_history = ChatHistoryTruncationReducer(
+            chat_history = TokenBudgetHistoryReducer(
+                service=kernel.get_service("chat"),
+                logger=logger,
                 system_message=prompt,
-                target_count=3,
-                threshold_count=2,
-                auto_reduce=True
+                max_tokens=HISTORY_TOKEN_BUDGET,
+                recent_tokens=HISTORY_RECENT_TOKENS
             )
             session_chat_histories[session_state] = chat_history
             
@@ -265,7 +283,27 @@ async def handle_query(user_input: str, session_state:str):
             chat_history = session_chat_histories[session_state]
         
         chat_history.add_user_message(user_input)
+        # Keep the prompt under budget before this turn goes to the model
+        await chat_history.reduce()
+
+        log_func = kernel.get_function("ChatMemoryPlugin", "log_interaction")
+        cascade_result = await cascade.route(user_input)
+        if cascade_result.answer is not None:
+            # Keep the local answer in the history so follow-ups have context
+            chat_history.add_assistant_message(cascade_result.answer)
+            await log_func.invoke(
+                kernel=kernel,
+                session_id=session_state,
+                question=user_input,
+                function_used=cascade_result.function_used,
+                answer=cascade_result.answer,
+                tier=cascade_result.tier,
+                metrics=interaction_metrics(cascade_result.escalation_reason)
+            )
+            return cascade_result.answer
 
+        if cascade_result.prefetched:
+            chat_history.add_system_message(cascade_result.escalation_context())
 
         chat_service = kernel.get_service("chat")
         result = await chat_service.get_chat_message_content(
@@ -274,6 +312,16 @@ async def handle_query(user_input: str, session_state:str):
                 kernel=kernel,
             )
         chat_history.add_assistant_message(str(result))
+
+        await log_func.invoke(
+            kernel=kernel,
+            session_id=session_state,
+            question=user_input,
+            function_used=cascade_result.proposal.tool if cascade_result.prefetched else None,
+            answer=str(result),
+            tier=cascade_result.tier,
+            metrics=interaction_metrics(cascade_result.escalation_reason)
+        )
         
         return str(result)
         
@@ -403,16 +451,14 @@ def format_faq_question(question):
 
 panel_visible = False
 
-async def get_chatbot_examples():
-    """Fetch FAQs and format them as Gradio chatbot examples"""
+FAQ_REFRESH_SECONDS = int(os.getenv("FAQ_REFRESH_SECONDS", "3600"))
+FAQ_POLL_SECONDS = int(os.getenv("FAQ_POLL_SECONDS", "60"))
+
+def get_chatbot_examples():
+    """Read the precomputed FAQ snapshot and format it as Gradio chatbot examples"""
     try:
-        # Get your chat memory plugin instance
-        get_faqs_func = kernel.get_function("ChatMemoryPlugin", "get_semantic_faqs")
-        
-        # Call the function to get FAQs
-        result = await get_faqs_func.invoke(kernel=kernel, limit=6, threshold=0.1)
-        faqs = result.value if hasattr(result, 'value') else result
-        
+        faqs = chat_memory_plugin.get_faq_snapshot(limit=6)
+
         # Format as Gradio examples
         examples = []
         for faq in faqs:
@@ -421,19 +467,33 @@ async def get_chatbot_examples():
                 "text": faq,
                 "display_text": faq
             })
-        
+
         return examples
     except Exception as e:
         logger.error(f"Failed to load FAQ examples: {str(e)}")
         return []
-    
-def get_examples_sync():
-    try:
-        loop = asyncio.get_event_loop()
-        return loop.run_until_complete(get_chatbot_examples())
-    except:
-        # If no event loop, create one
-        return asyncio.run(get_chatbot_examples())
+
+def refresh_faqs_forever():
+    """Recompute the FAQ snapshot periodically on its own thread and event loop"""
+    generated_at = chat_memory_plugin.chat_memory_handler.load_faq_snapshot().get("generated_at")
+    age = time.time() - datetime.fromisoformat(generated_at).timestamp() if generated_at else FAQ_REFRESH_SECONDS
+    time.sleep(max(0, FAQ_REFRESH_SECONDS - age))
+    while True:
+        try:
+            asyncio.run(chat_memory_plugin.refresh_faq_snapshot(limit=6, threshold=0.1))
+        except Exception as e:
+            logger.error(f"FAQ refresh failed: {str(e)}")
+        time.sleep(FAQ_REFRESH_SECONDS)
+
+def start_faq_refresher():
+    threading.Thread(target=refresh_faqs_forever, name="faq-refresh", daemon=True).start()
+
+def update_examples(current_examples):
+    """Pick up a newer snapshot without restarting the app"""
+    examples = get_chatbot_examples()
+    if not examples or examples == current_examples:
+        return gr.update(), current_examples
+    return gr.update(examples=examples), examples
     
 def toggle_panel():
     global panel_visible
@@ -442,7 +502,8 @@ def toggle_panel():
 
 # Apply the custom theme to your Blocks
 with gr.Blocks(theme=custom_theme, css=minimal_css) as demo:
-    faqs = gr.State(get_examples_sync())
+    faqs = gr.State(get_chatbot_examples())
+    faq_timer = gr.Timer(FAQ_POLL_SECONDS)
 
     session_id = gr.State(str(uuid.uuid4()))
 
@@ -567,9 +628,10 @@ with gr.Blocks(theme=custom_theme, css=minimal_css) as demo:
         """
     )
 
-    def handle_example_select(evt: gr.SelectData):
+    def handle_example_select(evt: gr.SelectData, examples):
         """Handle when user clicks on an example"""
-        examples = faqs.value
+        if isinstance(evt.value, dict) and evt.value.get("text"):
+            return evt.value["text"]
         if evt.index < len(examples):
             selected_example = examples[evt.index]
             return selected_example.get("text", "")
@@ -578,9 +640,12 @@ with gr.Blocks(theme=custom_theme, css=minimal_css) as demo:
     # Connect the example_select event to populate the textbox
     chatbot.example_select(
         fn=handle_example_select,
+        inputs=faqs,
         outputs=msg
     )
 
+    faq_timer.tick(update_examples, inputs=faqs, outputs=[chatbot, faqs])
+
     # Your existing event handlers
     async def respond(message, chat_history):
         response = await handle_query(message, session_id.value)
@@ -592,4 +657,6 @@ with gr.Blocks(theme=custom_theme, css=minimal_css) as demo:
     msg.submit(respond, [msg, chatbot], [msg, chatbot])
     toggle_btn.click(toggle_panel, outputs=chat_panel)
 
-demo.launch()
+if __name__ == "__main__":
+    start_faq_refresher()
+    demo.launch()
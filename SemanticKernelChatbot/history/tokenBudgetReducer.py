@@ -0,0 +1,202 @@
+# tokenBudgetReducer.py
+import logging
+import re
+import sys
+from typing import Any, Dict, List, Optional
+
+import tiktoken
+from pydantic import Field, PrivateAttr
+from semantic_kernel.contents import (
+    AuthorRole,
+    ChatHistory,
+    ChatHistoryReducer,
+    ChatMessageContent,
+    FunctionCallContent,
+    FunctionResultContent,
+)
+
+if sys.version_info >= (3, 11):
+    from typing import Self
+else:
+    from typing_extensions import Self
+
+ARTNR_PATTERN = re.compile(r"\b(?:\d{5}|\d{6})\b")
+DUMP_ARTNR_PATTERN = re.compile(r"'artnr': (\d+)")
+DUMP_LAMP_PATTERN = re.compile(r"'([^']+)': \{'min'")
+SUMMARY_MARKER = "history_summary"
+
+
+class TokenBudgetHistoryReducer(ChatHistoryReducer):
+    """Chat history kept under a token budget measured with tiktoken.
+
+    When the history grows past max_tokens, tool calls and results from
+    earlier turns are replaced by one-line entity notes (function,
+    arguments, artnrs and lamps returned). If that is not enough, the
+    oldest turns are folded into a running summary: only the evicted turns
+    are sent to the model together with the previous summary, so the cost
+    of summarizing does not grow with the length of the session.
+    The system prompt and the latest turn are never touched.
+    """
+
+    service: Any = Field(default=None, exclude=True)
+    max_tokens: int = 4000
+    recent_tokens: int = 1500
+    summary_max_tokens: int = 300
+    max_entity_notes: int = 20
+    encoding_name: str = "cl100k_base"
+    summary: str = ""
+    entity_notes: List[str] = Field(default_factory=list)
+
+    _encoding: Any = PrivateAttr(default=None)
+    _logger: Any = PrivateAttr(default=None)
+
+    def __init__(self, service=None, logger: Optional[logging.Logger] = None, **kwargs):
+        kwargs.setdefault("target_count", 1)
+        super().__init__(service=service, **kwargs)
+        self._encoding = tiktoken.get_encoding(self.encoding_name)
+        self._logger = logger or logging.getLogger(__name__)
+
+    # ---- token accounting ---------------------------------------------
+    def count_tokens(self, messages: Optional[List[ChatMessageContent]] = None) -> int:
+        messages = self.messages if messages is None else messages
+        return sum(self._message_tokens(m) for m in messages)
+
+    def _message_tokens(self, message: ChatMessageContent) -> int:
+        # ~4 tokens of per-message framing in the chat format
+        tokens = 4 + len(self._encoding.encode(message.content or ""))
+        for item in message.items:
+            if isinstance(item, FunctionCallContent):
+                tokens += len(self._encoding.encode(f"{item.name}{item.arguments or ''}"))
+            elif isinstance(item, FunctionResultContent):
+                tokens += len(self._encoding.encode(str(item.result)))
+        return tokens
+
+    # ---- reduction ----------------------------------------------------
+    async def reduce(self) -> Self | None:
+        if self.count_tokens() <= self.max_tokens:
+            return None
+
+        head = [m for m in self.messages[:1] if m.role == AuthorRole.SYSTEM]
+        body = [m for m in self.messages[len(head):] if not m.metadata.get(SUMMARY_MARKER)]
+        last_user = max((i for i, m in enumerate(body) if m.role == AuthorRole.USER), default=0)
+        older, recent = body[:last_user], body[last_user:]
+
+        older = self._compact_tool_messages(older)
+
+        # Evict whole turns, oldest first, until the rest fits
+        turns = self._split_turns(older)
+        evicted: List[ChatMessageContent] = []
+        fixed = self.count_tokens(head) + self.count_tokens(recent) + self._note_tokens()
+        while turns and (fixed + sum(self.count_tokens(t) for t in turns) > self.max_tokens
+                         or sum(self.count_tokens(t) for t in turns) > self.recent_tokens):
+            evicted.extend(turns.pop(0))
+        if evicted:
+            await self._update_summary(evicted)
+
+        kept = [m for turn in turns for m in turn]
+        self.messages = head + self._note_messages() + kept + recent
+        return self
+
+    def _split_turns(self, messages: List[ChatMessageContent]) -> List[List[ChatMessageContent]]:
+        turns: List[List[ChatMessageContent]] = []
+        for message in messages:
+            if message.role == AuthorRole.USER or not turns:
+                turns.append([])
+            turns[-1].append(message)
+        return turns
+
+    def _compact_tool_messages(self, messages: List[ChatMessageContent]) -> List[ChatMessageContent]:
+        """Replace tool calls and their results with entity notes"""
+        calls: Dict[str, FunctionCallContent] = {}
+        compacted = []
+        for message in messages:
+            call_items = [i for i in message.items if isinstance(i, FunctionCallContent)]
+            result_items = [i for i in message.items if isinstance(i, FunctionResultContent)]
+            for call in call_items:
+                calls[call.id] = call
+            for result in result_items:
+                call = calls.get(result.id)
+                try:
+                    arguments = call.parse_arguments() if call else {}
+                except Exception:
+                    arguments = {}
+                args = ", ".join(f"{k}={v}" for k, v in (arguments or {}).items())
+                self._add_entity_note(f"{result.function_name or 'tool'}({args})", str(result.result))
+            if message.role == AuthorRole.SYSTEM:
+                # Per-turn context such as results prefetched by the model cascade
+                self._add_entity_note("context", message.content or "")
+                continue
+            if message.role == AuthorRole.TOOL or (call_items and not (message.content or "").strip()):
+                continue
+            compacted.append(message)
+        return compacted
+
+    def _add_entity_note(self, source: str, output: str):
+
+        artnrs = list(dict.fromkeys(DUMP_ARTNR_PATTERN.findall(output) or ARTNR_PATTERN.findall(output)))
+        lamps = list(dict.fromkeys(DUMP_LAMP_PATTERN.findall(output)))
+        if output.startswith("Compatible lamps:"):
+            lamps = [lamp.strip() for lamp in output.split(":", 1)[1].split(",") if lamp.strip()]
+
+        if not artnrs and not lamps:
+            details = " ".join(output.split())[:120]
+        else:
+            parts = []
+            if artnrs:
+                parts.append(f"artnr {', '.join(artnrs[:10])}" + (f" (+{len(artnrs) - 10} more)" if len(artnrs) > 10 else ""))
+            if lamps:
+                parts.append(f"lamps {', '.join(lamps[:10])}" + (f" (+{len(lamps) - 10} more)" if len(lamps) > 10 else ""))
+            details = "; ".join(parts)
+
+        self.entity_notes.append(f"{source} -> {details}")
+        del self.entity_notes[:-self.max_entity_notes]
+
+    async def _update_summary(self, evicted: List[ChatMessageContent]):
+        transcript = "\n".join(
+            f"{m.role.value}: {m.content}" for m in evicted if (m.content or "").strip()
+        )
+        if not transcript or self.service is None:
+            return
+        prompt = ChatHistory()
+        prompt.add_system_message(
+            "You maintain a running summary of a customer chat about TAL LED converters. "
+            "Merge the new turns into the existing summary. Keep artnrs, lamp types, "
+            "dimming types and voltages the user cares about. Reply with the summary only."
+        )
+        prompt.add_user_message(f"Existing summary:\n{self.summary or '(none)'}\n\nNew turns:\n{transcript}")
+        try:
+            settings = self.service.get_prompt_execution_settings_class()(max_tokens=self.summary_max_tokens, temperature=0)
+            result = await self.service.get_chat_message_content(chat_history=prompt, settings=settings)
+            if result is not None and str(result).strip():
+                self.summary = str(result).strip()
+        except Exception as e:
+            # Keep going with the old summary; the turns are still covered by entity notes
+            self._logger.error(f"History summarization failed: {str(e)}")
+
+    def _note_messages(self) -> List[ChatMessageContent]:
+        text = self._note_text()
+        if not text:
+            return []
+        return [ChatMessageContent(role=AuthorRole.SYSTEM, content=text, metadata={SUMMARY_MARKER: True})]
+
+    def _note_text(self) -> str:
+        sections = []
+        if self.summary:
+            sections.append(f"Conversation so far: {self.summary}")
+        if self.entity_notes:
+            sections.append("Earlier tool results:\n" + "\n".join(f"- {n}" for n in self.entity_notes))
+        return "\n\n".join(sections)
+
+    def _note_tokens(self) -> int:
+        text = self._note_text()
+        # Allow for the summary growing by up to summary_max_tokens this round
+        return (len(self._encoding.encode(text)) + 4 if text else 0) + self.summary_max_tokens
+
+    def get_stats(self) -> Dict:
+        """Current prompt size and what has been compacted so far"""
+        return {
+            "tokens": self.count_tokens(),
+            "messages": len(self.messages),
+            "summary": self.summary,
+            "entity_notes": list(self.entity_notes),
+        }
@@ -1,6 +1,6 @@
 #converterPlugin.py
 from datetime import datetime
-from typing import Annotated, Dict, List, Optional
+from typing import Annotated, Any, Dict, List, Optional
 import uuid
 from CosmosDBHandlers.cosmosConnector import CosmosLampHandler
 from semantic_kernel.functions import kernel_function
@@ -12,13 +12,16 @@ class ChatMemoryPlugin:
         self.chat_memory_handler = ChatMemoryHandler(logger)
 
     @kernel_function(name="log_interaction", description="Logs chat interactions")
-    async def log_interaction(self, session_id: str, question: str, function_used: str, answer: str):
+    async def log_interaction(self, session_id: str, question: str, function_used: str, answer: str,
+                              tier: Optional[str] = None, metrics: Optional[Dict[str, Any]] = None):
 
         try:
             await self.chat_memory_handler.log_interaction(session_id=session_id,
                                                            question=question,
                                                            function_used=function_used,
-                                                           answer=answer)
+                                                           answer=answer,
+                                                           tier=tier,
+                                                           metrics=metrics)
         except Exception as e:
             self.logger.error(f"Failed to log chat interaction: {str(e)}")
 
@@ -37,13 +40,29 @@ class ChatMemoryPlugin:
         """Retrieve FAQs using vector embeddings for semantic similarity"""
         try:
             faqs_dict = await self.chat_memory_handler.get_semantic_faqs(limit=limit+5, threshold=threshold)
-            faqs = [faq["representative_question"] for faq in faqs_dict]
-            
-            # Remove duplicates while preserving order
-            unique_faqs = list(dict.fromkeys(faqs))
-            
+            unique_faqs = self._unique_questions(faqs_dict, limit)
             self.logger.info(unique_faqs)
-            return unique_faqs[:limit]
+            return unique_faqs
         except Exception as e:
             self.logger.error(f"Semantic FAQ retrieval failed: {str(e)}")
-            return []
\ No newline at end of file
+            return []
+
+    def get_faq_snapshot(self, limit: int = 6) -> List[str]:
+        """FAQs from the precomputed snapshot; a file read, no Cosmos or embedding calls"""
+        snapshot = self.chat_memory_handler.load_faq_snapshot()
+        return self._unique_questions(snapshot.get("faqs", []), limit)
+
+    async def refresh_faq_snapshot(self, limit: int = 6, threshold: float = 0.1) -> List[str]:
+        """Recompute the FAQ snapshot; meant for a background job, not the request path"""
+        try:
+            snapshot = await self.chat_memory_handler.refresh_faq_snapshot(limit=limit+5, threshold=threshold)
+            return self._unique_questions(snapshot.get("faqs", []), limit)
+        except Exception as e:
+            self.logger.error(f"FAQ snapshot refresh failed: {str(e)}")
+            return self.get_faq_snapshot(limit)
+
+    @staticmethod
+    def _unique_questions(faqs_dict: List[Dict], limit: int) -> List[str]:
+        faqs = [faq["representative_question"] for faq in faqs_dict]
+        # Remove duplicates while preserving order
+        return list(dict.fromkeys(faqs))[:limit]
\ No newline at end of file
@@ -4,9 +4,9 @@ from CosmosDBHandlers.cosmosConnector import CosmosLampHandler
 from semantic_kernel.functions import kernel_function
 
 class ConverterPlugin:
-    def __init__(self, logger):
+    def __init__(self, logger, chat_memory_handler=None):
         self.logger = logger
-        self.db = CosmosLampHandler(logger=logger)
+        self.db = CosmosLampHandler(logger=logger, chat_memory_handler=chat_memory_handler)
 
     
     @kernel_function(
@@ -0,0 +1,308 @@
+# modelCascade.py
+import json
+import logging
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from semantic_kernel import Kernel
+
+from tracing.chatTracer import tracer
+
+try:
+    import ollama
+except ImportError:  # the local tier is optional
+    ollama = None
+
+ARTNR_PATTERN = re.compile(r"\b(?:\d{5}|\d{6})\b")
+DIMMING_PATTERN = re.compile(r"\b(dali|1-10\s?v|mains|casambi|touchdim)\b", re.IGNORECASE)
+CURRENT_PATTERN = re.compile(r"\b(\d{3,4})\s?ma\b", re.IGNORECASE)
+VOLTAGE_PATTERN = re.compile(r"\b(\d{1,3})\s?v\b(?!\s?dc\s?input)", re.IGNORECASE)
+# Schema keywords the routing prompt sends to generate_sql
+SQL_PATTERN = re.compile(
+    r"\b(price|cost|eur|ip\s?\d{2}|efficiency|size|dimensions?|class|strain relief|lifecycle|"
+    r"cheapest|barcode|weight|dimming type|voltage range|type of)\b",
+    re.IGNORECASE
+)
+DML_PATTERN = re.compile(r"\b(delete|update|insert|drop)\b", re.IGNORECASE)
+LIMIT_PATTERN = re.compile(r"\b(how many|min(?:imum)?|max(?:imum)?)\b", re.IGNORECASE)
+# Questions that compare or rank results need the large model to reason over them
+SYNTHESIS_PATTERN = re.compile(r"\b(most|least|best|compare|comparison|difference|versus|vs|which one|recommend)\b", re.IGNORECASE)
+COMPATIBLE_PATTERN = re.compile(r"\b(lamps?|luminaires?|luminares?|compatible)\b", re.IGNORECASE)
+LAMP_PATTERN = re.compile(
+    r"(?:for|with|of|on)\s+(?:the\s+)?([a-z][a-z0-9²\-\s]*?)\s*(?:lamps?|luminaires?|luminares?)?\s*\??$",
+    re.IGNORECASE
+)
+
+# Tools whose output is already a readable answer
+DIRECT_ANSWER_TOOLS = {"get_compatible_lamps", "get_lamp_limits"}
+NL2SQL_TOOLS = {"generate_sql", "query_converters"}
+TOOL_PLUGINS = {
+    "generate_sql": "NL2SQLPlugin",
+    "query_converters": "CosmosDBPlugin",
+    "get_compatible_lamps": "CosmosDBPlugin",
+    "get_converters_by_lamp_type": "CosmosDBPlugin",
+    "get_lamp_limits": "CosmosDBPlugin",
+    "get_converters_by_dimming": "CosmosDBPlugin",
+    "get_converters_by_voltage_current": "CosmosDBPlugin",
+}
+
+
+@dataclass
+class ToolProposal:
+    tool: str
+    arguments: Dict = field(default_factory=dict)
+    confidence: float = 0.0
+    source: str = "rules"
+    needs_synthesis: bool = False
+
+
+@dataclass
+class CascadeResult:
+    """Outcome of the cheap tiers for one question.
+
+    answer is set when the question was fully handled without Azure.
+    Otherwise escalation_reason says why, and prefetched holds any tool
+    output already retrieved so the large model does not fetch it again.
+    """
+    tier: str
+    answer: Optional[str] = None
+    function_used: Optional[str] = None
+    escalation_reason: Optional[str] = None
+    proposal: Optional[ToolProposal] = None
+    prefetched: Optional[str] = None
+
+    def escalation_context(self) -> str:
+        if not self.prefetched or not self.proposal:
+            return ""
+        return f"""
+    Tool results already retrieved for this question with {self.proposal.tool}({json.dumps(self.proposal.arguments)}):
+    {self.prefetched}
+    Use these results instead of calling {self.proposal.tool} again.
+    """
+
+
+class RuleRouter:
+    """Compact classifier mirroring the decision flow of the routing prompt"""
+
+    def propose(self, question: str) -> Optional[ToolProposal]:
+        if DML_PATTERN.search(question):
+            return None
+
+        artnr = ARTNR_PATTERN.search(question)
+        needs_synthesis = bool(SYNTHESIS_PATTERN.search(question))
+        lamp = LAMP_PATTERN.search(question)
+        lamp_type = lamp.group(1).strip() if lamp else None
+
+        if SQL_PATTERN.search(question):
+            return ToolProposal("generate_sql", {"question": question}, 0.9, needs_synthesis=needs_synthesis)
+
+        if artnr:
+            artnr_value = int(artnr.group())
+            if LIMIT_PATTERN.search(question) or needs_synthesis:
+                if lamp_type and not ARTNR_PATTERN.search(lamp_type):
+                    return ToolProposal("get_lamp_limits", {"artnr": artnr_value, "lamp_type": lamp_type}, 0.85)
+                return ToolProposal("get_lamp_limits", {"artnr": artnr_value}, 0.4)
+            if COMPATIBLE_PATTERN.search(question):
+                return ToolProposal("get_compatible_lamps", {"artnr": artnr_value}, 0.9)
+            # Anything else about a specific converter is a spec lookup
+            return ToolProposal("generate_sql", {"question": question}, 0.7)
+
+        dimming = DIMMING_PATTERN.search(question)
+        current = CURRENT_PATTERN.search(question)
+        voltage = VOLTAGE_PATTERN.search(question)
+        if dimming:
+            arguments = {"dimming_type": dimming.group(1).lower()}
+            if current:
+                arguments["voltage_current"] = f"{current.group(1)}mA"
+            elif voltage:
+                arguments["voltage_current"] = f"{voltage.group(1)}V"
+            if lamp_type and not DIMMING_PATTERN.search(lamp_type):
+                arguments["lamp_type"] = lamp_type
+            return ToolProposal("get_converters_by_dimming", arguments, 0.85, needs_synthesis=needs_synthesis)
+
+        if current or voltage:
+            arguments = {"current": f"{current.group(1)}mA"} if current else {"output_voltage": voltage.group(1)}
+            # Several constraints in one question are better left to the large model
+            confidence = 0.85 if not (current and voltage) else 0.5
+            if lamp_type and not VOLTAGE_PATTERN.search(lamp_type):
+                arguments["lamp_type"] = lamp_type
+            return ToolProposal("get_converters_by_voltage_current", arguments, confidence, needs_synthesis=needs_synthesis)
+
+        if lamp_type and re.search(r"\b(converters?|drivers?|power suppl(?:y|ies)|gear)\b", question, re.IGNORECASE):
+            return ToolProposal("get_converters_by_lamp_type", {"lamp_type": lamp_type}, 0.75, needs_synthesis=needs_synthesis)
+
+        return None
+
+
+class OllamaRouter:
+    """Small local model that proposes a tool call as JSON"""
+
+    def __init__(self, model: str, host: Optional[str] = None, logger: Optional[logging.Logger] = None):
+        self.model = model
+        self.client = ollama.AsyncClient(host=host) if ollama is not None else None
+        self.logger = logger or logging.getLogger(__name__)
+
+    @property
+    def available(self) -> bool:
+        return self.client is not None
+
+    async def _chat(self, messages: List[Dict], **options) -> Dict:
+        with tracer.span("local_model", model=self.model) as span:
+            response = await self.client.chat(model=self.model, messages=messages, **options)
+            span.set_attribute("prompt_tokens", response.get("prompt_eval_count", 0) or 0)
+            span.set_attribute("completion_tokens", response.get("eval_count", 0) or 0)
+            span.root.add("local_prompt_tokens", span.attributes["prompt_tokens"])
+            span.root.add("local_completion_tokens", span.attributes["completion_tokens"])
+            return response
+
+    async def propose(self, question: str, tools: Dict[str, List[str]]) -> Optional[ToolProposal]:
+        if not self.available:
+            return None
+        tool_list = "\n".join(f"- {name}({', '.join(params)})" for name, params in tools.items())
+        prompt = f"""Pick the single function that answers this question about TAL LED converters.
+Functions:
+{tool_list}
+artnr values are 5 or 6 digit numbers. Questions about price, ip rating, efficiency, size or class need generate_sql.
+Reply with JSON only: {{"tool": "<name or null>", "arguments": {{}}, "confidence": <0 to 1>}}
+Question: {question}"""
+        try:
+            response = await self._chat(
+                [{"role": "user", "content": prompt}],
+                format="json",
+                options={"temperature": 0, "num_predict": 128}
+            )
+            data = json.loads(response["message"]["content"])
+        except Exception as e:
+            self.logger.error(f"Local routing failed: {str(e)}")
+            return None
+
+        tool = data.get("tool")
+        arguments = data.get("arguments") or {}
+        if tool not in tools or not isinstance(arguments, dict):
+            return None
+        # Drop hallucinated parameters rather than failing the invocation
+        arguments = {k: v for k, v in arguments.items() if k in tools[tool] and v is not None}
+        try:
+            confidence = float(data.get("confidence", 0))
+        except (TypeError, ValueError):
+            confidence = 0.0
+        return ToolProposal(tool, arguments, confidence, source="local")
+
+    async def answer(self, question: str, tool_output: str) -> Optional[str]:
+        if not self.available:
+            return None
+        try:
+            response = await self._chat(
+                [
+                    {"role": "system", "content": "You are a product catalog assistant for TAL BV. Answer using ONLY the provided results. Be brief."},
+                    {"role": "user", "content": f"Results:\n{tool_output}\n\nQuestion: {question}"}
+                ],
+                options={"temperature": 0.2, "num_predict": 256}
+            )
+            return response["message"]["content"].strip() or None
+        except Exception as e:
+            self.logger.error(f"Local answer failed: {str(e)}")
+            return None
+
+
+class ModelCascade:
+    """Answer simple questions without the Azure chat deployment.
+
+    The rule classifier proposes a tool call first, the local Ollama model
+    (if configured) second. The proposed function is invoked directly and
+    its output returned when it is already a readable answer, or phrased
+    by the local model when the result set is small. Everything else -
+    low confidence, NL2SQL, comparisons and large result sets - escalates
+    to the large model.
+    """
+
+    def __init__(
+        self,
+        kernel: Kernel,
+        logger: Optional[logging.Logger] = None,
+        confidence_threshold: Optional[float] = None,
+        max_local_results: int = 5,
+        local_model: Optional[str] = None
+    ):
+        self.kernel = kernel
+        self.logger = logger or logging.getLogger(__name__)
+        self.enabled = os.getenv("MODEL_CASCADE", "on").lower() not in ("off", "false", "0")
+        self.confidence_threshold = confidence_threshold or float(os.getenv("CASCADE_CONFIDENCE_THRESHOLD", "0.8"))
+        self.max_local_results = max_local_results
+        self.rule_router = RuleRouter()
+        local_model = local_model or os.getenv("CASCADE_OLLAMA_MODEL")
+        self.local_router = OllamaRouter(local_model, host=os.getenv("OLLAMA_HOST"), logger=self.logger) if local_model else None
+        self._tools: Optional[Dict[str, List[str]]] = None
+
+    @property
+    def tools(self) -> Dict[str, List[str]]:
+        if self._tools is None:
+            self._tools = {}
+            for name, plugin in TOOL_PLUGINS.items():
+                try:
+                    function = self.kernel.get_function(plugin, name)
+                    self._tools[name] = [p.name for p in function.metadata.parameters]
+                except Exception:
+                    continue
+        return self._tools
+
+    def _escalate(self, reason: str, proposal: Optional[ToolProposal] = None, prefetched: Optional[str] = None) -> CascadeResult:
+        return CascadeResult(tier="azure", escalation_reason=reason, proposal=proposal, prefetched=prefetched)
+
+    async def route(self, question: str) -> CascadeResult:
+        if not self.enabled:
+            return self._escalate("disabled")
+
+        with tracer.span("cascade") as span:
+            result = await self._route(question)
+            span.set_attribute("tier", result.tier)
+            if result.escalation_reason:
+                span.set_attribute("escalation_reason", result.escalation_reason)
+            if result.proposal:
+                span.set_attribute("proposed_tool", result.proposal.tool)
+                span.set_attribute("confidence", result.proposal.confidence)
+            return result
+
+    async def _route(self, question: str) -> CascadeResult:
+        proposal = self.rule_router.propose(question)
+        if (proposal is None or proposal.confidence < self.confidence_threshold) and self.local_router and self.local_router.available:
+            local_proposal = await self.local_router.propose(question, self.tools)
+            if local_proposal is not None and (proposal is None or local_proposal.confidence > proposal.confidence):
+                proposal = local_proposal
+
+        if proposal is None:
+            return self._escalate("no_proposal")
+        if proposal.tool in NL2SQL_TOOLS:
+            return self._escalate("nl2sql", proposal)
+        if proposal.confidence < self.confidence_threshold:
+            return self._escalate("low_confidence", proposal)
+        if proposal.tool not in self.tools:
+            return self._escalate("unknown_tool", proposal)
+
+        try:
+            function = self.kernel.get_function(TOOL_PLUGINS[proposal.tool], proposal.tool)
+            result = await function.invoke(kernel=self.kernel, **proposal.arguments)
+            output = str(result.value if hasattr(result, "value") else result)
+        except Exception as e:
+            self.logger.error(f"Cascade tool call {proposal.tool} failed: {str(e)}")
+            return self._escalate("tool_error", proposal)
+
+        # The plugins report errors and empty results as plain strings
+        if not output or output.startswith(("Error", "Failed", "Query failed", "No ")):
+            return self._escalate("no_results", proposal)
+        if proposal.needs_synthesis:
+            return self._escalate("synthesis", proposal, prefetched=output)
+
+        if proposal.tool in DIRECT_ANSWER_TOOLS:
+            return CascadeResult(tier=proposal.source, answer=output, function_used=proposal.tool, proposal=proposal)
+
+        result_count = output.count("\n") + 1
+        if result_count > self.max_local_results or not (self.local_router and self.local_router.available):
+            return self._escalate("synthesis", proposal, prefetched=output)
+
+        answer = await self.local_router.answer(question, output)
+        if answer is None:
+            return self._escalate("local_answer_failed", proposal, prefetched=output)
+        return CascadeResult(tier="local", answer=answer, function_used=proposal.tool, proposal=proposal)
@@ -0,0 +1,173 @@
+# chatTracer.py
+import contextvars
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    def __init__(self, name: str, parent: Optional["Span"], attributes: Dict):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.root = parent.root if parent else self
+        self.attributes = dict(attributes)
+        self.start = time.time()
+        self._start_perf = time.perf_counter()
+        self.duration_ms: Optional[float] = None
+        self.status = "ok"
+        # Only the root keeps the finished spans of its trace
+        self.spans: List["Span"] = []
+
+    def set_attribute(self, key: str, value):
+        self.attributes[key] = value
+
+    def add(self, key: str, value: float):
+        """Accumulate a numeric attribute, e.g. RU or tokens over several calls"""
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+    def end(self):
+        self.duration_ms = (time.perf_counter() - self._start_perf) * 1000
+
+    def elapsed_ms(self) -> float:
+        """Time since the span started; usable before it ends"""
+        return (time.perf_counter() - self._start_perf) * 1000
+
+    def to_dict(self) -> Dict:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent.span_id if self.parent else None,
+            "name": self.name,
+            "start": self.start,
+            "offset_ms": (self.start - self.root.start) * 1000,
+            "duration_ms": self.duration_ms,
+            "status": self.status,
+            "attributes": self.attributes
+        }
+
+
+class ChatTracer:
+    """Nested latency spans for a chat turn.
+
+    Finished traces are appended to a JSON-lines file (one span per line)
+    and kept in an in-memory ring buffer for dashboards.
+    """
+
+    def __init__(self, path: Optional[str] = None, buffer_size: int = 200, logger: Optional[logging.Logger] = None):
+        self.path = path or os.getenv("CHAT_TRACE_PATH", "chat_traces.jsonl")
+        self.recent = deque(maxlen=buffer_size)
+        self.logger = logger or logging.getLogger(__name__)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def span(self, name: str, **attributes):
+        parent = _current_span.get()
+        span = Span(name, parent, attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except Exception as e:
+            span.status = "error"
+            span.set_attribute("error", str(e))
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+            span.root.spans.append(span)
+            if parent is None:
+                self._export(span)
+
+    def current_span(self) -> Optional[Span]:
+        return _current_span.get()
+
+    def _export(self, root: Span):
+        trace = [s.to_dict() for s in sorted(root.spans, key=lambda s: s.start)]
+        self.recent.append(trace)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                for span in trace:
+                    f.write(json.dumps(span, ensure_ascii=False, default=str) + "\n")
+        except Exception as e:
+            self.logger.error(f"Failed to export trace: {str(e)}")
+
+    def get_recent_traces(self, limit: int = 20, name: Optional[str] = None) -> List[List[Dict]]:
+        """Most recent finished traces, newest first, optionally by root span name"""
+        traces = [t for t in reversed(self.recent) if name is None or t[0]["name"] == name]
+        return traces[:limit]
+
+    def get_slowest_traces(self, limit: int = 10, name: str = "handle_query") -> List[List[Dict]]:
+        traces = [t for t in self.recent if t[0]["name"] == name]
+        return sorted(traces, key=lambda t: t[0]["duration_ms"] or 0, reverse=True)[:limit]
+
+
+def waterfall(trace: List[Dict]) -> List[Dict]:
+    """Flatten a trace into waterfall rows and mark the critical path.
+
+    Within each span the critical path is found backwards: the child that
+    finished last, then the child that finished last before it started, and
+    so on. Spans running in parallel with a critical span are not critical.
+    """
+    children: Dict[Optional[str], List[Dict]] = {}
+    for span in trace:
+        children.setdefault(span["parent_id"], []).append(span)
+
+    def end(span: Dict) -> float:
+        return span["offset_ms"] + (span["duration_ms"] or 0)
+
+    critical = set()
+
+    def mark(span: Dict):
+        critical.add(span["span_id"])
+        cutoff = end(span)
+        kids = children.get(span["span_id"], [])
+        while True:
+            before = [k for k in kids if end(k) <= cutoff + 0.001 and k["span_id"] not in critical]
+            if not before:
+                break
+            last = max(before, key=end)
+            mark(last)
+            cutoff = last["offset_ms"]
+
+    for root in children.get(None, []):
+        mark(root)
+
+    rows = []
+
+    def visit(span: Dict, depth: int):
+        rows.append({
+            "name": "  " * depth + span["name"],
+            "start_ms": round(span["offset_ms"], 1),
+            "duration_ms": round(span["duration_ms"] or 0, 1),
+            "critical": span["span_id"] in critical,
+            "attributes": span["attributes"]
+        })
+        for child in sorted(children.get(span["span_id"], []), key=lambda s: s["offset_ms"]):
+            visit(child, depth + 1)
+
+    for root in children.get(None, []):
+        visit(root, 0)
+    return rows
+
+
+def record_cosmos_response(span: Span, container, item_count: Optional[int] = None):
+    """Attach request charge and item count from the container's last response"""
+    try:
+        headers = container.client_connection.last_response_headers or {}
+        span.add("ru", float(headers.get("x-ms-request-charge", 0)))
+    except Exception:
+        pass
+    if item_count is not None:
+        span.set_attribute("item_count", item_count)
+
+
+tracer = ChatTracer()
@@ -0,0 +1,173 @@
+# kernelTracing.py
+import os
+from functools import lru_cache
+from typing import Dict, Optional
+
+import tiktoken
+from semantic_kernel import Kernel
+from semantic_kernel.connectors.ai.open_ai import AzureChatCompletion
+from semantic_kernel.contents import ChatHistory, FunctionCallContent, FunctionResultContent
+from semantic_kernel.filters import FilterTypes, FunctionInvocationContext
+
+from tracing.chatTracer import Span, tracer
+
+# USD per million Azure OpenAI tokens for the cost estimate stored with every chat log
+# (defaults: gpt-4o list prices); local model tokens are free
+INPUT_PRICE_PER_M = float(os.getenv("AZURE_OPENAI_INPUT_PRICE_PER_M", "2.50"))
+CACHED_INPUT_PRICE_PER_M = float(os.getenv("AZURE_OPENAI_CACHED_INPUT_PRICE_PER_M", "1.25"))
+OUTPUT_PRICE_PER_M = float(os.getenv("AZURE_OPENAI_OUTPUT_PRICE_PER_M", "10.00"))
+
+@lru_cache(maxsize=1)
+def _encoding():
+    # Same encoding as the history reducer; loaded on first use
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def tool_output_tokens(chat_history: ChatHistory) -> int:
+    """Estimated prompt tokens of the tool results sent with a request (the API
+    does not report them separately)"""
+    return sum(
+        len(_encoding().encode(str(item.result)))
+        for message in chat_history.messages
+        for item in message.items
+        if isinstance(item, FunctionResultContent)
+    )
+
+
+def cached_tokens(message, usage) -> int:
+    """Prompt tokens served from the prompt cache, if the response reports them"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    if details is None:
+        details = getattr(getattr(getattr(message, "inner_content", None), "usage", None), "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", 0) or 0
+
+
+def token_source(span: Span) -> str:
+    """Plugin function that made a model call (e.g. NL2SQLPlugin.generate_sql), else chat"""
+    parent = span.parent
+    while parent is not None:
+        # Prompts run through invoke_prompt are kernel functions without a plugin
+        if parent.name == "kernel_function" and parent.attributes.get("plugin"):
+            return parent.attributes["function"]
+        parent = parent.parent
+    return "chat"
+
+
+class TracedAzureChatCompletion(AzureChatCompletion):
+    """AzureChatCompletion that records one span per LLM round trip.
+
+    With auto function calling every tool-call round goes through
+    _inner_get_chat_message_contents, so each round gets its own span.
+    """
+
+    async def _inner_get_chat_message_contents(self, chat_history: ChatHistory, settings):
+        current = tracer.current_span()
+        round_index = 0
+        if current is not None:
+            current.root.add("llm_rounds", 1)
+            round_index = current.root.attributes["llm_rounds"]
+
+        with tracer.span("llm_round", round=round_index, messages=len(chat_history.messages)) as span:
+            results = await self._complete_round(chat_history, settings)
+            for message in results:
+                usage = message.metadata.get("usage")
+                if usage is not None:
+                    span.add("prompt_tokens", getattr(usage, "prompt_tokens", 0) or 0)
+                    span.add("completion_tokens", getattr(usage, "completion_tokens", 0) or 0)
+                    span.add("cached_tokens", cached_tokens(message, usage))
+                tool_calls = [item.name for item in message.items if isinstance(item, FunctionCallContent)]
+                if tool_calls:
+                    span.set_attribute("tool_calls", tool_calls)
+            span.set_attribute("tool_output_tokens", tool_output_tokens(chat_history))
+            span.set_attribute("source", token_source(span))
+            if span.root is not span:
+                totals = {
+                    "prompt_tokens": span.attributes.get("prompt_tokens", 0),
+                    "completion_tokens": span.attributes.get("completion_tokens", 0),
+                    "cached_tokens": span.attributes.get("cached_tokens", 0),
+                    "tool_output_tokens": span.attributes["tool_output_tokens"]
+                }
+                # Per-source usage of the turn, e.g. the main chat and the NL2SQL helper
+                source = span.root.attributes.setdefault("token_sources", {}).setdefault(span.attributes["source"], {"calls": 0})
+                source["calls"] += 1
+                for key, value in totals.items():
+                    span.root.add(key, value)
+                    source[key] = source.get(key, 0) + value
+            return results
+
+    async def _complete_round(self, chat_history: ChatHistory, settings):
+        """The actual model call; overridden by the load-test stub"""
+        return await super()._inner_get_chat_message_contents(chat_history, settings)
+
+
+def add_tracing_filters(kernel: Kernel):
+    """Trace every kernel function invocation, including auto-invoked tools"""
+
+    async def trace_function_invocation(context: FunctionInvocationContext, next):
+        with tracer.span(
+            "kernel_function",
+            function=f"{context.function.plugin_name}.{context.function.name}",
+            plugin=context.function.plugin_name,
+            arguments=[k for k in context.arguments.keys()] if context.arguments else []
+        ) as span:
+            await next(context)
+            if context.result is not None:
+                value = context.result.value
+                if isinstance(value, (list, tuple)):
+                    span.set_attribute("item_count", len(value))
+                elif isinstance(value, str):
+                    span.set_attribute("result_chars", len(value))
+
+    kernel.add_filter(FilterTypes.FUNCTION_INVOCATION, trace_function_invocation)
+
+
+def interaction_metrics(escalation_reason: Optional[str] = None) -> Dict:
+    """Latency and token counts of the current chat turn for the interaction log"""
+    current = tracer.current_span()
+    metrics = {"escalationReason": escalation_reason}
+    if current is not None:
+        root = current.root
+        metrics.update({
+            "latencyMs": round(root.elapsed_ms(), 1),
+            "promptTokens": root.attributes.get("prompt_tokens", 0),
+            "completionTokens": root.attributes.get("completion_tokens", 0),
+            "localPromptTokens": root.attributes.get("local_prompt_tokens", 0),
+            "localCompletionTokens": root.attributes.get("local_completion_tokens", 0),
+            "cachedTokens": root.attributes.get("cached_tokens", 0),
+            "toolOutputTokens": root.attributes.get("tool_output_tokens", 0),
+            "tokensBySource": [
+                {
+                    "source": source,
+                    "calls": usage["calls"],
+                    "promptTokens": usage.get("prompt_tokens", 0),
+                    "cachedTokens": usage.get("cached_tokens", 0),
+                    "completionTokens": usage.get("completion_tokens", 0),
+                    "toolOutputTokens": usage.get("tool_output_tokens", 0),
+                    "estimatedCostUsd": estimate_cost(usage.get("prompt_tokens", 0), usage.get("cached_tokens", 0),
+                                                      usage.get("completion_tokens", 0))
+                }
+                for source, usage in root.attributes.get("token_sources", {}).items()
+            ],
+            "toolLatencyMs": tool_latencies(root)
+        })
+        metrics["estimatedCostUsd"] = estimate_cost(metrics["promptTokens"], metrics["cachedTokens"],
+                                                    metrics["completionTokens"])
+    return metrics
+
+
+def estimate_cost(prompt_tokens: int, cached_tokens: int, completion_tokens: int) -> float:
+    """Azure OpenAI cost in USD at the configured prices; cached prompt tokens are discounted"""
+    uncached = max(prompt_tokens - cached_tokens, 0)
+    cost = uncached * INPUT_PRICE_PER_M + cached_tokens * CACHED_INPUT_PRICE_PER_M + completion_tokens * OUTPUT_PRICE_PER_M
+    return round(cost / 1_000_000, 6)
+
+
+def tool_latencies(root) -> Dict[str, float]:
+    """Time spent in each kernel function (tool) of a chat turn, summed over calls"""
+    latencies: Dict[str, float] = {}
+    for span in root.spans:
+        function = span.attributes.get("function")
+        if span.name != "kernel_function" or not function or function.startswith("ChatMemoryPlugin."):
+            continue
+        latencies[function] = round(latencies.get(function, 0) + (span.duration_ms or 0), 1)
+    return latencies
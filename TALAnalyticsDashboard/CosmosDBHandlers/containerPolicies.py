@@ -0,0 +1,137 @@
+# containerPolicies.py
+"""Partition keys and policies of the ChatHistory and GeneratedQueries containers.
+
+Cosmos DB fixes the partition key, the vector embedding policy and the
+vector index of a container when it is created. Changing them means
+provisioning a new container and copying the data over with
+containerMigration.py, then pointing CHAT_HISTORY_CONTAINER or
+GENERATED_QUERIES_CONTAINER at it.
+
+New containers are partitioned by a synthetic pk: the UTC day of the
+record plus a hash bucket of its session (of its id for SQL records),
+e.g. "2025-06-01-03". Writes spread over LOG_PARTITION_BUCKETS logical
+partitions per day instead of piling into the most used function or the
+"success" state, and queries over a few days can name their partitions.
+Containers created with the earlier keys (/functionUsed, /state) keep
+working; the handlers read the key path from the container.
+
+With LOG_RETENTION_DAYS set, raw log records carry a per-item ttl and
+expire after that many days; the daily rollups in StatsRollups keep their
+statistics (see retention.py).
+"""
+import os
+import zlib
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+load_dotenv()
+
+CHAT_HISTORY_CONTAINER = os.getenv("CHAT_HISTORY_CONTAINER", "ChatHistory")
+GENERATED_QUERIES_CONTAINER = os.getenv("GENERATED_QUERIES_CONTAINER", "GeneratedQueries")
+LOG_PARTITION_KEY = "/pk"
+CHAT_HISTORY_PARTITION_KEY = LOG_PARTITION_KEY
+GENERATED_QUERIES_PARTITION_KEY = LOG_PARTITION_KEY
+# Keys of containers created before the synthetic pk
+LEGACY_PARTITION_KEYS = {"chat": "/functionUsed", "sql": "/state"}
+LOG_PARTITION_BUCKETS = int(os.getenv("LOG_PARTITION_BUCKETS", "8"))
+# Days raw chat and SQL logs are kept, 0 keeps them forever
+LOG_RETENTION_DAYS = int(os.getenv("LOG_RETENTION_DAYS", "0"))
+# Days question embeddings stay on the raw chat logs, 0 keeps them as long as the log
+EMBEDDING_RETENTION_DAYS = int(os.getenv("EMBEDDING_RETENTION_DAYS", "0"))
+# Hourly rollups and per-minute latency histograms; daily and all-time rollups are kept
+HOURLY_ROLLUP_RETENTION_DAYS = int(os.getenv("HOURLY_ROLLUP_RETENTION_DAYS", "35"))
+MINUTE_ROLLUP_RETENTION_DAYS = int(os.getenv("MINUTE_ROLLUP_RETENTION_DAYS", "8"))
+# Containers are created with TTL enabled but no default expiry; only items with a ttl expire
+TTL_PER_ITEM = -1
+
+# quantizedFlat: compressed vectors scanned per partition, near exact up to ~50k vectors
+# diskANN: graph index, for histories well beyond that
+# none: VectorDistance computes the full distance for every document
+VECTOR_INDEX_TYPES = ("quantizedFlat", "diskANN", "none")
+CHAT_VECTOR_INDEX_TYPE = os.getenv("CHAT_VECTOR_INDEX_TYPE", "quantizedFlat")
+# Shorter vectors need a text-embedding-3 deployment; see embeddingCodec.py for the storage types
+EMBEDDING_DIMENSIONS = int(os.getenv("EMBEDDING_DIMENSIONS", "1536"))
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float32")
+
+# Served by the vector index; VectorDistance is a cosine similarity, higher is closer
+SIMILAR_QUESTIONS_QUERY = """
+SELECT TOP @limit c.id, c.question, c.answer, c.functionUsed, c.timestamp,
+       VectorDistance(c.embedding, @embedding) AS similarity
+FROM c
+ORDER BY VectorDistance(c.embedding, @embedding)
+"""
+
+
+def chat_history_policies(vector_index_type: str = CHAT_VECTOR_INDEX_TYPE,
+                          dimensions: int = EMBEDDING_DIMENSIONS,
+                          storage: str = EMBEDDING_STORAGE) -> Tuple[Dict, Optional[Dict]]:
+    """(indexing_policy, vector_embedding_policy) for a ChatHistory container"""
+    if vector_index_type not in VECTOR_INDEX_TYPES:
+        raise ValueError(f"Unknown vector index type {vector_index_type!r}, expected one of {VECTOR_INDEX_TYPES}")
+
+    indexing_policy = {
+        "indexingMode": "consistent",
+        "includedPaths": [{"path": "/*"}],  # Indexes all properties, including nested
+        "excludedPaths": [
+            {"path": '/"_etag"/?'},
+            # Vector paths stay out of the range index; the vector index covers them
+            {"path": "/embedding/*"},
+            {"path": "/embeddingBits/?"}
+        ]
+    }
+    if storage == "binary":
+        # Sign codes are searched client-side; there is no vector to index
+        return indexing_policy, None
+    if vector_index_type != "none":
+        indexing_policy["vectorIndexes"] = [{"path": "/embedding", "type": vector_index_type}]
+
+    vector_embedding_policy = {
+        "vectorEmbeddings": [
+            {
+                "path": "/embedding",
+                "dataType": "int8" if storage == "int8" else "float32",
+                "distanceFunction": "cosine",
+                "dimensions": dimensions,
+            }
+        ]
+    }
+    return indexing_policy, vector_embedding_policy
+
+
+def log_partition_key(timestamp: Optional[str], key: str, buckets: int = LOG_PARTITION_BUCKETS) -> str:
+    """'2025-06-01-03': the record's UTC day plus a stable hash bucket of key"""
+    bucket = zlib.crc32(str(key).encode("utf-8")) % buckets
+    return f"{(timestamp or '')[:10] or 'undated'}-{bucket:02d}"
+
+
+def with_partition_key(doc: Dict, kind: str = "chat") -> Dict:
+    """Add the synthetic pk to a log record that has none"""
+    if not doc.get("pk"):
+        key = doc.get("sessionId") if kind == "chat" else None
+        doc["pk"] = log_partition_key(doc.get("timestamp"), key or doc["id"])
+    return doc
+
+
+def with_retention(doc: Dict, days: int = LOG_RETENTION_DAYS) -> Dict:
+    """Give a record a ttl of that many days, counted from its last write"""
+    if days > 0:
+        doc["ttl"] = days * 86400
+    return doc
+
+
+def day_partition_keys(days: int, buckets: int = LOG_PARTITION_BUCKETS, now: Optional[datetime] = None) -> List[str]:
+    """Every pk of the last days (today included), for queries over a time window"""
+    now = now or datetime.now(timezone.utc)
+    return [
+        f"{(now - timedelta(days=offset)).strftime('%Y-%m-%d')}-{bucket:02d}"
+        for offset in range(days) for bucket in range(buckets)
+    ]
+
+
+def partition_key_path(container, default: str) -> str:
+    """Partition key path the container was created with"""
+    try:
+        return container.read()["partitionKey"]["paths"][0]
+    except Exception:
+        return default
@@ -1,18 +1,39 @@
 
 # cosmosConnector.py
+import asyncio
 from azure.cosmos import exceptions
 from datetime import datetime, timedelta, timezone
 import uuid
-from langchain_openai import AzureOpenAIEmbeddings
 import os
 from azure.cosmos import CosmosClient, PartitionKey
-from typing import List, Optional, Dict
+from typing import List, Optional, Dict, Tuple
 import logging
 import os
 from dotenv import load_dotenv
+from CosmosDBHandlers.hyperLogLog import HyperLogLog
+from CosmosDBHandlers.latencyHistogram import LatencyHistogram, DEFAULT_ACCURACY
+from CosmosDBHandlers.containerPolicies import (
+    CHAT_HISTORY_CONTAINER, CHAT_HISTORY_PARTITION_KEY, GENERATED_QUERIES_CONTAINER, GENERATED_QUERIES_PARTITION_KEY,
+    LEGACY_PARTITION_KEYS, TTL_PER_ITEM, chat_history_policies, day_partition_keys, partition_key_path
+)
 load_dotenv()
 # Initialize Cosmos DB containers
 
+FAQ_CLUSTER_SET = "faq"
+# Category counted per time bucket on the timelines
+TIMELINE_DIMENSIONS = {"chat": "functionUsed", "sql": "state"}
+# Token counts and cost summed per function on the cost views
+TOKEN_METRICS = ("promptTokens", "cachedTokens", "completionTokens", "toolOutputTokens",
+                 "localPromptTokens", "localCompletionTokens", "estimatedCostUsd")
+SOURCE_TOKEN_METRICS = ("promptTokens", "cachedTokens", "completionTokens", "toolOutputTokens", "estimatedCostUsd")
+# Failed SQL generations; in containers partitioned by /state, each is one partition
+FAILED_SQL_STATES = ("error", "null")
+ROLLUP_INDEXING_POLICY = {
+    "indexingMode": "consistent",
+    "includedPaths": [{"path": "/granularity/?"}, {"path": "/bucket/?"}],
+    "excludedPaths": [{"path": "/*"}]
+}
+
 class ChatMemoryHandlerForAnalytics():
     def __init__(self, logger: Optional[logging.Logger] = None):
         self.cosmos_client = CosmosClient(
@@ -20,223 +41,264 @@ class ChatMemoryHandlerForAnalytics():
             os.getenv("AZURE_COSMOS_DB_KEY")
         )
         self.logger = logger
-        self.indexing_policy = {
-            "indexingMode": "consistent",
-            "includedPaths": [{"path": "/*"}],  # Indexes all properties, including nested
-            "excludedPaths": [
-                {
-                    "path": '/"_etag"/?'
-                },
-                {
-                    "path": "/embedding/*"
-                }
-                ],
-        }
-
-
-        self.vector_embedding_policy = {
-            "vectorEmbeddings": [
-                {
-                    "path": "/embedding",
-                    "dataType": "float32",
-                    "distanceFunction": "cosine",
-                    "dimensions": 1536,
-                }
-            ]
-        }
-
-        self.embedding_model = AzureOpenAIEmbeddings(
-            azure_endpoint=os.environ["OPENAI_API_ENDPOINT"],
-            azure_deployment=os.environ["OPENAI_EMBEDDINGS_MODEL_DEPLOYMENT"],
-            api_key=os.environ["AZURE_OPENAI_KEY"]
-        )
+        # The vector index can't be changed on an existing container, see containerPolicies.py
+        self.indexing_policy, self.vector_embedding_policy = chat_history_policies()
 
         self.database = self.cosmos_client.create_database_if_not_exists("TAL_ChatData")
 
         # Container for chat history
         self.chat_container = self.database.create_container_if_not_exists(
-            id="ChatHistory",
-            partition_key=PartitionKey(path="/functionUsed"),
+            id=CHAT_HISTORY_CONTAINER,
+            partition_key=PartitionKey(path=CHAT_HISTORY_PARTITION_KEY),
             indexing_policy=self.indexing_policy,
-            vector_embedding_policy=self.vector_embedding_policy
+            vector_embedding_policy=self.vector_embedding_policy,
+            default_ttl=TTL_PER_ITEM
         )
 
         # Container for SQL queries
         self.sql_container = self.database.create_container_if_not_exists(
-            id="GeneratedQueries", 
-            partition_key=PartitionKey(path="/state")
+            id=GENERATED_QUERIES_CONTAINER,
+            partition_key=PartitionKey(path=GENERATED_QUERIES_PARTITION_KEY),
+            default_ttl=TTL_PER_ITEM
+        )
+        # Containers created before the synthetic pk keep their key, see containerPolicies.py
+        self.chat_partition_path = partition_key_path(self.chat_container, CHAT_HISTORY_PARTITION_KEY)
+        self.sql_partition_path = partition_key_path(self.sql_container, GENERATED_QUERIES_PARTITION_KEY)
+
+        # Materialized FAQ clusters written by faqClustering.py, one partition
+        self.faq_container = self.database.create_container_if_not_exists(
+            id="FAQClusters",
+            partition_key=PartitionKey(path="/clusterSet"),
+            indexing_policy={
+                "indexingMode": "consistent",
+                "includedPaths": [{"path": "/*"}],
+                "excludedPaths": [{"path": '/"_etag"/?'}, {"path": "/centroid/*"}]
+            }
+        )
+
+        # Counters maintained by the chatbot log worker (statsRollups.py)
+        self.rollup_container = self.database.create_container_if_not_exists(
+            id="StatsRollups",
+            partition_key=PartitionKey(path="/kind"),
+            indexing_policy=ROLLUP_INDEXING_POLICY,
+            default_ttl=TTL_PER_ITEM
         )
         
-    async def _generate_embedding(self, query: str) -> List[float]:
-        """Generate embedding for the given query using Azure OpenAI"""
-        try:
-            return self.embedding_model.embed_query(query)
-        except Exception as e:
-            self.logger.error(f"Embedding generation failed: {str(e)}")
-            raise
+    async def run_query(self, container, query: str, **kwargs) -> List:
+        """Run a Cosmos DB query in a worker thread so concurrent fetches overlap"""
+        return await asyncio.to_thread(lambda: list(container.query_items(query=query, **kwargs)))
+
+    def _state_scope(self, state: str) -> Dict:
+        """Query options for one SQL state: a single partition under the legacy /state key,
+        otherwise a cross-partition query filtered on c.state"""
+        if self.sql_partition_path == LEGACY_PARTITION_KEYS["sql"]:
+            return {"partition_key": state}
+        return {"enable_cross_partition_query": True}
+
+    def _day_partition_filter(self, days: int) -> Tuple[str, List[Dict]]:
+        """Condition and parameters limiting a chat query to the partitions of the last days,
+        so Cosmos DB only visits those; empty for containers with a legacy key"""
+        if self.chat_partition_path != CHAT_HISTORY_PARTITION_KEY:
+            return "", []
+        # One extra day covers records just past midnight in the window's first day
+        keys = day_partition_keys(days + 1)
+        names = [f"@pk{i}" for i in range(len(keys))]
+        return f" AND c.pk IN ({', '.join(names)})", [{"name": n, "value": k} for n, k in zip(names, keys)]
 
     async def get_semantic_faqs(self, limit: int = 5, threshold: float = 0.1) -> List[Dict]:
-        """Retrieve FAQs using vector embeddings for semantic similarity"""
-        try:            
+        """Read the largest precomputed FAQ clusters (see faqClustering.py) in one query"""
+        try:
             query = """
-            SELECT c.question FROM c
+            SELECT TOP @limit c.representative_question, c.similar_questions, c.total_occurrences, c.similarity_scores, c.member_count
+            FROM c
+            WHERE c.clusterSet = @set
+            ORDER BY c.total_occurrences DESC
             """
-            raw_results = list(self.chat_container.query_items(
+            clusters = await self.run_query(
+                self.faq_container,
                 query=query,
-                enable_cross_partition_query=True,
-                max_item_count=-1
-            ))
+                parameters=[{"name": "@limit", "value": limit}, {"name": "@set", "value": FAQ_CLUSTER_SET}],
+                partition_key=FAQ_CLUSTER_SET
+            )
 
-            # Group by question in Python
-            from collections import Counter
-            question_counts = Counter(item['question'] for item in raw_results)
-            top_questions = question_counts.most_common(limit)
-
-            # Generate embeddings for top questions
-            faq_embeddings = {}
-            for question_text, count in top_questions:
-                embedding = await self._generate_embedding(question_text)
-                faq_embeddings[question_text] = {
-                    'embedding': embedding,
-                    'count': count
-                }
-
-            # Cluster similar questions
-            clustered_faqs = []
-            processed = set()
-            
-            for text, data in faq_embeddings.items():
-                if text in processed:
-                    continue
+            for cluster in clusters:
+                scores = cluster.get("similarity_scores") or {}
+                cluster["similar_questions"] = [q for q in cluster.get("similar_questions", []) if scores.get(q, 1.0) >= threshold]
+            return clusters
 
-                query = """
-                SELECT TOP 50 c.question, VectorDistance(c.embedding, @embedding) as distance
-                FROM c
-                ORDER BY VectorDistance(c.embedding, @embedding)
-                """
-                parameters = [{"name": "@embedding", "value": data['embedding']}]
-                    
-                similar_results = list(self.chat_container.query_items(
-                    query=query,
-                    parameters=parameters,
-                    enable_cross_partition_query=True
-                ))
-                
-                similarity_threshold = threshold  
-                filtered_results = []
-                for item in similar_results:
-                    similarity = 1 - item['distance']  # Convert distance to similarity
-                    if similarity <= similarity_threshold:
-                        filtered_results.append(item['question'])
-
-                # Count occurrences of similar questions
-                similar_question_counts = Counter(filtered_results)
-                cluster_count = sum(similar_question_counts.values())
-                
-                clustered_faqs.append({
-                    "representative_question": text,
-                    "similar_questions": list(similar_question_counts.keys()),
-                    "total_occurrences": cluster_count,
-                    "similarity_scores": {q: 1 - item['distance'] for item in similar_results for q in [item['question']] if 1 - item['distance'] >= similarity_threshold}
-                })
-                
-                # Mark all similar questions as processed
-                processed.update(filtered_results)
-                clustered_faqs.append({
-                    "representative_question": text,
-                    "similar_questions": [text],
-                    "total_occurrences": data['count'],
-                    "similarity_scores": {text: 1.0}
-                })
-                processed.add(text)
-
-            return sorted(clustered_faqs[:limit], key=lambda x: x['total_occurrences'], reverse=True)
-            
         except exceptions.CosmosHttpResponseError as ex:
-            print(f"Cosmos DB error: {ex}")
-            self.logger.error(f"Semantic FAQ retrieval failed: {str(e)}")
+            if self.logger:
+                self.logger.error(f"Semantic FAQ retrieval failed: {str(ex)}")
             return []
         except Exception as e:
             if self.logger:
                 self.logger.error(f"Semantic FAQ retrieval failed: {str(e)}")
             return []
 
+    async def get_rollup(self, kind: str) -> Optional[Dict]:
+        """Point-read the all-time rollup document for "chat" or "sql" records"""
+        try:
+            return await asyncio.to_thread(self.rollup_container.read_item, item=kind, partition_key=kind)
+        except exceptions.CosmosResourceNotFoundError:
+            self.logger.warning(
+                f"No {kind} rollup yet; run 'python -m CosmosDBHandlers.statsRollups --rebuild' "
+                "from SemanticKernelChatbot to backfill existing records"
+            )
+            return None
+
+    @staticmethod
+    def count_sessions(rollup: Dict) -> int:
+        """Approximate distinct sessions from a rollup's HyperLogLog sketch"""
+        return HyperLogLog.from_base64(rollup.get("sessions"), rollup.get("hllPrecision", 12)).count()
+
     async def get_sql_query_statistics(self):
-        """Get comprehensive SQL query statistics - CORRECTED"""
+        """Get SQL query statistics from the materialized rollup"""
         try:
-            # Get total queries
-            total_query = "SELECT VALUE COUNT(1) FROM c"
-            total_queries = list(self.sql_container.query_items(
-                query=total_query,
-                enable_cross_partition_query=True
-            ))[0]
-            
-            # Get queries by state
-            state_query = "SELECT c.state FROM c"
-            state_results = list(self.sql_container.query_items(
-                query=state_query,
-                enable_cross_partition_query=True
-            ))
-            
-            from collections import Counter
-            state_counts = Counter(item['state'] for item in state_results)
-            
-            # Get top original questions
-            question_query = "SELECT c.originalQuestion FROM c"
-            question_results = list(self.sql_container.query_items(
-                query=question_query,
-                enable_cross_partition_query=True
-            ))
-            
-            question_counts = Counter(item['originalQuestion'] for item in question_results)
-            top_questions = [
-                {'question': q, 'count': c} 
-                for q, c in question_counts.most_common(10)
-            ]
-            
+            rollup = await self.get_rollup("sql") or {}
+            total_queries = rollup.get("total", 0)
+            state_counts = rollup.get("counts", {}).get("state", {})
+
             return {
                 'total_queries': total_queries,
                 'success_count': state_counts.get('success', 0),
                 'error_count': state_counts.get('error', 0),
-                'null_count': state_counts.get('null', 0),  # Changed from 'failed_count'
-                'top_questions': top_questions,
+                'null_count': state_counts.get('null', 0),
+                'top_questions': rollup.get("questions", [])[:10],
+                'hot_shapes': rollup.get("shapes", [])[:10],
                 'success_rate': (state_counts.get('success', 0) / total_queries * 100) if total_queries > 0 else 0
             }
         except Exception as e:
             print(f"Error getting SQL statistics: {e}")
-            return {'total_queries': 0, 'success_count': 0, 'error_count': 0, 'null_count': 0, 'top_questions': [], 'success_rate': 0}
+            return {'total_queries': 0, 'success_count': 0, 'error_count': 0, 'null_count': 0, 'top_questions': [],
+                    'hot_shapes': [], 'success_rate': 0}
+
 
+    async def get_timeline(self, kind: str, days: int = 7) -> List[Dict]:
+        """Record counts per period and function (chat) or state (sql).
+
+        Multi-day windows read the daily rollups; the last 24 hours are
+        grouped into the 15-minute buckets stored at log time by Cosmos DB.
+        Either way one row per bucket and category is transferred.
+        """
+        dimension = TIMELINE_DIMENSIONS[kind]
+        now = datetime.now(timezone.utc)
+        if days > 1:
+            rollups = await self.run_query(
+                self.rollup_container,
+                query="SELECT c.bucket, c.counts FROM c WHERE c.granularity = 'day' AND c.bucket >= @since",
+                parameters=[{"name": "@since", "value": (now - timedelta(days=days)).strftime('%Y-%m-%d')}],
+                partition_key=kind
+            )
+            return [
+                {
+                    'period': datetime.strptime(r['bucket'], '%Y-%m-%d').replace(tzinfo=timezone.utc),
+                    'category': category,
+                    'count': count
+                }
+                for r in rollups
+                for category, count in r.get('counts', {}).get(dimension, {}).items()
+            ]
+
+        container = self.chat_container if kind == "chat" else self.sql_container
+        rows = await self.run_query(
+            container,
+            query=f"""
+            SELECT c.bucket, c.{dimension} AS category, COUNT(1) AS count
+            FROM c
+            WHERE c.epoch >= @since
+            GROUP BY c.bucket, c.{dimension}
+            """,
+            parameters=[{"name": "@since", "value": int(now.timestamp()) - 86400}],
+            enable_cross_partition_query=True
+        )
+        return [
+            {
+                'period': datetime.fromtimestamp(r['bucket'], tz=timezone.utc),
+                'category': r.get('category'),
+                'count': r['count']
+            }
+            for r in rows
+        ]
+
+    async def get_latency_histograms(self, granularity: str, since: str) -> Dict[Tuple, LatencyHistogram]:
+        """Latency histograms of the minute/hour/day rollups from the given bucket on,
+        keyed by (bucket, scope, name, tier); scope is "functions" or "tools"."""
+        docs = await self.run_query(
+            self.rollup_container,
+            query="SELECT c.bucket, c.functions, c.tools, c.accuracy FROM c WHERE c.granularity = @granularity AND c.bucket >= @since",
+            parameters=[{"name": "@granularity", "value": granularity}, {"name": "@since", "value": since}],
+            partition_key="latency"
+        )
+        histograms = {}
+        for doc in docs:
+            accuracy = doc.get("accuracy", DEFAULT_ACCURACY)
+            for scope in ("functions", "tools"):
+                for name, tiers in (doc.get(scope) or {}).items():
+                    for tier, data in tiers.items():
+                        histograms[(doc["bucket"], scope, name, tier)] = LatencyHistogram.from_dict(data, accuracy)
+        return histograms
+
+    async def get_token_usage(self, days: int = 7) -> Dict[str, List[Dict]]:
+        """Token and estimated cost sums per day and function, and per prompt source,
+        aggregated by Cosmos DB so only one row per group is transferred"""
+        since = int(datetime.now(timezone.utc).timestamp()) - days * 86400
+        sums = ", ".join(f"SUM(c.{metric}) AS {metric}" for metric in TOKEN_METRICS)
+        pk_filter, pk_parameters = self._day_partition_filter(days)
+        source_sums = ", ".join(f"SUM(s.{metric}) AS {metric}" for metric in SOURCE_TOKEN_METRICS)
+        by_function, by_source = await asyncio.gather(
+            self.run_query(
+                self.chat_container,
+                query=f"""
+                SELECT LEFT(c.timestamp, 10) AS day, c.functionUsed, COUNT(1) AS requests, {sums}
+                FROM c
+                WHERE c.epoch >= @since{pk_filter}
+                GROUP BY LEFT(c.timestamp, 10), c.functionUsed
+                """,
+                parameters=[{"name": "@since", "value": since}] + pk_parameters,
+                enable_cross_partition_query=True
+            ),
+            self.run_query(
+                self.chat_container,
+                query=f"""
+                SELECT s.source, SUM(s.calls) AS calls, {source_sums}
+                FROM c
+                JOIN s IN c.tokensBySource
+                WHERE c.epoch >= @since{pk_filter}
+                GROUP BY s.source
+                """,
+                parameters=[{"name": "@since", "value": since}] + pk_parameters,
+                enable_cross_partition_query=True
+            )
+        )
+        return {"by_function": by_function, "by_source": by_source}
+
+    async def get_token_usage_rollups(self, days: int = 7) -> Dict[str, List[Dict]]:
+        """Token and cost sums per day and function, and per prompt source, from the daily
+        chat rollups; they outlive the raw records (see retention.py)"""
+        since = (datetime.now(timezone.utc) - timedelta(days=days)).strftime('%Y-%m-%d')
+        rollups = await self.run_query(
+            self.rollup_container,
+            query="SELECT c.bucket, c.counts, c.tokens, c.sources FROM c WHERE c.granularity = 'day' AND c.bucket >= @since",
+            parameters=[{"name": "@since", "value": since}],
+            partition_key="chat"
+        )
+        by_function, by_source = [], {}
+        for rollup in rollups:
+            requests = rollup.get('counts', {}).get('functionUsed', {})
+            tokens = rollup.get('tokens') or {}
+            for function in set(requests) | set(tokens):
+                by_function.append({'day': rollup['bucket'], 'functionUsed': function,
+                                    'requests': requests.get(function, 0), **tokens.get(function, {})})
+            for source, sums in (rollup.get('sources') or {}).items():
+                row = by_source.setdefault(source, {'source': source})
+                for metric, value in sums.items():
+                    row[metric] = row.get(metric, 0) + value
+        return {"by_function": by_function, "by_source": list(by_source.values())}
 
     async def get_sql_query_timeline(self, days=7):
-        """Get SQL query generation timeline"""
+        """Get SQL query generation counts per period and state"""
         try:
-            start_date = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
-            
-            query = f"""
-            SELECT c.timestamp, c.state, c.originalQuestion
-            FROM c 
-            WHERE c.timestamp >= '{start_date}'
-            ORDER BY c.timestamp
-            """
-            
-            results = list(self.sql_container.query_items(
-                query=query,
-                enable_cross_partition_query=True
-            ))
-            
-            timeline_data = []
-            for item in results:
-                date = datetime.fromisoformat(item['timestamp'].replace('Z', '+00:00'))
-                timeline_data.append({
-                    'date': date.strftime('%Y-%m-%d'),
-                    'hour': date.hour,
-                    'minute': date.minute,
-                    'datetime': date,
-                    'state': item['state'],
-                    'question': item['originalQuestion']
-                })
-            
-            return timeline_data
+            return await self.get_timeline("sql", days)
         except Exception as e:
             self.logger.error(f"Error getting SQL timeline: {e}")
             return []
@@ -250,40 +312,96 @@ class ChatMemoryHandlerForAnalytics():
             ORDER BY c.timestamp DESC
             """
             
-            results = list(self.sql_container.query_items(
+            results = await self.run_query(
+                self.sql_container,
                 query=query,
                 enable_cross_partition_query=True
-            ))
+            )
             
             return results
         except Exception as e:
             self.logger.error(f"Error getting recent SQL queries: {e}")
             return []
 
-    async def get_sql_error_analysis(self):
-        """Analyze failed SQL query patterns - CORRECTED"""
+    async def get_sql_error_analysis(self, limit=10):
+        """Latest failed SQL generations: TOP @limit of each failed state"""
         try:
             query = """
-            SELECT c.originalQuestion, c.generatedSql, c.state, c.timestamp
+            SELECT TOP @limit c.originalQuestion, c.generatedSql, c.state, c.timestamp
             FROM c
-            WHERE c.state != 'success'
+            WHERE c.state = @state
             ORDER BY c.timestamp DESC
             """
-            
-            results = list(self.sql_container.query_items(
-                query=query,
-                enable_cross_partition_query=True
+            partitions = await asyncio.gather(*(
+                self.run_query(
+                    self.sql_container,
+                    query=query,
+                    parameters=[{"name": "@limit", "value": limit}, {"name": "@state", "value": state}],
+                    **self._state_scope(state)
+                )
+                for state in FAILED_SQL_STATES
             ))
-            
-            return results
+            results = [row for rows in partitions for row in rows]
+            return sorted(results, key=lambda r: r['timestamp'], reverse=True)[:limit]
         except Exception as e:
             print(f"Error getting SQL error analysis: {e}")
             return []
 
+    async def get_sql_failure_classes(self, limit=10, examples=3):
+        """Failed SQL grouped by error class and query shape, largest first.
 
+        Cosmos DB counts each class per failed state, then
+        the latest examples of the top classes are read with TOP, so only
+        the grouped counts and a few records are transferred.
+        """
+        try:
+            query = """
+            SELECT c.errorClass, c.fingerprint, MAX(c.shape) AS shape, COUNT(1) AS count
+            FROM c
+            WHERE c.state = @state
+            GROUP BY c.errorClass, c.fingerprint
+            """
+            partitions = await asyncio.gather(*(
+                self.run_query(self.sql_container, query=query, parameters=[{"name": "@state", "value": state}],
+                               **self._state_scope(state))
+                for state in FAILED_SQL_STATES
+            ))
+            classes = [
+                {**row, 'state': state}
+                for state, rows in zip(FAILED_SQL_STATES, partitions)
+                for row in rows
+            ]
+            classes = sorted(classes, key=lambda c: c['count'], reverse=True)[:limit]
+            samples = await asyncio.gather(*(self._failure_examples(c, examples) for c in classes))
+            for failure_class, rows in zip(classes, samples):
+                failure_class['examples'] = rows
+            return classes
+        except Exception as e:
+            self.logger.error(f"Error getting SQL failure classes: {e}")
+            return []
 
+    async def _failure_examples(self, failure_class: Dict, limit: int) -> List[Dict]:
+        # Records logged before fingerprinting have neither field
+        conditions = ["c.state = @state"]
+        parameters = [{"name": "@limit", "value": limit}, {"name": "@state", "value": failure_class['state']}]
+        for field in ("errorClass", "fingerprint"):
+            if failure_class.get(field) is None:
+                conditions.append(f"NOT IS_DEFINED(c.{field})")
+            else:
+                conditions.append(f"c.{field} = @{field}")
+                parameters.append({"name": f"@{field}", "value": failure_class[field]})
+        return await self.run_query(
+            self.sql_container,
+            query=f"""
+            SELECT TOP @limit c.originalQuestion, c.generatedSql, c.error, c.timestamp
+            FROM c
+            WHERE {' AND '.join(conditions)}
+            ORDER BY c.timestamp DESC
+            """,
+            parameters=parameters,
+            **self._state_scope(failure_class['state'])
+        )
 
-import asyncio
 
 async def main():
     handler = ChatMemoryHandlerForAnalytics()
@@ -0,0 +1,89 @@
+# liveAnalytics.py
+import logging
+import threading
+from typing import Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from CosmosDBHandlers.parquetSnapshot import AnalyticsSnapshot, SnapshotAggregates
+
+
+class RecentItems:
+    """Ring buffer of the newest records by timestamp; updated records replace their old copy"""
+
+    def __init__(self, maxlen: int = 50):
+        self.maxlen = maxlen
+        self._rows: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def add(self, rows: Iterable[Dict]):
+        with self._lock:
+            for row in rows:
+                self._rows[row["id"]] = row
+            if len(self._rows) > self.maxlen:
+                newest = sorted(self._rows.values(), key=lambda r: r["timestamp"], reverse=True)[:self.maxlen]
+                self._rows = {row["id"]: row for row in newest}
+
+    def items(self, limit: Optional[int] = None) -> List[Dict]:
+        with self._lock:
+            rows = sorted(self._rows.values(), key=lambda r: r["timestamp"], reverse=True)
+        return rows[:limit] if limit is not None else rows
+
+
+class LiveAnalytics:
+    """In-memory dashboard state kept current by the change-feed sync.
+
+    The sync thread pushes every changed record into ring buffers of the
+    newest chats, SQL generations and failed SQL, then refreshes the
+    snapshot days and per-day counters it touched and bumps `version`.
+    Open dashboard tabs poll `version` and re-render from memory only when
+    it moved, so they add no load on Cosmos DB however many there are;
+    widgets that need Cosmos DB keep their last rendering on these ticks.
+    """
+
+    def __init__(self, snapshot: AnalyticsSnapshot, aggregates: Dict[str, SnapshotAggregates],
+                 buffer_size: int = 50, logger: Optional[logging.Logger] = None):
+        self.snapshot = snapshot
+        self.aggregates = aggregates
+        self.logger = logger or logging.getLogger(__name__)
+        self.recent = {
+            "chat": RecentItems(buffer_size),
+            "sql": RecentItems(buffer_size),
+            "sql_failed": RecentItems(buffer_size)
+        }
+        self.version = 0
+        self.running = False
+        self._seeded = False
+
+    def on_records(self, kind: str, records: pd.DataFrame):
+        """Sync listener: records of one kind just written to the snapshot"""
+        rows = records.to_dict("records")
+        self.recent[kind].add(rows)
+        if kind == "sql":
+            self.recent["sql_failed"].add(row for row in rows if row.get("state") != "success")
+
+    def on_sync(self, changed: Dict[str, int]):
+        """Called by the sync thread after every pass over the change feed"""
+        self.running = True
+        if self._seeded and not any(changed.values()):
+            return
+        try:
+            for kind, aggregates in self.aggregates.items():
+                if self.snapshot.refresh(kind) is not None:
+                    aggregates.get()
+            if not self._seeded:
+                # Records synced before this process started never passed through on_records
+                self._seed()
+            self.version += 1
+        except Exception as e:
+            self.logger.error(f"Failed to update live analytics: {str(e)}")
+
+    def _seed(self):
+        for kind, select in (("chat", None), ("sql", None), ("sql_failed", lambda df: df[df["state"] != "success"])):
+            source = "sql" if kind == "sql_failed" else kind
+            latest = self.snapshot.latest(source, self.recent[kind].maxlen, select)
+            self.recent[kind].add(latest.to_dict("records"))
+        self._seeded = True
+
+    def recent_frame(self, kind: str, limit: int, columns: List[str]) -> pd.DataFrame:
+        return pd.DataFrame(self.recent[kind].items(limit), columns=columns)
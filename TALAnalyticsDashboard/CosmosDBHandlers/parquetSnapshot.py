@@ -0,0 +1,432 @@
+# parquetSnapshot.py
+"""Local columnar copy of ChatHistory and GeneratedQueries for the dashboard.
+
+ParquetSnapshotSync follows each container's change feed and merges new
+and updated records into one Parquet file per day:
+
+    analytics_snapshot/chat/day=2026-10-19/data.parquet
+    analytics_snapshot/sql/day=2026-10-19/data.parquet
+
+Only the days that received changes are rewritten, records are
+deduplicated by id (a replayed upsert just replaces the row) and the
+change-feed continuation tokens are saved after the files, so an
+interrupted sync resumes without losing or doubling rows. The change feed
+does not report expired records, so with LOG_RETENTION_DAYS set the sync
+drops day files older than that itself.
+AnalyticsSnapshot loads the files with pyarrow, re-reading only the days
+that changed, so dashboard refreshes run on local data and cost no
+request units.
+
+The dashboard syncs in the background; to run the sync as its own
+process instead (and set ANALYTICS_SYNC_SECONDS=0 for the dashboard):
+
+    python -m CosmosDBHandlers.parquetSnapshot --interval 60
+"""
+import argparse
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import Counter, defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from CosmosDBHandlers.containerPolicies import LOG_RETENTION_DAYS
+from CosmosDBHandlers.sqlFingerprint import error_class, fingerprint_sql
+
+SNAPSHOT_SCHEMAS = {
+    "chat": pa.schema([
+        ("id", pa.string()),
+        ("sessionId", pa.string()),
+        ("question", pa.string()),
+        ("functionUsed", pa.string()),
+        ("answer", pa.string()),
+        ("tier", pa.string()),
+        ("escalationReason", pa.string()),
+        ("latencyMs", pa.float64()),
+        ("promptTokens", pa.float64()),
+        ("completionTokens", pa.float64()),
+        ("localPromptTokens", pa.float64()),
+        ("localCompletionTokens", pa.float64()),
+        ("cachedTokens", pa.float64()),
+        ("toolOutputTokens", pa.float64()),
+        ("estimatedCostUsd", pa.float64()),
+        # JSON list of token usage per prompt source (main chat, NL2SQL helper)
+        ("tokensBySource", pa.string()),
+        # JSON object of milliseconds per kernel function
+        ("toolLatencyMs", pa.string()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+    ]),
+    "sql": pa.schema([
+        ("id", pa.string()),
+        ("originalQuestion", pa.string()),
+        ("generatedSql", pa.string()),
+        ("state", pa.string()),
+        ("fingerprint", pa.string()),
+        ("shape", pa.string()),
+        ("errorClass", pa.string()),
+        ("error", pa.string()),
+        ("timestamp", pa.timestamp("us", tz="UTC")),
+    ]),
+}
+
+
+# Nested objects stored as JSON strings
+JSON_COLUMNS = {"chat": ("tokensBySource", "toolLatencyMs")}
+
+
+def _fill_fingerprints(df: pd.DataFrame) -> pd.DataFrame:
+    """Fingerprint SQL records logged before the chatbot stored fingerprints"""
+    missing = df["fingerprint"].isna() & df["generatedSql"].notna()
+    if missing.any():
+        prints = df.loc[missing, "generatedSql"].map(fingerprint_sql)
+        df.loc[missing, "fingerprint"] = prints.map(lambda p: p["fingerprint"])
+        df.loc[missing, "shape"] = prints.map(lambda p: p["shape"])
+    unclassified = df["errorClass"].isna() & (df["state"] != "success")
+    if unclassified.any():
+        df.loc[unclassified, "errorClass"] = df.loc[unclassified, "state"].map(error_class)
+    return df
+
+
+def _to_frame(kind: str, records: List[Dict]) -> pd.DataFrame:
+    """Cosmos documents to a frame with exactly the snapshot columns"""
+    schema = SNAPSHOT_SCHEMAS[kind]
+    df = pd.DataFrame.from_records(records).reindex(columns=schema.names)
+    for name in JSON_COLUMNS.get(kind, ()):
+        df[name] = df[name].map(lambda v: json.dumps(v) if isinstance(v, (dict, list)) else None)
+    df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True, errors="coerce", format="ISO8601")
+    for field in schema:
+        if pa.types.is_floating(field.type):
+            df[field.name] = pd.to_numeric(df[field.name], errors="coerce")
+        elif pa.types.is_string(field.type):
+            df[field.name] = df[field.name].astype(object).where(df[field.name].notna(), None)
+    return _fill_fingerprints(df) if kind == "sql" else df
+
+
+class ParquetSnapshotSync:
+    """Mirrors ChatHistory and GeneratedQueries into day-partitioned Parquet"""
+
+    def __init__(self, handler, root: Optional[str] = None, logger: Optional[logging.Logger] = None,
+                 flush_rows: int = 50000):
+        self.handler = handler
+        self.root = root or os.getenv("ANALYTICS_SNAPSHOT_DIR", "analytics_snapshot")
+        self.logger = logger or logging.getLogger(__name__)
+        self.flush_rows = flush_rows
+        self.state_path = os.path.join(self.root, "_state.json")
+        # Called with (kind, frame) for every batch of changes written
+        self.listeners: List[Callable[[str, pd.DataFrame], None]] = []
+        self._lock = threading.Lock()
+        self._containers: Optional[Dict] = None
+
+    def containers(self) -> Dict:
+        """The handler's containers through a client of the sync's own.
+
+        The change-feed continuation is read from the client's last response
+        headers, which the dashboard's concurrent queries on the handler's
+        client would overwrite.
+        """
+        if self._containers is None:
+            from azure.cosmos import CosmosClient
+            client = CosmosClient(os.getenv("AZURE_COSMOS_DB_ENDPOINT"), os.getenv("AZURE_COSMOS_DB_KEY"))
+            database = client.get_database_client(self.handler.database.id)
+            self._containers = {
+                "chat": database.get_container_client(self.handler.chat_container.id),
+                "sql": database.get_container_client(self.handler.sql_container.id)
+            }
+        return self._containers
+
+    def load_state(self) -> Dict:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_state(self, state: Dict):
+        os.makedirs(self.root, exist_ok=True)
+        tmp_path = self.state_path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f, indent=2)
+        os.replace(tmp_path, self.state_path)
+
+    def sync_once(self) -> Dict[str, int]:
+        """Pull all changes since the last sync; returns changed records per kind"""
+        with self._lock:
+            state = self.load_state()
+            changed = {}
+            for kind, container in self.containers().items():
+                entry = state.get(kind, {})
+                container_id = getattr(container, "id", None)
+                # Tokens are only valid for their own container, e.g. not after a migration
+                token = entry.get("continuation") if entry.get("container") in (None, container_id) else None
+                count, token = self._sync_container(kind, container, token)
+                state[kind] = {"container": container_id, "continuation": token,
+                               "synced_at": datetime.now(timezone.utc).isoformat()}
+                changed[kind] = count
+                self._prune(kind)
+            self._save_state(state)
+            return changed
+
+    def _prune(self, kind: str, days: int = LOG_RETENTION_DAYS):
+        """Remove the day files whose records have expired in Cosmos DB"""
+        if days <= 0:
+            return
+        cutoff = (datetime.now(timezone.utc) - timedelta(days=days)).strftime("%Y-%m-%d")
+        try:
+            entries = list(os.scandir(os.path.join(self.root, kind)))
+        except FileNotFoundError:
+            return
+        for entry in entries:
+            if entry.is_dir() and entry.name.startswith("day=") and entry.name[4:] < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+
+    def _sync_container(self, kind: str, container, token: Optional[str]):
+        options = {"continuation": token} if token else {"start_time": "Beginning"}
+        pending: List[Dict] = []
+        count = 0
+        for doc in container.query_items_change_feed(max_item_count=1000, **options):
+            doc.pop("embedding", None)
+            doc.pop("embeddingBits", None)
+            pending.append(doc)
+            if len(pending) >= self.flush_rows:
+                count += self._merge(kind, pending)
+                pending = []
+        if pending:
+            count += self._merge(kind, pending)
+        # The etag of the last change-feed response is the continuation token; only
+        # this thread uses the sync's client, see containers()
+        new_token = container.client_connection.last_response_headers.get("etag") or token
+        return count, new_token
+
+    def _merge(self, kind: str, records: List[Dict]) -> int:
+        df = _to_frame(kind, records)
+        invalid = df["timestamp"].isna()
+        if invalid.any():
+            self.logger.warning(f"Skipping {int(invalid.sum())} {kind} records without a valid timestamp")
+            df = df[~invalid]
+
+        for day, rows in df.groupby(df["timestamp"].dt.strftime("%Y-%m-%d")):
+            path = os.path.join(self.root, kind, f"day={day}", "data.parquet")
+            if os.path.exists(path):
+                rows = pd.concat([pq.read_table(path).to_pandas(), rows], ignore_index=True)
+            rows = rows.drop_duplicates(subset="id", keep="last").sort_values("timestamp")
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # The leading underscore keeps readers from picking up a half-written file
+            tmp_path = os.path.join(os.path.dirname(path), "_data.parquet.tmp")
+            pq.write_table(pa.Table.from_pandas(rows, schema=SNAPSHOT_SCHEMAS[kind], preserve_index=False), tmp_path)
+            os.replace(tmp_path, path)
+        for listener in self.listeners:
+            listener(kind, df)
+        return len(df)
+
+    def run_forever(self, interval: float, on_sync: Optional[Callable[[Dict[str, int]], None]] = None):
+        while True:
+            try:
+                changed = self.sync_once()
+                if any(changed.values()):
+                    self.logger.info(f"Analytics snapshot synced: {changed}")
+                if on_sync is not None:
+                    on_sync(changed)
+            except Exception as e:
+                self.logger.error(f"Analytics snapshot sync failed: {str(e)}")
+            time.sleep(interval)
+
+
+class AnalyticsSnapshot:
+    """Read side of the Parquet snapshot.
+
+    Each day file's modification time is its high-water mark: a refresh
+    only re-reads the days the sync has touched since the previous one
+    (normally just today), so its cost follows new activity rather than
+    the size of the history.
+    """
+
+    def __init__(self, root: Optional[str] = None):
+        self.root = root or os.getenv("ANALYTICS_SNAPSHOT_DIR", "analytics_snapshot")
+        self.state_path = os.path.join(self.root, "_state.json")
+        # kind -> day -> (mtime_ns, frame)
+        self._parts: Dict[str, Dict[str, Tuple[int, pd.DataFrame]]] = {}
+        self._frames: Dict[str, pd.DataFrame] = {}
+        self._seen: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def _version(self) -> Optional[int]:
+        try:
+            return os.stat(self.state_path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def synced_at(self, kind: str) -> Optional[str]:
+        try:
+            with open(self.state_path, "r", encoding="utf-8") as f:
+                return json.load(f).get(kind, {}).get("synced_at")
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def _day_files(self, kind: str) -> Dict[str, Tuple[str, int]]:
+        files = {}
+        try:
+            entries = list(os.scandir(os.path.join(self.root, kind)))
+        except FileNotFoundError:
+            return files
+        for entry in entries:
+            if entry.is_dir() and entry.name.startswith("day="):
+                path = os.path.join(entry.path, "data.parquet")
+                try:
+                    files[entry.name[4:]] = (path, os.stat(path).st_mtime_ns)
+                except FileNotFoundError:
+                    continue
+        return files
+
+    def refresh(self, kind: str) -> Optional[List[str]]:
+        """Load days changed since the last refresh; None before the first sync"""
+        with self._lock:
+            version = self._version()
+            if version is None:
+                return None
+            if self._seen.get(kind) == version:
+                return []
+
+            parts = self._parts.setdefault(kind, {})
+            on_disk = self._day_files(kind)
+            changed = [day for day, (_, mtime) in on_disk.items() if parts.get(day, (None,))[0] != mtime]
+            removed = [day for day in parts if day not in on_disk]
+            for day in removed:
+                del parts[day]
+            for day in changed:
+                path, mtime = on_disk[day]
+                df = pq.read_table(path, schema=SNAPSHOT_SCHEMAS[kind]).to_pandas()
+                if kind == "sql":
+                    df = _fill_fingerprints(df)
+                df["day"] = day
+                parts[day] = (mtime, df)
+            if changed or removed:
+                self._frames.pop(kind, None)
+            self._seen[kind] = version
+            return changed + removed
+
+    def partitions(self, kind: str) -> Dict[str, Tuple[int, pd.DataFrame]]:
+        """Loaded day frames with their modification times, oldest day first"""
+        with self._lock:
+            return dict(sorted(self._parts.get(kind, {}).items()))
+
+    def _concat(self, kind: str, frames: List[pd.DataFrame]) -> pd.DataFrame:
+        if frames:
+            return pd.concat(frames, ignore_index=True)
+        df = pd.DataFrame({name: pd.Series(dtype=object) for name in SNAPSHOT_SCHEMAS[kind].names + ["day"]})
+        df["timestamp"] = pd.to_datetime(df["timestamp"], utc=True)
+        return df
+
+    def frame(self, kind: str) -> Optional[pd.DataFrame]:
+        """All records of a kind, or None before the first sync has finished"""
+        if self.refresh(kind) is None:
+            return None
+        with self._lock:
+            if kind not in self._frames:
+                self._frames[kind] = self._concat(kind, [df for _, (_, df) in sorted(self._parts.get(kind, {}).items())])
+            return self._frames[kind]
+
+    def since(self, kind: str, day: str) -> pd.DataFrame:
+        """Records of the loaded days from the given day on"""
+        return self._concat(kind, [df for d, (_, df) in self.partitions(kind).items() if d >= day])
+
+    def latest(self, kind: str, limit: int, select: Optional[Callable] = None) -> pd.DataFrame:
+        """Newest records (optionally filtered), reading back only as many days as needed"""
+        frames, found = [], 0
+        for _, (_, df) in reversed(list(self.partitions(kind).items())):
+            rows = select(df) if select else df
+            frames.append(rows)
+            found += len(rows)
+            if found >= limit:
+                break
+        return self._concat(kind, frames).nlargest(limit, "timestamp")
+
+
+class SnapshotAggregates:
+    """Counters over one snapshot kind, kept per day.
+
+    summarize(frame) returns a dict of Counters for one day. When a day
+    changes only its partial is subtracted and recounted, so the totals
+    never need a pass over the whole history.
+    """
+
+    def __init__(self, snapshot: AnalyticsSnapshot, kind: str, summarize: Callable[[pd.DataFrame], Dict[str, Counter]]):
+        self.snapshot = snapshot
+        self.kind = kind
+        self.summarize = summarize
+        self._partials: Dict[str, Tuple[int, Dict[str, Counter]]] = {}
+        self._totals: Dict[str, Counter] = defaultdict(Counter)
+        self._lock = threading.Lock()
+
+    def get(self) -> Dict[str, Counter]:
+        """Current totals; call snapshot.refresh(kind) first to pick up new days"""
+        with self._lock:
+            parts = self.snapshot.partitions(self.kind)
+            for day in list(self._partials):
+                if day not in parts or parts[day][0] != self._partials[day][0]:
+                    self._apply(self._partials.pop(day)[1], -1)
+            for day, (mtime, df) in parts.items():
+                if day not in self._partials:
+                    partial = self.summarize(df)
+                    self._partials[day] = (mtime, partial)
+                    self._apply(partial, 1)
+            return self._totals
+
+    def _apply(self, partial: Dict[str, Counter], sign: int):
+        for name, counter in partial.items():
+            total = self._totals[name]
+            for key, n in counter.items():
+                total[key] += sign * n
+                if total[key] <= 0:
+                    del total[key]
+
+
+class SnapshotPartials:
+    """Per-day summaries of one snapshot kind that cannot simply be added up
+    (e.g. latency histograms); only days that changed are summarized again"""
+
+    def __init__(self, snapshot: AnalyticsSnapshot, kind: str, summarize: Callable[[pd.DataFrame], Any]):
+        self.snapshot = snapshot
+        self.kind = kind
+        self.summarize = summarize
+        self._partials: Dict[str, Tuple[int, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, since: Optional[str] = None) -> Dict[str, Any]:
+        """Summaries of the loaded days from the given day on, oldest first"""
+        with self._lock:
+            parts = self.snapshot.partitions(self.kind)
+            for day in [day for day in self._partials if day not in parts]:
+                del self._partials[day]
+            for day, (mtime, df) in parts.items():
+                if since is not None and day < since:
+                    continue
+                if self._partials.get(day, (None,))[0] != mtime:
+                    self._partials[day] = (mtime, self.summarize(df))
+            return {day: partial for day, (_, partial) in sorted(self._partials.items())
+                    if since is None or day >= since}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mirror chat logs into local Parquet files")
+    parser.add_argument("--interval", type=float, default=0, help="Seconds between syncs (0 = sync once)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger = logging.getLogger(__name__)
+    from CosmosDBHandlers.cosmosChatHistoryHandler import ChatMemoryHandlerForAnalytics
+    sync = ParquetSnapshotSync(ChatMemoryHandlerForAnalytics(logger=logger), logger=logger)
+    if args.interval > 0:
+        sync.run_forever(args.interval)
+    else:
+        logger.info(f"Analytics snapshot synced: {sync.sync_once()}")
+
+
+if __name__ == "__main__":
+    main()
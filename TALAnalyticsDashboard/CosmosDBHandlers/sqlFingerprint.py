@@ -0,0 +1,105 @@
+# sqlFingerprint.py
+"""Normalized shapes of generated Cosmos DB SQL.
+
+Two queries that differ only in their literal values, whitespace or
+keyword case get the same shape, e.g.
+
+    select top 5 * from c where c.power >= 60 and c.type = 'LED'
+    SELECT TOP 10 *  FROM c WHERE c.power >= 100 AND c.type = "CC"
+
+both become
+
+    SELECT TOP ? * FROM c WHERE c.power >= ? AND c.type = ?
+
+and the fingerprint is a short hash of that shape. Counting records per
+fingerprint shows which query shapes fail and which are hot enough to be
+worth caching or indexing.
+"""
+import hashlib
+import re
+from typing import Dict, Optional
+
+KEYWORDS = {
+    "SELECT", "VALUE", "DISTINCT", "TOP", "FROM", "WHERE", "AND", "OR", "NOT", "IN", "BETWEEN",
+    "LIKE", "ESCAPE", "IS", "NULL", "UNDEFINED", "AS", "JOIN", "ORDER", "BY", "ASC", "DESC",
+    "GROUP", "OFFSET", "LIMIT", "EXISTS", "ARRAY", "RANK"
+}
+# Boolean literals are values like any other and are masked too
+MASKED_WORDS = {"TRUE", "FALSE"}
+
+_TOKEN = re.compile(r"""
+    (?P<comment>--[^\n]*|/\*.*?(?:\*/|$))
+  | (?P<string>'(?:[^'\\]|\\.|'')*(?:'|$)|"(?:[^"\\]|\\.)*(?:"|$))
+  | (?P<number>(?<![\w.])(?:\d+\.?\d*|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<param>@\w+)
+  | (?P<word>[A-Za-z_]\w*)
+  | (?P<space>\s+)
+  | (?P<op><=|>=|!=|<>|\?\?|\|\||.)
+""", re.VERBOSE | re.DOTALL)
+
+# A run of masked values, e.g. IN ('a', 'b', 'c') or ARRAY_CONTAINS(["a", "b"], ...)
+_VALUE_LIST = re.compile(r"\?(?:, \?)+")
+# Cosmos DB reports parse and semantic errors as {"code": "SC2001", "message": "..."}
+_ERROR_DETAIL = re.compile(r'"code"\s*:\s*"(\w+)"\s*,\s*"message"\s*:\s*"((?:[^"\\]|\\.)*)"')
+_QUOTED = re.compile(r"'[^']*'|\"[^\"]*\"|\b\d+\b")
+
+
+def normalize_sql(sql: str) -> str:
+    """Shape of a query: literals replaced by ?, keywords upper-cased, whitespace collapsed"""
+    out = []
+    tokens = [(m.lastgroup, m.group()) for m in _TOKEN.finditer(sql or "")]
+    tokens = [(kind, text) for kind, text in tokens if kind not in ("space", "comment")]
+    for i, (kind, text) in enumerate(tokens):
+        prev = out[-1] if out else ""
+        following = tokens[i + 1][1] if i + 1 < len(tokens) else ""
+        if kind == "string":
+            # c["name"] is a property access, not a value
+            accessor = prev == "[" and len(out) > 1 and (out[-2][-1:].isalnum() or out[-2] in ("]", ")"))
+            token = text if accessor else "?"
+        elif kind == "number":
+            token = "?"
+        elif kind == "word":
+            upper = text.upper()
+            if upper in MASKED_WORDS:
+                token = "?"
+            elif upper in KEYWORDS or (following == "(" and prev != "."):
+                # System functions are case-insensitive as well
+                token = upper
+            else:
+                token = text
+        else:
+            token = text
+
+        if out and not (prev in (".", "(", "[") or token in (".", ",", ")", "]")
+                        or (token in ("(", "[") and (prev[-1:].isalnum() or prev in (")", "]"))
+                            and prev.upper() not in KEYWORDS)):
+            out.append(" ")
+        out.append(token)
+    shape = "".join(out)
+    return _VALUE_LIST.sub("?, ...", shape)
+
+
+def fingerprint_sql(sql: str) -> Dict[str, str]:
+    """{"fingerprint": 16 hex characters, "shape": normalized query}"""
+    shape = normalize_sql(sql)
+    fingerprint = hashlib.blake2b(shape.encode("utf-8"), digest_size=8).hexdigest()
+    return {"fingerprint": fingerprint, "shape": shape}
+
+
+def error_class(state: str, error: Optional[object] = None) -> Optional[str]:
+    """Failure class of a logged generation: the Cosmos DB error code and message
+    with names and values masked, "no results" for empty results, None on success"""
+    if state == "success":
+        return None
+    if state == "null":
+        return "no results"
+    if error is None:
+        return "unclassified"
+    message = getattr(error, "message", None) or str(error)
+    detail = _ERROR_DETAIL.search(message)
+    if detail:
+        code, text = detail.groups()
+        return f"{code}: {_QUOTED.sub('?', text)}"
+    status = getattr(error, "status_code", None)
+    first_line = _QUOTED.sub("?", message.strip().splitlines()[0] if message.strip() else "")[:120]
+    return f"{status}: {first_line}" if status else first_line or "unclassified"
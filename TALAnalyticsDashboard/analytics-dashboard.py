@@ -1,51 +1,195 @@
 import gradio as gr
 import pandas as pd
 import asyncio
+import json
+import logging
+import os
+import threading
+from collections import Counter
+from contextvars import ContextVar
 from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional, Tuple
 import plotly.express as px
 import plotly.graph_objects as go
-from CosmosDBHandlers.cosmosChatHistoryHandler import ChatMemoryHandlerForAnalytics
+from CosmosDBHandlers.cosmosChatHistoryHandler import ChatMemoryHandlerForAnalytics, TOKEN_METRICS, SOURCE_TOKEN_METRICS
+from CosmosDBHandlers.containerPolicies import LOG_RETENTION_DAYS
+from CosmosDBHandlers.parquetSnapshot import AnalyticsSnapshot, ParquetSnapshotSync, SnapshotAggregates, SnapshotPartials
+from CosmosDBHandlers.liveAnalytics import LiveAnalytics
+from CosmosDBHandlers.latencyHistogram import LatencyHistogram
+
+# Seconds between change-feed syncs of the local Parquet snapshot (0 = synced elsewhere)
+ANALYTICS_SYNC_SECONDS = float(os.getenv("ANALYTICS_SYNC_SECONDS", "5"))
+# How often open dashboards check the in-memory state for changes
+DASHBOARD_POLL_SECONDS = float(os.getenv("DASHBOARD_POLL_SECONDS", "5"))
+# Week-over-week change of a function's p95 latency flagged as a regression (0.2 = 20%)
+LATENCY_REGRESSION_BAND = float(os.getenv("LATENCY_REGRESSION_BAND", "0.2"))
+# Functions with fewer requests in either week are not compared
+LATENCY_MIN_SAMPLES = int(os.getenv("LATENCY_MIN_SAMPLES", "20"))
+# The regression table compares the last week with the week before
+LATENCY_REGRESSION_DAYS = 14
+PERCENTILES = (('p50', 0.5), ('p95', 0.95), ('p99', 0.99))
+
+# Datasets fetched during the current refresh, shared by all widgets
+_refresh_cache: ContextVar[Optional[Dict]] = ContextVar("refresh_cache", default=None)
+
+
+def from_snapshot(days: int) -> bool:
+    """Whether the snapshot still has every raw record of the range; once
+    LOG_RETENTION_DAYS expires them, longer ranges come from the daily rollups"""
+    return not LOG_RETENTION_DAYS or days <= LOG_RETENTION_DAYS
+
+
+def cached(key: str, fetch, *args):
+    """Await fetch(*args) at most once per dashboard refresh"""
+    cache = _refresh_cache.get()
+    if cache is None:
+        return fetch(*args)
+    if key not in cache:
+        cache[key] = asyncio.ensure_future(fetch(*args))
+    return cache[key]
+
+
+def summarize_chats(df: pd.DataFrame) -> Dict[str, Counter]:
+    """Per-day chat counters, merged by SnapshotAggregates"""
+    return {
+        'total': Counter({'chats': len(df)}),
+        'functions': Counter(df['functionUsed'].fillna('None').value_counts().to_dict()),
+        'sessions': Counter(df['sessionId'].dropna().value_counts().to_dict())
+    }
+
+
+def summarize_sql(df: pd.DataFrame) -> Dict[str, Counter]:
+    """Per-day SQL generation counters, merged by SnapshotAggregates"""
+    df = df.fillna({'fingerprint': '', 'shape': '', 'errorClass': ''})
+    failed = df[df['state'] != 'success']
+    return {
+        'total': Counter({'queries': len(df)}),
+        'states': Counter(df['state'].fillna('None').value_counts().to_dict()),
+        'questions': Counter(df['originalQuestion'].dropna().value_counts().to_dict()),
+        'shapes': Counter(df.groupby(['fingerprint', 'shape']).size().to_dict()),
+        'shape_failures': Counter(failed.groupby(['fingerprint', 'shape']).size().to_dict()),
+        'failures': Counter(failed.groupby(['state', 'errorClass', 'fingerprint']).size().to_dict())
+    }
+
+
+def summarize_costs(df: pd.DataFrame) -> Dict[str, Counter]:
+    """Per-day token and cost sums keyed by (day, function), and by (day, source)"""
+    rows = df.assign(functionUsed=df['functionUsed'].fillna('None'), requests=1)
+    sums = rows.groupby(['day', 'functionUsed'])[['requests', *TOKEN_METRICS]].sum()
+    summary = {
+        metric: Counter({key: value for key, value in sums[metric].items() if value})
+        for metric in ['requests', *TOKEN_METRICS]
+    }
+    sources = Counter()
+    for day, usage in zip(rows['day'], rows['tokensBySource']):
+        if isinstance(usage, str):
+            for source in json.loads(usage):
+                for metric in ('calls', *SOURCE_TOKEN_METRICS):
+                    sources[(day, source['source'], metric)] += source.get(metric) or 0
+    summary['sources'] = sources
+    return summary
+
+
+def summarize_latency(df: pd.DataFrame) -> Dict[str, Dict[Tuple, LatencyHistogram]]:
+    """Per-day latency histograms keyed by (period, scope, name, tier), for each
+    15-minute period ("quarter") and for the whole day, like the latency rollups"""
+    rows = df[df['latencyMs'].notna()]
+    histograms = {'quarter': {}, 'day': {}}
+    day = pd.Timestamp(df['day'].iloc[0], tz='UTC') if len(df) else None
+    # Same key values as the rollups, which store str(value)
+    functions = rows['functionUsed'].map(str)
+    tiers = rows['tier'].map(str)
+    for period, function, tier, ms, tools in zip(rows['timestamp'].dt.floor('15min'), functions, tiers,
+                                                 rows['latencyMs'], rows['toolLatencyMs']):
+        measurements = [('functions', function, ms)]
+        if isinstance(tools, str):
+            measurements += [('tools', tool, tool_ms) for tool, tool_ms in json.loads(tools).items()]
+        for scope, name, value in measurements:
+            for granularity, key in (('quarter', period), ('day', day)):
+                histograms[granularity].setdefault((key, scope, name, tier), LatencyHistogram()).add(value)
+    return histograms
+
+
+def merge_histograms(histograms, key) -> Dict[Tuple, LatencyHistogram]:
+    """Merge histograms whose key(k) is equal, e.g. across tiers or into longer periods"""
+    merged = {}
+    for k, histogram in histograms.items():
+        target = key(k)
+        if target not in merged:
+            merged[target] = LatencyHistogram(histogram.accuracy)
+        merged[target].merge(histogram)
+    return merged
+
+
+SQL_RECORD_COLUMNS = ['originalQuestion', 'generatedSql', 'state', 'timestamp']
+SQL_EXAMPLE_COLUMNS = ['originalQuestion', 'generatedSql', 'error', 'timestamp']
+
 
 class ChatAnalyticsDashboard:
     def __init__(self):
-        self.handler = ChatMemoryHandlerForAnalytics()
-        
+        self.handler = ChatMemoryHandlerForAnalytics(logger=logging.getLogger(__name__))
+        # Until the first sync has finished, queries fall back to Cosmos DB
+        self.snapshot = AnalyticsSnapshot()
+        self.snapshot_sync = ParquetSnapshotSync(self.handler, logger=logging.getLogger(__name__))
+        self.chat_totals = SnapshotAggregates(self.snapshot, "chat", summarize_chats)
+        self.sql_totals = SnapshotAggregates(self.snapshot, "sql", summarize_sql)
+        self.latency_partials = SnapshotPartials(self.snapshot, "chat", summarize_latency)
+        self.cost_totals = SnapshotAggregates(self.snapshot, "chat", summarize_costs)
+        self.live = LiveAnalytics(self.snapshot, {"chat": self.chat_totals, "sql": self.sql_totals},
+                                  logger=logging.getLogger(__name__))
+        self.snapshot_sync.listeners.append(self.live.on_records)
+
+    def start_snapshot_sync(self):
+        """Keep the local Parquet snapshot current from the change feed"""
+        if ANALYTICS_SYNC_SECONDS > 0:
+            threading.Thread(
+                target=self.snapshot_sync.run_forever, args=(ANALYTICS_SYNC_SECONDS, self.live.on_sync), daemon=True
+            ).start()
+
+    def get_snapshot_status(self):
+        synced_at = self.snapshot.synced_at("chat")
+        if synced_at is None:
+            return "**Data:** live from Cosmos DB (local snapshot not synced yet)"
+        synced = datetime.fromisoformat(synced_at).strftime('%Y-%m-%d %H:%M:%S')
+        return f"**Data:** local snapshot, synced {synced} UTC"
+
+    async def snapshot_ready(self, kind: str) -> bool:
+        """Load snapshot days changed since the last refresh (once per refresh)"""
+        changed = await cached(f"snapshot:{kind}", asyncio.to_thread, self.snapshot.refresh, kind)
+        return changed is not None
+
+    def latest(self, kind: str, limit: int, columns, select=None) -> pd.DataFrame:
+        """Newest records from the live ring buffers, or the snapshot when it is synced elsewhere"""
+        if self.live.running:
+            return self.live.recent_frame(kind, limit, columns)
+        source = "sql" if kind == "sql_failed" else kind
+        return self.snapshot.latest(source, limit, select)[columns]
+
     async def get_chat_statistics(self):
-        """Get basic chat statistics - Fixed version"""
+        """Get basic chat statistics from the snapshot, or the materialized rollup.
+        Once raw records expire only the rollup still covers all time."""
         try:
-            # Get total chats - this works
-            total_query = "SELECT VALUE COUNT(1) FROM c"
-            total_chats = list(self.handler.chat_container.query_items(
-                query=total_query,
-                enable_cross_partition_query=True
-            ))[0]
-            
-            # Get unique sessions - fetch all and count in Python
-            session_query = "SELECT c.sessionId FROM c"
-            session_results = list(self.handler.chat_container.query_items(
-                query=session_query,
-                enable_cross_partition_query=True
-            ))
-            unique_sessions = len(set(item['sessionId'] for item in session_results))
-            
-            # Get function usage - fetch all and group in Python
-            function_query = "SELECT c.functionUsed FROM c"
-            function_results = list(self.handler.chat_container.query_items(
-                query=function_query,
-                enable_cross_partition_query=True
-            ))
-            
-            # Count function usage in Python
-            from collections import Counter
-            function_counts = Counter(item['functionUsed'] for item in function_results)
+            if not LOG_RETENTION_DAYS and await self.snapshot_ready("chat"):
+                totals = await asyncio.to_thread(self.chat_totals.get)
+                return {
+                    'total_chats': totals['total']['chats'],
+                    'unique_sessions': len(totals['sessions']),
+                    'function_usage': [
+                        {'functionUsed': func, 'count': count} for func, count in totals['functions'].items()
+                    ]
+                }
+
+            rollup = await self.handler.get_rollup("chat")
+            if rollup is None:
+                return {'total_chats': 0, 'unique_sessions': 0, 'function_usage': []}
+
             function_usage = [
-                {'functionUsed': func, 'count': count} 
-                for func, count in function_counts.items()
+                {'functionUsed': func, 'count': count}
+                for func, count in rollup.get("counts", {}).get("functionUsed", {}).items()
             ]
-            
             return {
-                'total_chats': total_chats,
-                'unique_sessions': unique_sessions,
+                'total_chats': rollup.get("total", 0),
+                'unique_sessions': self.handler.count_sessions(rollup),
                 'function_usage': function_usage
             }
         except Exception as e:
@@ -55,16 +199,22 @@ class ChatAnalyticsDashboard:
     async def get_recent_chats(self, limit=10):
         """Get recent chat interactions"""
         try:
+            if await self.snapshot_ready("chat"):
+                recent = self.latest("chat", limit, ['sessionId', 'question', 'functionUsed', 'answer', 'timestamp'])
+                recent = recent.assign(timestamp=recent['timestamp'].map(lambda ts: ts.isoformat()))
+                return recent.to_dict('records')
+
             query = f"""
             SELECT TOP {limit} c.sessionId, c.question, c.functionUsed, c.answer, c.timestamp
             FROM c
             ORDER BY c.timestamp DESC
             """
             
-            results = list(self.handler.chat_container.query_items(
+            results = await self.handler.run_query(
+                self.handler.chat_container,
                 query=query,
                 enable_cross_partition_query=True
-            ))
+            )
             
             return results
         except Exception as e:
@@ -72,58 +222,211 @@ class ChatAnalyticsDashboard:
             return []
 
     async def get_chat_timeline(self, days=7):
-        """Enhanced timeline data with minute-level precision"""
+        """Chat counts per period and function: 15-minute buckets for one day, else daily"""
         try:
-            start_date = (datetime.now(timezone.utc) - timedelta(days=days)).isoformat()
-            
-            query = f"""
-            SELECT c.timestamp, c.functionUsed 
-            FROM c 
-            WHERE c.timestamp >= '{start_date}'
-            ORDER BY c.timestamp
+            if from_snapshot(days) and await self.snapshot_ready("chat"):
+                start = pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=days)
+                df = self.snapshot.since("chat", start.strftime('%Y-%m-%d'))
+                recent = df[df['timestamp'] >= start]
+                period = recent['timestamp'].dt.floor('15min' if days <= 1 else 'D')
+                counts = recent.groupby([period, recent['functionUsed'].fillna('None')]).size()
+                return [
+                    {'period': p, 'category': category, 'count': int(n)}
+                    for (p, category), n in counts.items()
+                ]
+
+            return await self.handler.get_timeline("chat", days)
+        except Exception as e:
+            print(f"Error getting timeline: {e}")
+            return []
+        
+    async def get_tier_statistics(self):
+        """Latency and token usage per model tier (rules / local / azure)"""
+        try:
+            if await self.snapshot_ready("chat"):
+                df = await asyncio.to_thread(self.snapshot.frame, "chat")
+                columns = ['tier', 'escalationReason', 'latencyMs', 'promptTokens', 'completionTokens',
+                           'localPromptTokens', 'localCompletionTokens']
+                return df.loc[df['tier'].notna(), columns].to_dict('records')
+
+            query = """
+            SELECT c.tier, c.escalationReason, c.latencyMs, c.promptTokens, c.completionTokens,
+                   c.localPromptTokens, c.localCompletionTokens
+            FROM c
+            WHERE IS_DEFINED(c.tier) AND NOT IS_NULL(c.tier)
             """
-            
-            results = list(self.handler.chat_container.query_items(
+            results = await self.handler.run_query(
+                self.handler.chat_container,
                 query=query,
                 enable_cross_partition_query=True
-            ))
-            
-            # Process for timeline with minute precision
-            timeline_data = []
-            for item in results:
-                date = datetime.fromisoformat(item['timestamp'].replace('Z', '+00:00'))
-                timeline_data.append({
-                    'date': date.strftime('%Y-%m-%d'),
-                    'hour': date.hour,
-                    'minute': date.minute,
-                    'datetime': date,
-                    'function': item['functionUsed']
-                })
-            
-            return timeline_data
+            )
+            return results
         except Exception as e:
-            print(f"Error getting timeline: {e}")
+            print(f"Error getting tier statistics: {e}")
             return []
-        
+
+    async def get_latency_histograms(self, days=7) -> Dict[Tuple, LatencyHistogram]:
+        """Latency histograms keyed by (period, scope, name, tier): 15-minute periods
+        for one day, else daily; from the snapshot for recent ranges, else the latency rollups"""
+        start = pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=days)
+        if days <= 1:
+            start = start.floor('15min')
+        else:
+            start = start.floor('D')
+
+        if from_snapshot(days) and await self.snapshot_ready("chat"):
+            partials = await asyncio.to_thread(self.latency_partials.get, start.strftime('%Y-%m-%d'))
+            granularity = 'quarter' if days <= 1 else 'day'
+            return {
+                k: histogram for partial in partials.values()
+                for k, histogram in partial[granularity].items() if k[0] >= start
+            }
+
+        if days <= 1:
+            # Per-minute rollups merged into the 15-minute periods of the timeline
+            minutes = await self.handler.get_latency_histograms('minute', start.strftime('%Y-%m-%dT%H:%M'))
+            return merge_histograms(
+                minutes,
+                lambda k: (pd.Timestamp(k[0], tz='UTC').floor('15min'), *k[1:])
+            )
+        daily = await self.handler.get_latency_histograms('day', start.strftime('%Y-%m-%d'))
+        return {(pd.Timestamp(k[0], tz='UTC'), *k[1:]): histogram for k, histogram in daily.items()}
+
+    async def get_latency_regressions(self):
+        """p95 per function and tier over the last 7 days against the 7 days before"""
+        histograms = await cached(f"latency:{LATENCY_REGRESSION_DAYS}", self.get_latency_histograms, LATENCY_REGRESSION_DAYS)
+        week_start = pd.Timestamp.now(tz='UTC').floor('D') - pd.Timedelta(days=6)
+        weekly = merge_histograms(
+            histograms,
+            lambda k: ('current' if k[0] >= week_start else 'previous', *k[1:])
+        )
+        rows = []
+        for (week, scope, name, tier), current in weekly.items():
+            if week != 'current':
+                continue
+            previous = weekly.get(('previous', scope, name, tier), LatencyHistogram())
+            p95, previous_p95 = current.quantile(0.95), previous.quantile(0.95)
+            if current.count < LATENCY_MIN_SAMPLES or previous.count < LATENCY_MIN_SAMPLES:
+                status, change = 'too few requests', None
+            else:
+                change = (p95 - previous_p95) / previous_p95
+                if change > LATENCY_REGRESSION_BAND:
+                    status = 'regression'
+                elif change < -LATENCY_REGRESSION_BAND:
+                    status = 'improved'
+                else:
+                    status = 'ok'
+            rows.append({
+                'scope': scope, 'name': name, 'tier': tier, 'requests': current.count,
+                'p95': p95, 'previous_p95': previous_p95, 'change': change, 'status': status
+            })
+        return rows
+
+    async def get_token_usage(self, days=7) -> Dict[str, pd.DataFrame]:
+        """Token and cost sums per day and function, and per prompt source"""
+        start_day = (pd.Timestamp.now(tz='UTC') - pd.Timedelta(days=days)).strftime('%Y-%m-%d')
+        by_function_columns = ['day', 'functionUsed', 'requests', *TOKEN_METRICS]
+        by_source_columns = ['source', 'calls', *SOURCE_TOKEN_METRICS]
+
+        if not from_snapshot(days):
+            usage = await self.handler.get_token_usage_rollups(days)
+            by_function, by_source = usage['by_function'], usage['by_source']
+        elif await self.snapshot_ready("chat"):
+            totals = await asyncio.to_thread(self.cost_totals.get)
+            by_function = {}
+            for metric in ['requests', *TOKEN_METRICS]:
+                for (day, function), value in totals[metric].items():
+                    if day >= start_day:
+                        by_function.setdefault((day, function), {'day': day, 'functionUsed': function})[metric] = value
+            by_source = {}
+            for (day, source, metric), value in totals['sources'].items():
+                if day >= start_day:
+                    row = by_source.setdefault(source, {'source': source})
+                    row[metric] = row.get(metric, 0) + value
+            by_function, by_source = list(by_function.values()), list(by_source.values())
+        else:
+            usage = await self.handler.get_token_usage(days)
+            by_function, by_source = usage['by_function'], usage['by_source']
+
+        return {
+            'by_function': pd.DataFrame(by_function).reindex(columns=by_function_columns).fillna(
+                {column: 0 for column in by_function_columns[2:]}).fillna({'functionUsed': 'None'}),
+            'by_source': pd.DataFrame(by_source).reindex(columns=by_source_columns).fillna(0)
+        }
+
+    async def get_sql_query_statistics(self):
+        """SQL generation statistics from the snapshot, or the materialized rollup"""
+        if LOG_RETENTION_DAYS or not await self.snapshot_ready("sql"):
+            return await self.handler.get_sql_query_statistics()
+
+        totals = await asyncio.to_thread(self.sql_totals.get)
+        total_queries = totals['total']['queries']
+        state_counts = totals['states']
+        return {
+            'total_queries': total_queries,
+            'success_count': state_counts.get('success', 0),
+            'error_count': state_counts.get('error', 0),
+            'null_count': state_counts.get('null', 0),
+            'top_questions': [{'question': q, 'count': c} for q, c in totals['questions'].most_common(10)],
+            'hot_shapes': [
+                {'fingerprint': fingerprint, 'shape': shape, 'count': c,
+                 'failed': totals['shape_failures'].get((fingerprint, shape), 0)}
+                for (fingerprint, shape), c in totals['shapes'].most_common(10)
+            ],
+            'success_rate': (state_counts.get('success', 0) / total_queries * 100) if total_queries > 0 else 0
+        }
+
+    def _sql_records(self, rows: pd.DataFrame):
+        rows = rows.assign(timestamp=rows['timestamp'].map(lambda ts: ts.isoformat()))
+        return rows.fillna('').to_dict('records')
+
+    async def get_recent_sql_queries(self, limit=20):
+        """Latest SQL generations from the snapshot, or Cosmos DB"""
+        if not await self.snapshot_ready("sql"):
+            return await self.handler.get_recent_sql_queries(limit)
+        return self._sql_records(self.latest("sql", limit, SQL_RECORD_COLUMNS))
+
+    async def get_sql_error_analysis(self, limit=10):
+        """Latest failed SQL generations from the snapshot, or Cosmos DB"""
+        if not await self.snapshot_ready("sql"):
+            return await self.handler.get_sql_error_analysis(limit)
+        failed = self.latest("sql_failed", limit, SQL_RECORD_COLUMNS, lambda df: df[df['state'] != 'success'])
+        return self._sql_records(failed)
+
+    async def get_sql_failure_classes(self, limit=10, examples=3):
+        """Failed SQL grouped by error class and query shape, from the snapshot or Cosmos DB"""
+        if not await self.snapshot_ready("sql"):
+            return await self.handler.get_sql_failure_classes(limit, examples)
+
+        totals = await asyncio.to_thread(self.sql_totals.get)
+        shapes = {fingerprint: shape for fingerprint, shape in totals['shapes']}
+        top = totals['failures'].most_common(limit)
+        samples = await asyncio.to_thread(self._failure_examples, [key for key, _ in top], examples)
+        return [
+            {'state': state, 'errorClass': error_class, 'fingerprint': fingerprint,
+             'shape': shapes.get(fingerprint, ''), 'count': count, 'examples': samples[(state, error_class, fingerprint)]}
+            for (state, error_class, fingerprint), count in top
+        ]
+
+    def _failure_examples(self, keys, examples: int) -> Dict:
+        """Latest records of each failure class, reading back only as many days as needed"""
+        found = {key: [] for key in keys}
+        for _, (_, df) in reversed(list(self.snapshot.partitions("sql").items())):
+            if all(len(rows) >= examples for rows in found.values()):
+                break
+            failed = df[df['state'] != 'success'].fillna({'errorClass': '', 'fingerprint': ''})
+            failed = failed.sort_values('timestamp', ascending=False)
+            for key, rows in failed.groupby(['state', 'errorClass', 'fingerprint'], sort=False):
+                if key in found and len(found[key]) < examples:
+                    found[key].extend(self._sql_records(rows.head(examples - len(found[key]))[SQL_EXAMPLE_COLUMNS]))
+        return found
+
 # Initialize dashboard
 dashboard = ChatAnalyticsDashboard()
 
-def sync_wrapper(async_func):
-    """Wrapper to run async functions in Gradio"""
-    def wrapper(*args, **kwargs):
-        try:
-            loop = asyncio.get_running_loop()
-        except RuntimeError:
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-        
-        return loop.run_until_complete(async_func(*args, **kwargs))
-    return wrapper
-
-@sync_wrapper
 async def update_sql_statistics():
     """Update SQL query statistics """
-    stats = await dashboard.handler.get_sql_query_statistics()
+    stats = await dashboard.get_sql_query_statistics()
     
     # Create success rate chart with correct state values
     if stats['total_queries'] > 0:
@@ -153,15 +456,30 @@ async def update_sql_statistics():
         f"**Success Rate:** {stats['success_rate']:.1f}%",
         f"**Error/Null Queries:** {stats['error_count'] + stats['null_count']}",  # Updated label
         state_chart,
-        questions_chart
+        questions_chart,
+        hot_shapes_frame(stats['hot_shapes'])
     )
 
 
+def hot_shapes_frame(shapes):
+    """Most generated query shapes: candidates for caching or a composite index"""
+    if not shapes:
+        return pd.DataFrame({'Message': ['No query shapes recorded yet']})
+    return pd.DataFrame([
+        {
+            'Query Shape': shape['shape'] or '(empty)',
+            'Fingerprint': shape['fingerprint'],
+            'Generations': shape['count'],
+            'Failure Rate': f"{shape.get('failed', 0) / shape['count'] * 100:.0f}%" if shape['count'] else '-'
+        }
+        for shape in shapes
+    ])
+
+
 
-@sync_wrapper
 async def get_recent_sql_queries():
     """Get recent SQL query generations"""
-    recent = await dashboard.handler.get_recent_sql_queries(limit=15)
+    recent = await dashboard.get_recent_sql_queries(limit=15)
     
     if recent:
         recent_data = []
@@ -177,10 +495,9 @@ async def get_recent_sql_queries():
     else:
         return pd.DataFrame({'Message': ['No recent SQL queries']})
 
-@sync_wrapper
 async def get_sql_error_analysis():
     """Get failed SQL query analysis"""
-    errors = await dashboard.handler.get_sql_error_analysis()
+    errors = await dashboard.get_sql_error_analysis()
     
     if errors:
         error_data = []
@@ -196,7 +513,28 @@ async def get_sql_error_analysis():
     else:
         return pd.DataFrame({'Message': ['No failed queries found']})
 
-@sync_wrapper
+async def get_sql_failure_classes():
+    """Failed generations grouped by error class and query shape"""
+    classes = await dashboard.get_sql_failure_classes(limit=10)
+    if not classes:
+        return pd.DataFrame({'Message': ['No failed queries found']})
+
+    rows = []
+    for failure in classes:
+        examples = failure.get('examples') or []
+        questions = [e['originalQuestion'] for e in examples if e.get('originalQuestion')]
+        last_seen = examples[0]['timestamp'] if examples else None
+        rows.append({
+            'Error Class': failure.get('errorClass') or 'unclassified',
+            'State': failure['state'],
+            'Query Shape': (failure.get('shape') or '')[:80] + ('...' if len(failure.get('shape') or '') > 80 else ''),
+            'Count': failure['count'],
+            'Example Questions': ' | '.join(q[:50] for q in questions),
+            'Example SQL': examples[0]['generatedSql'] if examples else '',
+            'Last Seen': datetime.fromisoformat(last_seen.replace('Z', '+00:00')).strftime('%Y-%m-%d %H:%M') if last_seen else ''
+        })
+    return pd.DataFrame(rows)
+
 async def update_statistics():
     """Update dashboard statistics"""
     stats = await dashboard.get_chat_statistics()
@@ -211,12 +549,11 @@ async def update_statistics():
     
     return (
         f"**Total Chats:** {stats['total_chats']}",
-        f"**Unique Sessions:** {stats['unique_sessions']}",
+        f"**Unique Sessions:** ~{stats['unique_sessions']}",
         func_chart
     )
 
 
-@sync_wrapper
 async def update_timeline(days):
     """Enhanced timeline function with adaptive granularity"""
     timeline_data = await dashboard.get_chat_timeline(days)
@@ -232,12 +569,13 @@ async def update_timeline(days):
         empty_fig.update_layout(title="Chat Activity Timeline")
         return empty_fig
     
+    # Rows are already aggregated per period and function; only sum the functions
     df = pd.DataFrame(timeline_data)
+    counts = df.groupby('period')['count'].sum().reset_index().sort_values('period')
     
     if days > 1:
-        # Multi-day view: Group by date for daily line plot
-        daily_counts = df.groupby('date').size().reset_index(name='count')
-        daily_counts['date'] = pd.to_datetime(daily_counts['date'])
+        # Multi-day view: daily line plot
+        daily_counts = counts.rename(columns={'period': 'date'})
         
         timeline_chart = px.line(
             daily_counts, 
@@ -256,14 +594,8 @@ async def update_timeline(days):
         
     # In the single day section of update_timeline:
     else:
-        # Single day view: Group by 15-minute intervals
-        df['datetime'] = pd.to_datetime(df['date'] + ' ' + 
-                                    df['hour'].astype(str) + ':' + 
-                                    df['minute'].astype(str) + ':00')
-        
-        # Create 15-minute intervals
-        df['interval'] = df['datetime'].dt.floor('15min')
-        interval_counts = df.groupby('interval').size().reset_index(name='count')
+        # Single day view: 15-minute buckets
+        interval_counts = counts.rename(columns={'period': 'interval'})
         
         timeline_chart = px.line(
             interval_counts,
@@ -287,7 +619,6 @@ async def update_timeline(days):
     return timeline_chart
 
 
-# @sync_wrapper
 # async def get_faqs():
 #     """Get semantic FAQs"""
 #     faqs = await dashboard.handler.get_semantic_faqs(limit=10)
@@ -304,7 +635,6 @@ async def update_timeline(days):
 #         return pd.DataFrame(faq_data)
 #     else:
 #         return pd.DataFrame({'Message': ['No FAQ data available']})
-@sync_wrapper
 async def get_faqs():
     """Get semantic FAQs with duplicate removal"""
     # Request more items than needed to account for duplicates
@@ -327,7 +657,7 @@ async def get_faqs():
                 seen_questions.add(question)
                 unique_faqs.append({
                     'Question': question[:100] + '...' if len(question) > 100 else question,
-                    'Similar Questions Count': len(faq['similar_questions']),
+                    'Similar Questions Count': faq.get('member_count') or len(faq['similar_questions']),
                     'Total Occurrences': faq['total_occurrences']
                 })
                 
@@ -339,7 +669,6 @@ async def get_faqs():
     else:
         return pd.DataFrame({'Message': ['No FAQ data available']})
 
-@sync_wrapper
 async def get_recent_interactions():
     """Get recent chat interactions"""
     recent = await dashboard.get_recent_chats(limit=20)
@@ -358,6 +687,255 @@ async def get_recent_interactions():
     else:
         return pd.DataFrame({'Message': ['No recent interactions']})
 
+async def get_tier_comparison():
+    """Compare requests, latency and tokens across model tiers"""
+    rows = await dashboard.get_tier_statistics()
+    if not rows:
+        return pd.DataFrame({'Message': ['No tier data yet']}), pd.DataFrame()
+
+    # Cosmos omits undefined fields, so older rows may lack some columns
+    columns = ['tier', 'escalationReason', 'latencyMs', 'promptTokens', 'completionTokens',
+               'localPromptTokens', 'localCompletionTokens']
+    df = pd.DataFrame(rows).reindex(columns=columns)
+    df[columns[2:]] = df[columns[2:]].fillna(0)
+    tiers = df.groupby('tier').agg(
+        Requests=('tier', 'size'),
+        **{'Avg Latency (ms)': ('latencyMs', 'mean'),
+           'p95 Latency (ms)': ('latencyMs', lambda x: x.quantile(0.95)),
+           'Avg Azure Prompt Tokens': ('promptTokens', 'mean'),
+           'Avg Azure Completion Tokens': ('completionTokens', 'mean'),
+           'Avg Local Prompt Tokens': ('localPromptTokens', 'mean'),
+           'Avg Local Completion Tokens': ('localCompletionTokens', 'mean')}
+    ).round(1).reset_index().rename(columns={'tier': 'Tier'})
+
+    reasons = df[df['tier'] == 'azure'].groupby(df['escalationReason'].fillna('unknown')).size()
+    reasons = reasons.sort_values(ascending=False).reset_index()
+    reasons.columns = ['Escalation Reason', 'Requests']
+    return tiers, reasons
+
+def percentile_chart(histograms, scope: str, title: str):
+    """p50/p95/p99 per period, one line per function (tiers merged)"""
+    merged = merge_histograms(
+        {k: h for k, h in histograms.items() if k[1] == scope},
+        lambda k: (k[0], k[2])
+    )
+    if not merged:
+        empty_fig = go.Figure()
+        empty_fig.add_annotation(
+            text="No latency data for selected period",
+            xref="paper", yref="paper",
+            x=0.5, y=0.5, showarrow=False
+        )
+        empty_fig.update_layout(title=title)
+        return empty_fig
+
+    df = pd.DataFrame([
+        {'period': period, 'function': name, 'percentile': label, 'ms': histogram.quantile(q)}
+        for (period, name), histogram in merged.items()
+        for label, q in PERCENTILES
+    ]).sort_values('period')
+    chart = px.line(df, x='period', y='ms', color='function', facet_row='percentile',
+                    markers=True, title=title, category_orders={'percentile': [p for p, _ in PERCENTILES]})
+    chart.update_yaxes(matches=None, title_text="ms")
+    chart.update_layout(xaxis_title="Time", hovermode='x unified', height=700)
+    return chart
+
+
+async def update_latency(days):
+    """Latency percentiles over time, end to end per function used and per tool"""
+    histograms = await cached(f"latency:{days}", dashboard.get_latency_histograms, days)
+    return (
+        percentile_chart(histograms, 'functions', f'End-to-end Latency by Function Used - Last {days} Day(s)'),
+        percentile_chart(histograms, 'tools', f'Time in Kernel Functions (Tools) - Last {days} Day(s)')
+    )
+
+async def get_latency_regressions():
+    """Week-over-week p95 comparison"""
+    rows = await dashboard.get_latency_regressions()
+    if not rows:
+        return pd.DataFrame({'Message': ['No latency data in the last 7 days']})
+
+    status_labels = {'regression': '⚠️ regression', 'improved': '✅ improved', 'ok': 'ok', 'too few requests': 'too few requests'}
+    order = {'regression': 0, 'improved': 1, 'ok': 2, 'too few requests': 3}
+    rows = sorted(rows, key=lambda r: (order[r['status']], -(r['change'] or 0)))
+    return pd.DataFrame([
+        {
+            'Status': status_labels[r['status']],
+            'Function': r['name'],
+            'Kind': 'end to end' if r['scope'] == 'functions' else 'tool',
+            'Tier': r['tier'],
+            'Requests (7d)': r['requests'],
+            'p95 (ms)': round(r['p95']) if r['p95'] is not None else None,
+            'p95 Week Before (ms)': round(r['previous_p95']) if r['previous_p95'] is not None else None,
+            'Change': f"{r['change'] * 100:+.0f}%" if r['change'] is not None else '-'
+        }
+        for r in rows
+    ])
+
+def share(part, whole) -> str:
+    return f"{part / whole * 100:.0f}%" if whole else '-'
+
+
+async def update_costs(days):
+    """Tokens and estimated Azure OpenAI cost per function, day and prompt source"""
+    usage = await dashboard.get_token_usage(days)
+    df, sources = usage['by_function'], usage['by_source']
+    if df.empty:
+        empty_fig = go.Figure()
+        empty_fig.add_annotation(
+            text="No token data for selected period",
+            xref="paper", yref="paper",
+            x=0.5, y=0.5, showarrow=False
+        )
+        empty_fig.update_layout(title="Estimated Cost per Day")
+        message = pd.DataFrame({'Message': ['No token data for selected period']})
+        return "**Estimated Cost:** no data", empty_fig, message, message
+
+    prompt, tool_output = df['promptTokens'].sum(), df['toolOutputTokens'].sum()
+    summary = (
+        f"**Estimated Cost (last {days} days):** ${df['estimatedCostUsd'].sum():,.2f} · "
+        f"**Azure Tokens:** {int(prompt):,} prompt / {int(df['completionTokens'].sum()):,} completion · "
+        f"**Cached:** {share(df['cachedTokens'].sum(), prompt)} · "
+        f"**From Tool Outputs:** {share(tool_output, prompt)} of prompt tokens"
+    )
+
+    daily = df.groupby(['day', 'functionUsed'], as_index=False)['estimatedCostUsd'].sum()
+    cost_chart = px.bar(daily.sort_values('day'), x='day', y='estimatedCostUsd', color='functionUsed',
+                        title=f'Estimated Cost per Day - Last {days} Days')
+    cost_chart.update_layout(xaxis_title="Date", yaxis_title="USD", legend_title="Function")
+
+    per_function = df.groupby('functionUsed').sum(numeric_only=True).sort_values('estimatedCostUsd', ascending=False)
+    function_table = pd.DataFrame([
+        {
+            'Function': function,
+            'Requests': int(row['requests']),
+            'Prompt Tokens': int(row['promptTokens']),
+            'Cached': share(row['cachedTokens'], row['promptTokens']),
+            'Completion Tokens': int(row['completionTokens']),
+            'From Tool Outputs': share(row['toolOutputTokens'], row['promptTokens']),
+            'Local Tokens': int(row['localPromptTokens'] + row['localCompletionTokens']),
+            'Est. Cost (USD)': round(row['estimatedCostUsd'], 4),
+            'Cost / Request (USD)': round(row['estimatedCostUsd'] / row['requests'], 5) if row['requests'] else 0
+        }
+        for function, row in per_function.iterrows()
+    ])
+
+    if sources.empty:
+        source_table = pd.DataFrame({'Message': ['No per-prompt token data yet']})
+    else:
+        source_table = pd.DataFrame([
+            {
+                'Prompt': row['source'],
+                'Model Calls': int(row['calls']),
+                'Prompt Tokens': int(row['promptTokens']),
+                'Cached': share(row['cachedTokens'], row['promptTokens']),
+                'Completion Tokens': int(row['completionTokens']),
+                'From Tool Outputs': share(row['toolOutputTokens'], row['promptTokens']),
+                'Est. Cost (USD)': round(row['estimatedCostUsd'], 4)
+            }
+            for _, row in sources.sort_values('estimatedCostUsd', ascending=False).iterrows()
+        ])
+    return summary, cost_chart, function_table, source_table
+
+async def skip_update(outputs: int = 1):
+    return gr.skip() if outputs == 1 else tuple(gr.skip() for _ in range(outputs))
+
+
+def unavailable_figure(title: str):
+    figure = go.Figure()
+    figure.add_annotation(
+        text="Could not load data",
+        xref="paper", yref="paper",
+        x=0.5, y=0.5, showarrow=False
+    )
+    figure.update_layout(title=title)
+    return figure
+
+def unavailable_table():
+    return pd.DataFrame({'Message': ['Could not load data']})
+
+async def widget(name: str, update, placeholder, live: bool):
+    """Run one widget's update; a failure only affects that widget.
+
+    Live ticks keep the widget's last rendering, other refreshes show the
+    placeholder.
+    """
+    try:
+        return await update
+    except Exception as e:
+        print(f"Error updating {name}: {e}")
+        if live:
+            return tuple(gr.skip() for _ in placeholder) if isinstance(placeholder, tuple) else gr.skip()
+        return placeholder
+
+
+async def refresh_dashboard(days, live=False):
+    """Fetch every dataset concurrently and update all widgets at once.
+
+    Widgets needing the same data (e.g. the chat snapshot) share one fetch
+    through the per-refresh cache, so a refresh takes as long as the
+    slowest query rather than the sum of all of them. A widget whose fetch
+    fails falls back on its own, see widget(). Live updates only re-render
+    what the snapshot covers and skip the widgets read from Cosmos DB: the
+    FAQ table and, with LOG_RETENTION_DAYS set, the all-time totals and
+    ranges longer than the retention window.
+    """
+    rollup_totals = live and bool(LOG_RETENTION_DAYS)
+    rollup_range = live and not from_snapshot(days)
+    rollup_regressions = live and not from_snapshot(LATENCY_REGRESSION_DAYS)
+    token = _refresh_cache.set({})
+    try:
+        (stats, timeline, faqs, recent, (tiers, reasons), sql_stats, recent_sql, sql_errors,
+         failure_classes, latency_charts, regressions, costs, status) = await asyncio.gather(
+            skip_update(3) if rollup_totals else widget(
+                "statistics", update_statistics(),
+                ("**Total Chats:** unavailable", "**Unique Sessions:** unavailable",
+                 unavailable_figure("Function Usage Distribution")), live),
+            skip_update() if rollup_range else widget(
+                "timeline", update_timeline(days), unavailable_figure("Chat Activity Timeline"), live),
+            skip_update() if live else widget("FAQs", get_faqs(), unavailable_table(), live),
+            widget("recent interactions", get_recent_interactions(), unavailable_table(), live),
+            widget("tier comparison", get_tier_comparison(), (unavailable_table(), pd.DataFrame()), live),
+            skip_update(6) if rollup_totals else widget(
+                "SQL statistics", update_sql_statistics(),
+                ("**Total SQL Queries:** unavailable", "**Success Rate:** unavailable",
+                 "**Error/Null Queries:** unavailable", unavailable_figure("SQL Query Success Rate"),
+                 unavailable_figure("Top Generated Queries"), unavailable_table()), live),
+            widget("recent SQL queries", get_recent_sql_queries(), unavailable_table(), live),
+            widget("SQL errors", get_sql_error_analysis(), unavailable_table(), live),
+            widget("SQL failure classes", get_sql_failure_classes(), unavailable_table(), live),
+            skip_update(2) if rollup_range else widget(
+                "latency", update_latency(days),
+                (unavailable_figure("End-to-end Latency by Function Used"),
+                 unavailable_figure("Time in Kernel Functions (Tools)")), live),
+            skip_update() if rollup_regressions else widget(
+                "latency regressions", get_latency_regressions(), unavailable_table(), live),
+            skip_update(4) if rollup_range else widget(
+                "costs", update_costs(days),
+                ("**Estimated Cost:** unavailable", unavailable_figure("Estimated Cost per Day"),
+                 unavailable_table(), unavailable_table()), live),
+            widget("snapshot status", asyncio.to_thread(dashboard.get_snapshot_status), "**Data:** unavailable", live)
+        )
+    finally:
+        _refresh_cache.reset(token)
+
+    total, sessions, function_chart = stats
+    return (
+        total, sessions, status, function_chart, timeline,
+        faqs, recent, tiers, reasons,
+        *sql_stats,
+        recent_sql, sql_errors, failure_classes,
+        *latency_charts, regressions,
+        *costs
+    )
+
+async def live_update(days, seen_version):
+    """Timer tick: re-render from the in-memory state only if the change feed moved it"""
+    version = dashboard.live.version
+    if not dashboard.live.running or version == seen_version:
+        return (*[gr.skip()] * len(dashboard_outputs), seen_version)
+    return (*await refresh_dashboard(days, live=True), version)
+
 theme = gr.themes.Citrus(
     secondary_hue="amber",
     font=[gr.themes.GoogleFont('Inter'), 'ui-sans-serif', 'system-ui', 'sans-serif'],
@@ -373,13 +951,14 @@ with gr.Blocks(theme=theme,
     with gr.Row():
         total_chats = gr.Markdown("**Total Chats:** Loading...")
         unique_sessions = gr.Markdown("**Unique Sessions:** Loading...")
+        snapshot_status = gr.Markdown("**Data:** Loading...")
 
     with gr.Tabs():
         with gr.TabItem("Function Usage Distribution"):
             function_chart = gr.Plot(label="Function Usage Distribution")
 
         with gr.TabItem("📈 Timeline Analysis"):
-            days_slider = gr.Slider(minimum=1, maximum=30, value=7, step=1, 
+            days_slider = gr.Slider(minimum=1, maximum=90, value=7, step=1, 
                                   label="Days to analyze")
             with gr.Row():
                 timeline_plot = gr.Plot(label="Daily Chat Activity")
@@ -390,6 +969,26 @@ with gr.Blocks(theme=theme,
         with gr.TabItem("💬 Recent Interactions"):
             recent_table = gr.DataFrame(label="Recent Chat Interactions", interactive=False)
 
+        with gr.TabItem("⚡ Model Tiers"):
+            tier_table = gr.DataFrame(label="Latency and tokens per tier", interactive=False)
+            escalation_table = gr.DataFrame(label="Why requests escalated to Azure", interactive=False)
+
+        with gr.TabItem("⏱️ Latency"):
+            gr.Markdown(
+                f"p50/p95/p99 from mergeable latency histograms. Regressions: p95 of the last 7 days "
+                f"more than {LATENCY_REGRESSION_BAND:.0%} above the week before."
+            )
+            latency_regression_table = gr.DataFrame(label="Week-over-week p95", interactive=False)
+            latency_function_plot = gr.Plot(label="End-to-end latency by function")
+            latency_tool_plot = gr.Plot(label="Latency by kernel function")
+
+        with gr.TabItem("💰 Tokens & Cost"):
+            cost_summary = gr.Markdown("**Estimated Cost:** Loading...")
+            cost_chart = gr.Plot(label="Estimated cost per day")
+            cost_function_table = gr.DataFrame(label="Tokens and cost per function", interactive=False)
+            cost_source_table = gr.DataFrame(label="Tokens and cost per prompt (main chat, NL2SQL, ...)",
+                                             interactive=False)
+
         with gr.TabItem("🔍 SQL Query Analytics", elem_id="sql-tab"):
             # SQL Statistics Section
             gr.Markdown("### 📊 SQL Generation Statistics")
@@ -407,6 +1006,14 @@ with gr.Blocks(theme=theme,
                     sql_state_chart = gr.Plot(label="SQL Query Success Distribution")
                 with gr.Column(elem_classes="plot-container"):
                     top_questions_chart = gr.Plot(label="Most Generated Queries")
+
+            gr.Markdown("### 🧩 Hot Query Shapes")
+            with gr.Column(elem_classes="plot-container"):
+                hot_shapes_table = gr.DataFrame(
+                    label="Most generated shapes (literals masked) - candidates for caching or indexing",
+                    interactive=False,
+                    elem_classes="dataframe"
+                )
             
             # Recent SQL Queries Section
             gr.Markdown("### 📝 Recent SQL Generations")
@@ -419,6 +1026,12 @@ with gr.Blocks(theme=theme,
             
             # Error Analysis Section
             gr.Markdown("### ⚠️ Failed Query Analysis")
+            with gr.Column(elem_classes="plot-container"):
+                failure_classes_table = gr.DataFrame(
+                    label="Failure classes by error and query shape",
+                    interactive=False,
+                    elem_classes="dataframe"
+                )
             with gr.Column(elem_classes="plot-container"):
                 sql_errors_table = gr.DataFrame(
                     label="Recent Failed SQL Queries", 
@@ -428,32 +1041,31 @@ with gr.Blocks(theme=theme,
     refresh_btn = gr.Button("🔄 Refresh Dashboard", variant="primary")
     
     
-# Update event handlers
-    demo.load(update_sql_statistics, outputs=[total_sql_queries, sql_success_rate, failed_sql_queries, sql_state_chart, top_questions_chart])
-    demo.load(get_recent_sql_queries, outputs=[recent_sql_table])
-    demo.load(get_sql_error_analysis, outputs=[sql_errors_table])
+    # One event refreshes every widget; see refresh_dashboard
+    dashboard_outputs = [
+        total_chats, unique_sessions, snapshot_status, function_chart, timeline_plot,
+        faq_table, recent_table, tier_table, escalation_table,
+        total_sql_queries, sql_success_rate, failed_sql_queries, sql_state_chart, top_questions_chart,
+        hot_shapes_table, recent_sql_table, sql_errors_table, failure_classes_table,
+        latency_function_plot, latency_tool_plot, latency_regression_table,
+        cost_summary, cost_chart, cost_function_table, cost_source_table
+    ]
+    demo.load(refresh_dashboard, inputs=[days_slider], outputs=dashboard_outputs)
+    refresh_btn.click(refresh_dashboard, inputs=[days_slider], outputs=dashboard_outputs)
 
-    refresh_btn.click(update_sql_statistics, outputs=[total_sql_queries, sql_success_rate, failed_sql_queries, sql_state_chart, top_questions_chart])
-    refresh_btn.click(get_recent_sql_queries, outputs=[recent_sql_table])
-    refresh_btn.click(get_sql_error_analysis, outputs=[sql_errors_table])
+    # Each open tab polls memory, never Cosmos DB
+    live_version = gr.State(0)
+    live_timer = gr.Timer(DASHBOARD_POLL_SECONDS)
+    live_timer.tick(live_update, inputs=[days_slider, live_version], outputs=dashboard_outputs + [live_version])
 
     days_slider.change(update_timeline, inputs=[days_slider], 
                         outputs=[timeline_plot])
+    days_slider.change(update_latency, inputs=[days_slider],
+                       outputs=[latency_function_plot, latency_tool_plot])
+    days_slider.change(update_costs, inputs=[days_slider],
+                       outputs=[cost_summary, cost_chart, cost_function_table, cost_source_table])
 
-    # Auto-refresh components
-   
-    # # Event handlers
-    demo.load(update_statistics, outputs=[total_chats, unique_sessions, function_chart])
-    demo.load(lambda: update_timeline(7), outputs=[timeline_plot])
-    demo.load(get_faqs, outputs=[faq_table])
-    demo.load(get_recent_interactions, outputs=[recent_table])
-    
-    refresh_btn.click(update_statistics, outputs=[total_chats, unique_sessions, function_chart])
-    refresh_btn.click(lambda: update_timeline(7), outputs=[timeline_plot])
-    refresh_btn.click(get_faqs, outputs=[faq_table])
-    refresh_btn.click(get_recent_interactions, outputs=[recent_table])
-    
-    
 
 if __name__ == "__main__":
+    dashboard.start_snapshot_sync()
     demo.launch()